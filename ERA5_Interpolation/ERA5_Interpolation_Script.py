@@ -1,79 +1,145 @@
 import os
+import sys
 import numpy as np
 import xarray as xr
-from scipy.interpolate import RegularGridInterpolator
+
+if __package__ in (None, ""):
+    # Allow running this file directly as a script.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ERA5_Interpolation.regrid import target_grid
+from ERA5_Interpolation.regrid_engines import SparseRegridder
+from ERA5_Interpolation.stream_writer import open_stream_writer
+from ERA5_Interpolation.weight_cache import WeightCache
 
 class NetCDFInterpolator:
-    def __init__(self, input_file, variable_name, grid_step=0.02, method='linear'):
+    def __init__(self, input_file, variable_name=None, grid_step=0.02, method='linear', time_chunk=240, cache_dir=None, dtype=None,
+                 variable_methods=None):
         """
         Initialize the interpolator with the specified parameters.
 
         Parameters:
-        - input_file (str): Path to the input NetCDF file.
-        - variable_name (str): Name of the variable to interpolate.
-        - grid_step (float): Desired grid step size for interpolation. Default is 0.02 degrees.
-        - method (str): Interpolation method. Options are 'linear' or 'nearest'. Default is 'linear'.
+          input_file (str): Path to the input NetCDF file.
+          variable_name (str or list): Name of the variable to interpolate, a list of names, or None
+            to interpolate every (valid_time, latitude, longitude) variable of the file (default: None).
+          grid_step (float): Desired grid step size for interpolation (default: 0.02 degrees).
+          method (str): Regridding method: 'linear' (bilinear), 'nearest', 'conservative' or any
+            engine added with regrid_engines.register_engine (default: 'linear').
+          time_chunk (int): Number of time steps regridded together in one batched operation (default: 240).
+          cache_dir (str): Directory of the on-disk weight cache shared between runs and processes
+            (default: None, which computes the weights in memory).
+          dtype (str): Output data type, e.g. 'float32' to halve the output size (default: None,
+            which keeps the float64 result of the interpolation).
+          variable_methods (dict): Per-variable methods overriding 'method', e.g. {'tp': 'conservative'}
+            for accumulated fluxes (default: None).
         """
         self.input_file = input_file
         self.variable_name = variable_name
         self.grid_step = grid_step
         self.method = method
+        self.time_chunk = time_chunk
+        self.cache_dir = cache_dir
+        self.dtype = dtype
         self.dataset = xr.open_dataset(input_file)
+        self.variable_names = self._select_variables(variable_name)
+        self.methods = {name: (variable_methods or {}).get(name, method) for name in self.variable_names}
         self.interpolated_data = []
 
-    def interpolate(self):
-        """
-        Perform interpolation over all time steps for the specified variable.
-        """
-        for time in self.dataset.valid_time:
-            # Select data for the current time step
-            time_step = self.dataset.sel(valid_time=time)
-            
-            lat = time_step['latitude'].values
-            lon = time_step['longitude'].values
-            variable = time_step[self.variable_name].values
-
-            # Define the number of points for interpolation
-            num_lat_points = int((lat.max() - lat.min()) / self.grid_step) + 1
-            num_lon_points = int((lon.max() - lon.min()) / self.grid_step) + 1
-
-            # Generate new latitude and longitude values including endpoints
-            new_lat = np.linspace(lat.min(), lat.max(), num=num_lat_points)
-            new_lon = np.linspace(lon.min(), lon.max(), num=num_lon_points)
-
-            # Create the interpolating function
-            interpolating_function = RegularGridInterpolator(
-                (lat, lon), variable, method=self.method
-            )
+    def _select_variables(self, variable_name):
+        if variable_name is None:
+            # Every gridded field; scalar and auxiliary variables (e.g. 'expver') are skipped.
+            grid_dims = {'valid_time', 'latitude', 'longitude'}
+            return [name for name, variable in self.dataset.data_vars.items() if set(variable.dims) == grid_dims]
+        if isinstance(variable_name, str):
+            return [variable_name]
+        return list(variable_name)
 
-            # Generate a grid of new points
-            new_lon_grid, new_lat_grid = np.meshgrid(new_lon, new_lat)
-            new_points = np.array([new_lat_grid.flatten(), new_lon_grid.flatten()]).T
+    def iter_interpolated(self):
+        """
+        Regrid the selected variables one block of 'time_chunk' time steps at a time.
 
-            # Perform interpolation
-            interpolated_values = interpolating_function(new_points)
-            interpolated_variable = interpolated_values.reshape(new_lat_grid.shape)
+        The target grid and the sparse weight matrix of every method are computed once (or
+        loaded from the weight cache) and shared by all variables. Each block of every
+        variable is read once, and the variables of each method are regridded together with
+        a single sparse-dense matrix product. Only the current block is held in memory.
 
-            # Create a new Dataset for the interpolated variable
-            interpolated_ds = xr.Dataset(
+        Yields:
+          xarray.Dataset: The interpolated block.
+        """
+        lat = self.dataset['latitude'].values
+        lon = self.dataset['longitude'].values
+        new_lat, new_lon = target_grid(lat, lon, self.grid_step)
+        # Variables grouped by regridding method, each group sharing one weight matrix.
+        groups = {}
+        for name in self.variable_names:
+            groups.setdefault(self.methods[name], []).append(name)
+        regridders = {}
+        for method in groups:
+            if self.cache_dir is None:
+                regridders[method] = SparseRegridder(lat, lon, new_lat, new_lon, method=method)
+            else:
+                regridders[method] = WeightCache(self.cache_dir).get_or_create(lat, lon, new_lat, new_lon, method=method)
+
+        dims = ('valid_time', 'latitude', 'longitude')
+        data = self.dataset[self.variable_names].transpose(*dims)
+        for start in range(0, data.sizes['valid_time'], self.time_chunk):
+            # Read one block of time steps of every variable and regrid each method's variables in one product
+            block = data.isel(valid_time=slice(start, start + self.time_chunk))
+            interpolated_variables = {}
+            for method, names in groups.items():
+                stacked = np.stack([block[name].values for name in names])
+                for name, interpolated_variable in zip(names, regridders[method].apply(stacked)):
+                    if self.dtype is not None:
+                        interpolated_variable = interpolated_variable.astype(self.dtype, copy=False)
+                    interpolated_variables[name] = interpolated_variable
+
+            # Create a new Dataset for the interpolated block
+            yield xr.Dataset(
                 {
-                    self.variable_name: (['latitude', 'longitude'], interpolated_variable)
+                    name: (dims, interpolated_variables[name], self.dataset[name].attrs)
+                    for name in self.variable_names
                 },
                 coords={
                     'latitude': new_lat,
                     'longitude': new_lon,
-                    'valid_time': time.values
+                    'valid_time': block['valid_time'].values
                 }
             )
+
+    def interpolate(self):
+        """
+        Perform interpolation over all time steps for the selected variables, keeping the
+        result in memory for 'save_to_netcdf'. Use 'stream_to_file' for long files.
+        """
+        for interpolated_ds in self.iter_interpolated():
             # Append the Dataset to the list
             self.interpolated_data.append(interpolated_ds)
 
+    def stream_to_file(self, output_file, derived=None):
+        """
+        Interpolate and append each block to the output as soon as it is computed.
+
+        The output grows along an unlimited 'valid_time' dimension, so peak memory depends
+        on 'time_chunk' rather than on the length of the input file.
+
+        Parameters:
+          output_file (str): Path to the output NetCDF file, or to a Zarr store if it ends with '.zarr'.
+          derived (derived_variables.DerivedStage): Stage also fed with every interpolated block, which
+            computes derived variables and time aggregates in the same pass; the caller closes it
+            (default: None).
+        """
+        with open_stream_writer(output_file) as writer:
+            for interpolated_ds in self.iter_interpolated():
+                writer.append(interpolated_ds)
+                if derived is not None:
+                    derived.add(interpolated_ds)
+        print(f"Interpolated data streamed to {output_file}")
+
     def save_to_netcdf(self, output_file):
         """
         Save the interpolated data to a new NetCDF file.
 
         Parameters:
-        - output_file (str): Path to the output NetCDF file.
+          output_file (str): Path to the output NetCDF file.
         """
         # Concatenate all time steps along the 'valid_time' dimension
         interpolated_ds = xr.concat(self.interpolated_data, dim='valid_time')
@@ -90,6 +156,9 @@ if __name__ == "__main__":
     files = [entry for entry in all_entries if os.path.isfile(os.path.join(path_era5_data, entry))]
     # Define the directory path
     directory_path = "/home/vvatellis/storage/weatherProject/datasets/ERA5/Interpolation_reanalysis-era5-single-levels"
+    # Weights are shared by all files on the same grid; inspect or purge with
+    # python -m ERA5_Interpolation.weight_cache --cache_dir <cache_dir> list|purge
+    cache_dir = os.path.join(directory_path, ".regrid_cache")
     # Check if the directory exists
 
     if not os.path.exists(directory_path):
@@ -100,29 +169,24 @@ if __name__ == "__main__":
     for file in files:
         dataPath = os.path.join(path_era5_data,file)
         print("path to data: ",dataPath)
-        ds = xr.open_dataset(dataPath)
-        all_variables = list(ds.data_vars)
-        excluded_vars = ['latitude', 'longitude']
-        selected_variables = [var for var in all_variables if var not in excluded_vars]
-        #print("Selected variables:", selected_variables)
-    
-        variable_name = selected_variables[0]  # Example: selecting the first variable
-        data_array = ds[variable_name]
 
-
-        # Initialize the interpolator
+        # Initialize the interpolator; the file is opened once and every gridded variable is
+        # regridded in the same pass
         interpolator = NetCDFInterpolator(
             input_file=dataPath,
-            variable_name=variable_name,
+            variable_name=None,
             grid_step=0.02,
-            method='linear'
+            # Precipitation is a total over each cell, so it is remapped conservatively
+            method='linear',
+            variable_methods={'tp': 'conservative'},
+            cache_dir=cache_dir,
+            dtype='float32'
         )
 
-        # Perform interpolation
-        interpolator.interpolate()
-
-        # Save the interpolated data to a new NetCDF file
-        interpolator.save_to_netcdf(f'{directory_path}/interpolated_{file}')
-        print(f'Variable: {variable_name}\nstarting time: {ds.valid_time.values[0]} (yyyy/mm/dd/hour)\nfinal time: {ds.valid_time.values[-1]} (yyyy/mm/dd/hour)')
+        # Interpolate and append each block of time steps to the new NetCDF file
+        interpolator.stream_to_file(f'{directory_path}/interpolated_{file}')
+        ds = interpolator.dataset
+        new_lat, new_lon = target_grid(ds.latitude.values, ds.longitude.values, interpolator.grid_step)
+        print(f'Variables: {", ".join(interpolator.variable_names)}\nstarting time: {ds.valid_time.values[0]} (yyyy/mm/dd/hour)\nfinal time: {ds.valid_time.values[-1]} (yyyy/mm/dd/hour)')
         print(f'Data saved at: {directory_path}/interpolated_{file} \n')
-        print(f'Latitude {interpolator.interpolated_ds["latitude"].values.min()}-{interpolator.interpolated_ds["latitude"].values.max()}\nLongitude {interpolator.interpolated_ds["longitude"].values.min()}-{interpolator.interpolated_ds["longitude"].values.max()}')
+        print(f'Latitude {new_lat.min()}-{new_lat.max()}\nLongitude {new_lon.min()}-{new_lon.max()}')
@@ -0,0 +1,197 @@
+# Batch driver that interpolates every NetCDF file of a directory in parallel.
+#
+# Files are distributed over a pool of worker processes. Each worker streams its output
+# to a temporary file that is renamed into place only once it is complete, so outputs
+# that already exist are complete and are skipped on the next run, and a crash never
+# leaves a half-written NetCDF behind.
+#
+# Usage:
+#   python ERA5_Interpolation/batch_interpolation.py --input_dir /path/to/era5 --output_dir /path/to/out --workers 32
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+if __package__ in (None, ""):
+    # Allow running this file directly as a script.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ERA5_Interpolation.ERA5_Interpolation_Script import NetCDFInterpolator
+from ERA5_Interpolation.regrid import target_grid
+from ERA5_Interpolation.regrid_engines import ENGINES
+from derived_variables import DerivedStage
+from era5_inventory import Inventory
+from pipeline_metrics import MetricsRecorder, add_metrics_arguments, measure, recorder_from_args
+
+# Worker processes are spawned rather than forked, as in mainGR.py.
+SPAWN = multiprocessing.get_context("spawn")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Parallel ERA5 interpolation of a directory")
+    parser.add_argument("--input_dir", type=str, required=True, help="Directory containing the ERA5 NetCDF files")
+    parser.add_argument("--output_dir", type=str, required=True, help="Directory where the interpolated files are saved")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--memory_limit_mb", type=int, default=None,
+                        help="Address-space limit of each worker in MiB (Unix only)")
+    parser.add_argument("--grid_step", type=float, default=0.02, help="Target grid step in degrees")
+    parser.add_argument("--method", type=str, default="linear", choices=sorted(ENGINES),
+                        help="Regridding method of the variables not listed in --variable_methods")
+    parser.add_argument("--variable_methods", type=str, nargs="*", default=[], metavar="VARIABLE=METHOD",
+                        help="Per-variable regridding methods, e.g. tp=conservative")
+    parser.add_argument("--time_chunk", type=int, default=240, help="Time steps per batched block")
+    parser.add_argument("--dtype", type=str, default="float32", help="Output data type")
+    parser.add_argument("--inventory", type=str, default=None,
+                        help="Path to the SQLite file inventory used to find the inputs and record the outputs")
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="Weight cache shared by the workers (default: <output_dir>/.regrid_cache)")
+    parser.add_argument("--derived", action="store_true",
+                        help="Also write wind speed/direction and time aggregates next to every output, in the same pass")
+    parser.add_argument("--aggregation_frequency", type=str, default="D",
+                        help="pandas period frequency of the aggregates written with --derived (default: D, daily)")
+    add_metrics_arguments(parser)
+    return parser.parse_args()
+
+
+def limit_worker_memory(memory_limit_mb):
+    """
+    Cap the address space of the current worker process, so that a single oversized file
+    fails with a MemoryError in its worker instead of exhausting the node.
+    """
+    if memory_limit_mb is None:
+        return
+    import resource
+    limit = memory_limit_mb * 1024 ** 2
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def interpolate_file(input_path, output_path, grid_step=0.02, method='linear', time_chunk=240,
+                     dtype='float32', cache_dir=None, variable_methods=None, derived=None):
+    """
+    Interpolate one file into 'output_path' through a temporary file.
+
+    With 'derived' (keyword arguments of derived_variables.DerivedStage.alongside), the derived
+    variables and time aggregates of the interpolated blocks are written next to the output.
+
+    Returns:
+      dict: Statistics of the run ('input', 'output', 'seconds', 'points', 'bytes_read', 'bytes_written').
+    """
+    start = time.perf_counter()
+    tmp_path = os.path.join(os.path.dirname(output_path), f".{os.path.basename(output_path)}.tmp-{os.getpid()}")
+    interpolator = None
+    try:
+        interpolator = NetCDFInterpolator(input_path, grid_step=grid_step, method=method, time_chunk=time_chunk,
+                                          cache_dir=cache_dir, dtype=dtype, variable_methods=variable_methods)
+        ds = interpolator.dataset
+        new_lat, new_lon = target_grid(ds['latitude'].values, ds['longitude'].values, grid_step)
+        points = ds.sizes['valid_time'] * new_lat.size * new_lon.size * len(interpolator.variable_names)
+        if derived is None:
+            interpolator.stream_to_file(tmp_path)
+        else:
+            with DerivedStage.alongside(output_path, **derived) as stage:
+                interpolator.stream_to_file(tmp_path, derived=stage)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        if interpolator is not None:
+            interpolator.dataset.close()
+
+    return {
+        'input': input_path,
+        'output': output_path,
+        'seconds': time.perf_counter() - start,
+        'points': points,
+        'bytes_read': os.path.getsize(input_path),
+        'bytes_written': os.path.getsize(output_path),
+    }
+
+
+def run_batch(input_dir, output_dir, workers=None, memory_limit_mb=None, inventory_path=None, metrics=None, **options):
+    """
+    Interpolate every NetCDF file of 'input_dir' that has no complete output yet.
+
+    Parameters:
+      input_dir (str): Directory containing the ERA5 NetCDF files.
+      output_dir (str): Directory where 'interpolated_<file>' outputs are saved.
+      workers (int): Number of worker processes (default: the number of CPUs).
+      memory_limit_mb (int): Address-space limit of each worker in MiB (default: None (no limit)).
+      inventory_path (str): SQLite file inventory (see era5_inventory.py). When given, the inputs are
+        taken from its records of 'input_dir', existing outputs are those recorded as 'interpolated' and the
+        new outputs are recorded (default: None).
+      metrics (pipeline_metrics.MetricsRecorder): Recorder of one "interpolate" record per file, measured
+        in its worker (time, bytes read and written, peak RSS, points per second) (default: None).
+      options: Keyword arguments passed to 'interpolate_file'.
+
+    Returns:
+      list: Statistics of the files processed in this run.
+    """
+    metrics = metrics if metrics is not None else MetricsRecorder()
+    os.makedirs(output_dir, exist_ok=True)
+    if options.get('cache_dir') is None:
+        options['cache_dir'] = os.path.join(output_dir, '.regrid_cache')
+
+    if inventory_path is None:
+        input_paths = [os.path.join(input_dir, file) for file in sorted(os.listdir(input_dir))]
+        done = {os.path.join(os.path.abspath(output_dir), file) for file in os.listdir(output_dir)}
+    else:
+        with Inventory(inventory_path) as inventory:
+            inventory.update_directory(input_dir, 'download', suffixes=('.nc',))
+            input_paths = [row['path'] for row in inventory.find(directory=input_dir)]
+            # Outputs are renamed into place once complete, so every recorded output is done.
+            inventory.update_directory(output_dir, 'interpolated', suffixes=('.nc',))
+            done = {row['path'] for row in inventory.find(stage='interpolated', directory=output_dir)}
+
+    jobs = []
+    for input_path in input_paths:
+        file = os.path.basename(input_path)
+        if not file.endswith('.nc') or not os.path.isfile(input_path):
+            continue
+        output_path = os.path.join(os.path.abspath(output_dir), f'interpolated_{file}')
+        if output_path in done:
+            print(f"File {os.path.basename(output_path)} already exists, skipping.")
+            continue
+        jobs.append((input_path, output_path))
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=SPAWN, initializer=limit_worker_memory,
+                             initargs=(memory_limit_mb,)) as executor:
+        futures = {executor.submit(measure, interpolate_file, input_path, output_path, **options): input_path
+                   for input_path, output_path in jobs}
+        for future in as_completed(futures):
+            try:
+                stats, file_metrics = future.result()
+            except Exception as error:
+                metrics.record('interpolate', file=os.path.basename(futures[future]), status='failed', error=repr(error))
+                print(f"Failed: {futures[future]} ({error!r})")
+                continue
+            results.append(stats)
+            metrics.record('interpolate', file=os.path.basename(stats['input']), status='ok', points=stats['points'],
+                           **file_metrics)
+            print(f"Interpolated: {os.path.basename(stats['input'])} -> {os.path.basename(stats['output'])} "
+                  f"in {stats['seconds']:.1f} s ({stats['points'] / stats['seconds'] / 1e6:.2f} Mpoints/s, "
+                  f"{stats['bytes_written'] / stats['seconds'] / 1024 ** 2:.1f} MiB/s written)")
+
+    print(f"Processed {len(results)} of {len(jobs)} files.")
+    if inventory_path is not None:
+        with Inventory(inventory_path) as inventory:
+            inventory.update_directory(output_dir, 'interpolated', suffixes=('.nc',))
+    return results
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    variable_methods = dict(pair.split("=", 1) for pair in args.variable_methods)
+    metrics = recorder_from_args(args)
+    with metrics.stage("interpolate") as record:
+        results = run_batch(args.input_dir, args.output_dir, workers=args.workers, memory_limit_mb=args.memory_limit_mb,
+                            grid_step=args.grid_step, method=args.method, time_chunk=args.time_chunk, dtype=args.dtype,
+                            cache_dir=args.cache_dir, inventory_path=args.inventory, variable_methods=variable_methods,
+                            derived={"frequency": args.aggregation_frequency} if args.derived else None,
+                            metrics=metrics)
+        record["files"] = len(results)
+        record["points"] = sum(stats['points'] for stats in results)
@@ -0,0 +1,283 @@
+# Point (station) time-series extraction from (valid_time, latitude, longitude) archives.
+#
+# A PointExtractor is built once for a grid and a list of stations: it stores the grid cells
+# every station depends on and their interpolation weights (located and weighted as by
+# RegularGridInterpolator, see regrid.axis_weights). Extraction then reads only the touched
+# cells: the cells are grouped by on-disk chunk, and every group is read with one hyperslab
+# per block of time steps, so the cost depends on the number of chunks touched rather than on
+# the number of stations.
+#
+# For long series, 'rechunk_time_major' rewrites a file with chunks spanning many time steps
+# and a small tile of cells; a station series then costs a handful of chunk reads instead of
+# one read per time step of the merged or interpolated files.
+#
+# Usage:
+#   python ERA5_Interpolation/point_extraction.py extract --stations stations.csv --variable t2m \\
+#       --output t2m_stations.csv GR_merged_filtered.nc
+#   python ERA5_Interpolation/point_extraction.py rechunk interpolated.nc interpolated_time_major.nc
+
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+
+if __package__ in (None, ""):
+    # Allow running this file directly as a script.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ERA5_Interpolation.regrid import axis_weights
+
+# Minimum number of time steps read at once, for files chunked by single time steps.
+DEFAULT_TIME_BLOCK = 720
+# Chunk shape of the time-major store: (time steps, latitudes, longitudes).
+DEFAULT_TIME_MAJOR_CHUNKS = (8760, 16, 16)
+
+
+def wrap_longitudes(station_lon, lon):
+    """
+    Express station longitudes in the convention of the grid (e.g. -180..180 or 0..360).
+    """
+    lon_min = np.min(lon)
+    station_lon = np.asarray(station_lon, dtype=float)
+    return np.where((station_lon >= lon_min) & (station_lon <= np.max(lon)), station_lon,
+                    (station_lon - lon_min) % 360.0 + lon_min)
+
+
+class PointExtractor:
+    def __init__(self, lat, lon, station_lat, station_lon, method='linear', station_ids=None):
+        """
+        Precompute the cells and weights of every station.
+
+        Parameters:
+          lat, lon (array-like): Grid coordinates (latitudes may be descending, as in ERA5).
+          station_lat, station_lon (array-like): Station coordinates, inside the grid.
+          method (str): 'linear' (bilinear) or 'nearest' (default: 'linear').
+          station_ids (list): Station names (default: None, which numbers the stations).
+        """
+        self.lat = np.asarray(lat)
+        self.lon = np.asarray(lon)
+        self.method = method
+        self.station_lat = np.asarray(station_lat, dtype=float)
+        self.station_lon = wrap_longitudes(station_lon, self.lon)
+        n_stations = self.station_lat.size
+        self.station_ids = list(range(n_stations)) if station_ids is None else list(station_ids)
+        if len(self.station_ids) != n_stations:
+            raise ValueError("There must be one station id per station.")
+
+        lat_index, lat_weight = axis_weights(self.lat, self.station_lat, method)
+        lon_index, lon_weight = axis_weights(self.lon, self.station_lon, method)
+        # Corners of every station: shape (n_stations, k * k), k = 2 for 'linear' and 1 for 'nearest'.
+        rows = np.repeat(lat_index, lon_index.shape[0], axis=0).T
+        cols = np.tile(lon_index, (lat_index.shape[0], 1)).T
+        self.weights = (np.repeat(lat_weight, lon_weight.shape[0], axis=0)
+                        * np.tile(lon_weight, (lat_weight.shape[0], 1))).T
+
+        # Distinct cells touched by the stations, and the position of every corner among them.
+        flat = rows * self.lon.size + cols
+        cells, self.corner_cell = np.unique(flat, return_inverse=True)
+        self.corner_cell = self.corner_cell.reshape(flat.shape)
+        self.cell_rows, self.cell_cols = np.divmod(cells, self.lon.size)
+
+    @classmethod
+    def from_file(cls, path, station_lat, station_lon, **kwargs):
+        """
+        Build an extractor for the grid of a NetCDF file.
+        """
+        import netCDF4
+
+        with netCDF4.Dataset(path) as nc:
+            return cls(nc["latitude"][:], nc["longitude"][:], station_lat, station_lon, **kwargs)
+
+    @property
+    def n_cells(self):
+        return self.cell_rows.size
+
+    def read_plan(self, chunk_shape):
+        """
+        Group the touched cells by on-disk chunk.
+
+        Parameters:
+          chunk_shape (tuple): (latitude, longitude) chunk sizes of the variable.
+
+        Returns:
+          list: One (row slice, column slice, cell positions, rows, columns) entry per touched
+            chunk: the bounding box of the touched cells inside the chunk, the positions of these
+            cells among the touched cells, and their rows and columns relative to the box.
+        """
+        chunk_lat, chunk_lon = chunk_shape
+        chunk_id = (self.cell_rows // chunk_lat) * (self.lon.size // chunk_lon + 1) + self.cell_cols // chunk_lon
+        plan = []
+        for chunk in np.unique(chunk_id):
+            cells = np.flatnonzero(chunk_id == chunk)
+            rows, cols = self.cell_rows[cells], self.cell_cols[cells]
+            row_slice = slice(int(rows.min()), int(rows.max()) + 1)
+            col_slice = slice(int(cols.min()), int(cols.max()) + 1)
+            plan.append((row_slice, col_slice, cells, rows - row_slice.start, cols - col_slice.start))
+        return plan
+
+    def read_cells(self, variable, time_block=DEFAULT_TIME_BLOCK):
+        """
+        Read the series of every touched cell of a netCDF4 variable.
+
+        Parameters:
+          variable (netCDF4.Variable): Variable of dimensions (valid_time, latitude, longitude).
+          time_block (int): Minimum number of time steps per read; reads are aligned to the
+            on-disk time chunks (default: 720).
+
+        Returns:
+          numpy.ndarray: Array of shape (n_times, n_cells), NaN where the data is masked.
+        """
+        if variable.dimensions != ("valid_time", "latitude", "longitude"):
+            raise ValueError(f"Expected dimensions (valid_time, latitude, longitude), got {variable.dimensions}.")
+        n_times, n_lat, n_lon = variable.shape
+        if (n_lat, n_lon) != (self.lat.size, self.lon.size):
+            raise ValueError(f"The extractor grid is {self.lat.size}x{self.lon.size}, the file grid {n_lat}x{n_lon}.")
+        chunking = variable.chunking()
+        chunk_time, chunk_lat, chunk_lon = (n_times, n_lat, n_lon) if chunking == "contiguous" else chunking
+        block = chunk_time * max(1, -(-time_block // chunk_time))
+
+        series = np.empty((n_times, self.n_cells))
+        for row_slice, col_slice, cells, rows, cols in self.read_plan((chunk_lat, chunk_lon)):
+            for start in range(0, n_times, block):
+                stop = min(start + block, n_times)
+                values = variable[start:stop, row_slice, col_slice]
+                series[start:stop, cells] = np.ma.filled(np.ma.asarray(values, dtype=float), np.nan)[:, rows, cols]
+        return series
+
+    def interpolate(self, series):
+        """
+        Combine cell series into station series.
+
+        Parameters:
+          series (numpy.ndarray): Array of shape (n_times, n_cells), as returned by 'read_cells'.
+
+        Returns:
+          numpy.ndarray: Array of shape (n_stations, n_times).
+        """
+        # (n_times, n_stations, k * k) corners, weighted and summed over the corners.
+        return np.einsum("tsk,sk->st", series[:, self.corner_cell], self.weights)
+
+    def extract(self, paths, variable_name, time_block=DEFAULT_TIME_BLOCK):
+        """
+        Extract the station series of a variable from one or more files on the same grid.
+
+        Parameters:
+          paths (str or list): NetCDF file(s), concatenated along time in the given order.
+          variable_name (str): Variable to extract.
+          time_block (int): See 'read_cells' (default: 720).
+
+        Returns:
+          xarray.DataArray: Array of dimensions (station, valid_time), with the station
+            coordinates as 'latitude' and 'longitude'.
+        """
+        import netCDF4
+        import xarray as xr
+
+        paths = [paths] if isinstance(paths, str) else list(paths)
+        blocks, times, attrs = [], [], {}
+        for path in paths:
+            with netCDF4.Dataset(path) as nc:
+                variable = nc[variable_name]
+                attrs = {key: variable.getncattr(key) for key in ("units", "long_name") if key in variable.ncattrs()}
+                blocks.append(self.interpolate(self.read_cells(variable, time_block)))
+                time = nc["valid_time"]
+                times.append(netCDF4.num2date(time[:], time.units, getattr(time, "calendar", "standard"),
+                                              only_use_cftime_datetimes=False, only_use_python_datetimes=True))
+        return xr.DataArray(
+            np.concatenate(blocks, axis=1), dims=("station", "valid_time"), name=variable_name, attrs=attrs,
+            coords={"station": self.station_ids, "valid_time": np.concatenate(times).astype("datetime64[ns]"),
+                    "latitude": ("station", self.station_lat), "longitude": ("station", self.station_lon)},
+        )
+
+
+def rechunk_time_major(input_file, output_file, chunks=DEFAULT_TIME_MAJOR_CHUNKS, compression="zlib", complevel=4):
+    """
+    Rewrite a file with time-major chunks for fast point extraction.
+
+    Every gridded variable is stored in chunks of 'chunks' = (time steps, latitudes, longitudes),
+    so the series of a cell over 'chunks[0]' time steps is one chunk read. The data is copied
+    with dask, one output chunk at a time; integer packing of the source is kept. The output
+    is written to a temporary file renamed once complete.
+
+    Parameters:
+      input_file (str): Source NetCDF file (e.g. a merged or interpolated file).
+      output_file (str): Time-major NetCDF file to write.
+      chunks (tuple): Output chunk shape (default: (8760, 16, 16)).
+      compression (str): "zlib", "zstd" or None for no compression (default: "zlib").
+      complevel (int): Compression level (default: 4).
+    """
+    import xarray as xr
+
+    grid_dims = ("valid_time", "latitude", "longitude")
+    with xr.open_dataset(input_file) as ds:
+        sizes = [ds.sizes[dim] for dim in grid_dims]
+        chunk_shape = tuple(min(chunk, size) for chunk, size in zip(chunks, sizes))
+        ds = ds.chunk(dict(zip(grid_dims, chunk_shape)))
+        encoding = {}
+        for name, variable in ds.data_vars.items():
+            if variable.dims != grid_dims:
+                continue
+            source = variable.encoding
+            encoding[name] = {key: source[key] for key in ("dtype", "scale_factor", "add_offset", "_FillValue")
+                              if key in source and ("scale_factor" in source or "add_offset" in source)}
+            encoding[name]["chunksizes"] = chunk_shape
+            if compression is not None:
+                encoding[name].update(compression=compression, complevel=complevel, shuffle=True)
+        tmp_path = f"{output_file}.part"
+        try:
+            ds.to_netcdf(tmp_path, encoding=encoding)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, output_file)
+
+
+def read_stations(path):
+    """
+    Read a station table with 'station_id', 'latitude' and 'longitude' columns.
+
+    Returns:
+      tuple: (station_ids, latitudes, longitudes).
+    """
+    with open(path, newline="") as stations_file:
+        rows = list(csv.DictReader(stations_file))
+    if not rows or not {"station_id", "latitude", "longitude"} <= set(rows[0]):
+        raise ValueError(f"The station table {path} needs 'station_id', 'latitude' and 'longitude' columns.")
+    return ([row["station_id"] for row in rows], np.array([float(row["latitude"]) for row in rows]),
+            np.array([float(row["longitude"]) for row in rows]))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Station time-series extraction from gridded ERA5 files")
+    commands = parser.add_subparsers(dest="command", required=True)
+    extract = commands.add_parser("extract", help="Extract station series")
+    extract.add_argument("files", type=str, nargs="+", help="NetCDF files on the same grid, in time order")
+    extract.add_argument("--stations", type=str, required=True, help="CSV with station_id, latitude, longitude")
+    extract.add_argument("--variable", type=str, required=True, help="Variable to extract")
+    extract.add_argument("--method", type=str, default="linear", choices=["linear", "nearest"])
+    extract.add_argument("--output", type=str, required=True, help="Output .csv (time x station) or .nc file")
+    rechunk = commands.add_parser("rechunk", help="Write a time-major copy of a file")
+    rechunk.add_argument("input_file", type=str, help="Source NetCDF file")
+    rechunk.add_argument("output_file", type=str, help="Time-major NetCDF file")
+    rechunk.add_argument("--chunks", type=int, nargs=3, default=list(DEFAULT_TIME_MAJOR_CHUNKS),
+                         metavar=("TIME", "LAT", "LON"), help="Output chunk shape")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "rechunk":
+        rechunk_time_major(args.input_file, args.output_file, chunks=tuple(args.chunks))
+        print(f"Time-major copy written to {args.output_file}")
+    else:
+        station_ids, station_lat, station_lon = read_stations(args.stations)
+        extractor = PointExtractor.from_file(args.files[0], station_lat, station_lon, method=args.method,
+                                             station_ids=station_ids)
+        series = extractor.extract(args.files, args.variable)
+        if args.output.endswith(".nc"):
+            series.to_netcdf(args.output)
+        else:
+            series.to_pandas().T.to_csv(args.output)
+        print(f"{len(station_ids)} station series of {series.sizes['valid_time']} time steps written to {args.output}")
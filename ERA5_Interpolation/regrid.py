@@ -0,0 +1,131 @@
+# Precomputed regridding stencils for regular latitude/longitude grids.
+#
+# A stencil stores, for every target latitude and longitude, the indices of the source
+# cells it depends on and the weight of each of them. It is computed once per grid pair
+# and can then be applied to a whole (time, latitude, longitude) block with a few batched
+# NumPy operations, instead of rebuilding an interpolator for every time step.
+
+import numpy as np
+
+def target_grid(lat, lon, grid_step):
+    """
+    Build the target grid covering the extent of the source coordinates.
+
+    Parameters:
+      lat (array-like): Source latitude values.
+      lon (array-like): Source longitude values.
+      grid_step (float): Target grid step size in degrees.
+
+    Returns:
+      tuple: (new_lat, new_lon) ascending arrays including both endpoints.
+    """
+    lat = np.asarray(lat)
+    lon = np.asarray(lon)
+
+    # Define the number of points for interpolation
+    num_lat_points = int((lat.max() - lat.min()) / grid_step) + 1
+    num_lon_points = int((lon.max() - lon.min()) / grid_step) + 1
+
+    # Generate new latitude and longitude values including endpoints
+    new_lat = np.linspace(lat.min(), lat.max(), num=num_lat_points)
+    new_lon = np.linspace(lon.min(), lon.max(), num=num_lon_points)
+    return new_lat, new_lon
+
+
+def axis_weights(src, dst, method='linear'):
+    """
+    Compute the 1-D stencil that maps a source axis onto target coordinates.
+
+    The source axis may be ascending or descending (ERA5 latitudes are descending).
+    Points are located and weighted exactly as scipy's RegularGridInterpolator does.
+
+    Parameters:
+      src (array-like): Strictly monotonic source coordinates.
+      dst (array-like): Target coordinates, all within the range of 'src'.
+      method (str): 'linear' or 'nearest'.
+
+    Returns:
+      tuple: (indices, weights) arrays of shape (k, len(dst)), where k is 2 for 'linear'
+        and 1 for 'nearest'. Indices refer to the original ordering of 'src'.
+    """
+    src = np.asarray(src, dtype=float)
+    dst = np.asarray(dst, dtype=float)
+    if src.ndim != 1 or src.size < 2:
+        raise ValueError("The source axis must be one-dimensional with at least two points.")
+    if method not in ('linear', 'nearest'):
+        raise ValueError(f"Method '{method}' is not defined. Options are 'linear' or 'nearest'.")
+
+    # Work on the ascending view of the axis and map back to the original positions.
+    order = np.argsort(src)
+    sorted_src = src[order]
+    if np.any(np.diff(sorted_src) <= 0):
+        raise ValueError("The source axis must be strictly monotonic.")
+    if dst.min() < sorted_src[0] or dst.max() > sorted_src[-1]:
+        raise ValueError("Target coordinates fall outside the source grid.")
+
+    # Lower neighbour of every target point and its fractional distance to the upper one.
+    lower = np.clip(np.searchsorted(sorted_src, dst, side='right') - 1, 0, src.size - 2)
+    fraction = (dst - sorted_src[lower]) / (sorted_src[lower + 1] - sorted_src[lower])
+
+    if method == 'nearest':
+        # Ties go to the lower neighbour, as in RegularGridInterpolator.
+        nearest = np.where(fraction <= 0.5, lower, lower + 1)
+        return order[nearest][np.newaxis, :], np.ones((1, dst.size))
+
+    indices = np.stack([order[lower], order[lower + 1]])
+    weights = np.stack([1.0 - fraction, fraction])
+    return indices, weights
+
+
+class RegridStencil:
+    def __init__(self, src_lat, src_lon, dst_lat, dst_lon, method='linear'):
+        """
+        Precompute the source-to-target stencil for a pair of regular grids.
+
+        Bilinear interpolation on a rectilinear grid is separable, so the stencil is
+        stored as one 1-D stencil per axis and applied along latitude, then longitude.
+
+        Parameters:
+          src_lat, src_lon (array-like): Source grid coordinates.
+          dst_lat, dst_lon (array-like): Target grid coordinates.
+          method (str): Interpolation method. Options are 'linear' or 'nearest' (default: 'linear').
+        """
+        self.method = method
+        self.dst_lat = np.asarray(dst_lat)
+        self.dst_lon = np.asarray(dst_lon)
+        self.src_shape = (np.size(src_lat), np.size(src_lon))
+        self.lat_index, self.lat_weight = axis_weights(src_lat, dst_lat, method)
+        self.lon_index, self.lon_weight = axis_weights(src_lon, dst_lon, method)
+
+    @property
+    def dst_shape(self):
+        return (self.dst_lat.size, self.dst_lon.size)
+
+    def apply(self, data):
+        """
+        Regrid a block of fields in one batched operation.
+
+        Parameters:
+          data (array-like): Array of shape (..., n_src_lat, n_src_lon), e.g. (time, lat, lon).
+
+        Returns:
+          numpy.ndarray: Array of shape (..., n_dst_lat, n_dst_lon).
+        """
+        data = np.asarray(data)
+        if data.shape[-2:] != self.src_shape:
+            raise ValueError(f"Expected trailing dimensions {self.src_shape}, got {data.shape[-2:]}.")
+
+        if self.method == 'nearest':
+            # A pure gather: no weights to apply.
+            return data[..., self.lat_index[0], :][..., self.lon_index[0]]
+
+        # Interpolate along latitude: (..., n_src_lat, n_src_lon) -> (..., n_dst_lat, n_src_lon)
+        by_lat = sum(
+            data[..., index, :] * weight[:, np.newaxis]
+            for index, weight in zip(self.lat_index, self.lat_weight)
+        )
+        # Interpolate along longitude: (..., n_dst_lat, n_src_lon) -> (..., n_dst_lat, n_dst_lon)
+        return sum(
+            by_lat[..., index] * weight
+            for index, weight in zip(self.lon_index, self.lon_weight)
+        )
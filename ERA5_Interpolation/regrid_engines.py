@@ -0,0 +1,247 @@
+# Pluggable regridding engines backed by sparse weight matrices.
+#
+# An engine is a function that builds the (n_dst, n_src) weight matrix mapping a flattened
+# (latitude, longitude) source field onto a flattened target field. The matrix is computed once
+# per grid pair, stored in CSR format, and applied to a whole block of time steps with one
+# sparse-dense matrix product.
+#
+# Built-in engines:
+# - 'bilinear' (alias 'linear'): bilinear interpolation, identical to RegularGridInterpolator.
+# - 'nearest': nearest source cell.
+# - 'conservative': first-order conservative remapping; every target cell is the area-weighted
+#   mean of the source cells it overlaps, so area integrals of fluxes and totals (e.g.
+#   total_precipitation) are preserved.
+#
+# New engines are added with 'register_engine'.
+
+import os
+
+import numpy as np
+
+from ERA5_Interpolation.regrid import axis_weights
+
+# scipy.sparse is imported by the functions that need it: importing this module (and the
+# interpolation scripts built on it) does not pay for scipy until weights are built or loaded.
+
+# Arrays that fully describe a SparseRegridder, as stored by 'save'.
+REGRIDDER_ARRAYS = ('dst_lat', 'dst_lon', 'data', 'indices', 'indptr')
+
+
+def _axis_matrix(indices, weights, n_src):
+    # (n_dst, n_src) CSR matrix of a 1-D stencil as returned by 'axis_weights'.
+    import scipy.sparse
+
+    n_dst = indices.shape[1]
+    rows = np.tile(np.arange(n_dst), indices.shape[0])
+    return scipy.sparse.csr_matrix((weights.ravel(), (rows, indices.ravel())), shape=(n_dst, n_src))
+
+
+def _separable(lat_matrix, lon_matrix):
+    # Weights of a separable scheme on the row-major flattened (latitude, longitude) grid.
+    import scipy.sparse
+
+    return scipy.sparse.kron(lat_matrix, lon_matrix, format='csr')
+
+
+def bilinear_weights(src_lat, src_lon, dst_lat, dst_lon):
+    """
+    Bilinear interpolation weights, located and weighted as in RegularGridInterpolator.
+    """
+    lat_matrix = _axis_matrix(*axis_weights(src_lat, dst_lat, 'linear'), np.size(src_lat))
+    lon_matrix = _axis_matrix(*axis_weights(src_lon, dst_lon, 'linear'), np.size(src_lon))
+    return _separable(lat_matrix, lon_matrix)
+
+
+def nearest_weights(src_lat, src_lon, dst_lat, dst_lon):
+    """
+    Nearest-neighbour weights (ties go to the lower neighbour, as in RegularGridInterpolator).
+    """
+    lat_matrix = _axis_matrix(*axis_weights(src_lat, dst_lat, 'nearest'), np.size(src_lat))
+    lon_matrix = _axis_matrix(*axis_weights(src_lon, dst_lon, 'nearest'), np.size(src_lon))
+    return _separable(lat_matrix, lon_matrix)
+
+
+def cell_edges(centers, lower=-np.inf, upper=np.inf):
+    """
+    Compute the (lower, upper) edges of the cells of a regular axis.
+
+    Edges lie halfway between neighbouring centers; the outer cells extend by half a step and
+    are clipped to [lower, upper] (e.g. [-90, 90] for latitudes).
+
+    Parameters:
+      centers (array-like): Strictly monotonic cell centers, ascending or descending.
+
+    Returns:
+      tuple: (lower_edges, upper_edges) arrays in the original order of 'centers'.
+    """
+    centers = np.asarray(centers, dtype=float)
+    if centers.ndim != 1 or centers.size < 2:
+        raise ValueError("The axis must be one-dimensional with at least two points.")
+    order = np.argsort(centers)
+    ascending = centers[order]
+    middle = (ascending[1:] + ascending[:-1]) / 2
+    edges = np.concatenate([[1.5 * ascending[0] - 0.5 * ascending[1]], middle,
+                            [1.5 * ascending[-1] - 0.5 * ascending[-2]]])
+    edges = np.clip(edges, lower, upper)
+    lower_edges = np.empty_like(centers)
+    upper_edges = np.empty_like(centers)
+    lower_edges[order] = edges[:-1]
+    upper_edges[order] = edges[1:]
+    return lower_edges, upper_edges
+
+
+def overlap_matrix(src_lower, src_upper, dst_lower, dst_upper):
+    """
+    Build the (n_dst, n_src) CSR matrix of the overlap lengths between source and target cells.
+    """
+    import scipy.sparse
+
+    # Source cells in ascending order; cells of a regular axis do not overlap each other.
+    order = np.argsort(src_lower)
+    src_lower = src_lower[order]
+    src_upper = src_upper[order]
+
+    # Range of source cells overlapping each target cell.
+    first = np.searchsorted(src_upper, dst_lower, side='right')
+    last = np.searchsorted(src_lower, dst_upper, side='left')
+    counts = np.maximum(last - first, 0)
+
+    rows = np.repeat(np.arange(dst_lower.size), counts)
+    columns = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    lengths = np.minimum(src_upper[columns], dst_upper[rows]) - np.maximum(src_lower[columns], dst_lower[rows])
+    keep = lengths > 0
+    return scipy.sparse.csr_matrix((lengths[keep], (rows[keep], order[columns[keep]])),
+                                   shape=(dst_lower.size, src_lower.size))
+
+
+def conservative_weights(src_lat, src_lon, dst_lat, dst_lon):
+    """
+    First-order conservative remapping weights.
+
+    On a regular latitude/longitude grid the area of a cell is proportional to its longitude
+    width times the difference of the sines of its edge latitudes, so the area overlap of two
+    cells is the product of their overlaps along each axis (in sin(latitude) and in longitude).
+    Each row is normalised by the covered area of the target cell.
+    """
+    import scipy.sparse
+
+    src_lat_edges = [np.sin(np.deg2rad(edge)) for edge in cell_edges(src_lat, -90.0, 90.0)]
+    dst_lat_edges = [np.sin(np.deg2rad(edge)) for edge in cell_edges(dst_lat, -90.0, 90.0)]
+    lat_matrix = overlap_matrix(*src_lat_edges, *dst_lat_edges)
+    lon_matrix = overlap_matrix(*cell_edges(src_lon), *cell_edges(dst_lon))
+
+    weights = _separable(lat_matrix, lon_matrix)
+    covered = np.asarray(weights.sum(axis=1)).ravel()
+    if np.any(covered <= 0):
+        raise ValueError("Target cells fall outside the source grid.")
+    return scipy.sparse.diags(1.0 / covered) @ weights
+
+
+# Registered engines: method name -> function(src_lat, src_lon, dst_lat, dst_lon) returning
+# the (n_dst, n_src) weight matrix.
+ENGINES = {
+    'bilinear': bilinear_weights,
+    'linear': bilinear_weights,
+    'nearest': nearest_weights,
+    'conservative': conservative_weights,
+}
+
+
+def register_engine(name, build_weights):
+    """
+    Add a regridding engine.
+
+    Parameters:
+      name (str): Method name, as passed to NetCDFInterpolator(method=...).
+      build_weights (callable): Function (src_lat, src_lon, dst_lat, dst_lon) returning the
+        (n_dst, n_src) weight matrix of the flattened grids, as a scipy.sparse matrix.
+    """
+    ENGINES[name] = build_weights
+
+
+class SparseRegridder:
+    def __init__(self, src_lat, src_lon, dst_lat, dst_lon, method='linear'):
+        """
+        Precompute the sparse weight matrix of a registered engine for a pair of grids.
+
+        Parameters:
+          src_lat, src_lon (array-like): Source grid coordinates.
+          dst_lat, dst_lon (array-like): Target grid coordinates.
+          method (str): Name of a registered engine (see ENGINES) (default: 'linear').
+        """
+        import scipy.sparse
+
+        if method not in ENGINES:
+            raise ValueError(f"Method '{method}' is not defined. Options are {', '.join(sorted(ENGINES))}.")
+        self.method = method
+        self.dst_lat = np.asarray(dst_lat)
+        self.dst_lon = np.asarray(dst_lon)
+        self.src_shape = (np.size(src_lat), np.size(src_lon))
+        self.weights = scipy.sparse.csr_matrix(ENGINES[method](src_lat, src_lon, dst_lat, dst_lon))
+        if self.weights.shape != (self.dst_lat.size * self.dst_lon.size, self.src_shape[0] * self.src_shape[1]):
+            raise ValueError(f"Engine '{method}' returned weights of shape {self.weights.shape}.")
+
+    @property
+    def dst_shape(self):
+        return (self.dst_lat.size, self.dst_lon.size)
+
+    def save(self, directory):
+        """
+        Store the weights as one '.npy' file per array, so they can be memory-mapped on load.
+
+        Parameters:
+          directory (str): Existing directory to write into.
+        """
+        arrays = {'dst_lat': self.dst_lat, 'dst_lon': self.dst_lon, 'data': self.weights.data,
+                  'indices': self.weights.indices, 'indptr': self.weights.indptr}
+        for name in REGRIDDER_ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), arrays[name])
+        np.save(os.path.join(directory, "src_shape.npy"), np.array(self.src_shape))
+        with open(os.path.join(directory, "method.txt"), "w") as method_file:
+            method_file.write(self.method)
+
+    @classmethod
+    def load(cls, directory, mmap_mode=None):
+        """
+        Load weights written by 'save' without recomputing them.
+
+        Parameters:
+          directory (str): Directory written by 'save'.
+          mmap_mode (str): Passed to numpy.load, e.g. 'r' to memory-map the arrays (default: None).
+
+        Returns:
+          SparseRegridder: The stored regridder.
+        """
+        import scipy.sparse
+
+        regridder = cls.__new__(cls)
+        with open(os.path.join(directory, "method.txt")) as method_file:
+            regridder.method = method_file.read().strip()
+        regridder.src_shape = tuple(int(n) for n in np.load(os.path.join(directory, "src_shape.npy")))
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in REGRIDDER_ARRAYS}
+        regridder.dst_lat = arrays['dst_lat']
+        regridder.dst_lon = arrays['dst_lon']
+        shape = (regridder.dst_lat.size * regridder.dst_lon.size, regridder.src_shape[0] * regridder.src_shape[1])
+        regridder.weights = scipy.sparse.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                                    shape=shape, copy=False)
+        return regridder
+
+    def apply(self, data):
+        """
+        Regrid a block of fields with one sparse-dense matrix product.
+
+        Parameters:
+          data (array-like): Array of shape (..., n_src_lat, n_src_lon), e.g. (time, lat, lon).
+
+        Returns:
+          numpy.ndarray: Array of shape (..., n_dst_lat, n_dst_lon).
+        """
+        data = np.asarray(data)
+        if data.shape[-2:] != self.src_shape:
+            raise ValueError(f"Expected trailing dimensions {self.src_shape}, got {data.shape[-2:]}.")
+        leading = data.shape[:-2]
+        # (n_dst, n_src) @ (n_src, n_fields): every field of the block in a single product.
+        fields = data.reshape(-1, self.src_shape[0] * self.src_shape[1]).T
+        regridded = self.weights @ fields
+        return np.ascontiguousarray(regridded.T).reshape(leading + self.dst_shape)
@@ -0,0 +1,107 @@
+# Incremental writers that append (valid_time, latitude, longitude) blocks to an output store.
+#
+# The output grows along an unlimited 'valid_time' dimension one block at a time, so the
+# memory needed to write a file depends on the block size, not on the length of the file.
+
+import numpy as np
+import netCDF4
+
+# CF time encoding used for the 'valid_time' coordinate (same as the ERA5 files).
+TIME_UNITS = "seconds since 1970-01-01"
+TIME_CALENDAR = "proleptic_gregorian"
+
+
+class NetCDFStreamWriter:
+    def __init__(self, output_file, mode="w"):
+        """
+        Create a NetCDF file whose 'valid_time' dimension is unlimited.
+
+        Dimensions and variables are defined from the first appended block.
+
+        Parameters:
+          output_file (str): Path to the output NetCDF file.
+          mode (str): "w" to create the file, or "a" to append to a file written by this class (default: "w").
+        """
+        self.output_file = output_file
+        self.nc = netCDF4.Dataset(output_file, mode)
+        self.n_times = len(self.nc.dimensions["valid_time"]) if "valid_time" in self.nc.dimensions else 0
+
+    def _define(self, block):
+        self.nc.createDimension("valid_time", None)
+        for name in ("latitude", "longitude"):
+            values = block[name].values
+            self.nc.createDimension(name, values.size)
+            self.nc.createVariable(name, values.dtype, (name,))[:] = values
+            self.nc[name].setncatts(block[name].attrs)
+
+        valid_time = self.nc.createVariable("valid_time", "i8", ("valid_time",))
+        valid_time.setncatts({"units": TIME_UNITS, "calendar": TIME_CALENDAR})
+
+        for name, variable in block.data_vars.items():
+            # Chunk the variable by single time steps so appends never rewrite earlier data.
+            chunks = (1,) + variable.shape[1:]
+            self.nc.createVariable(name, variable.dtype, variable.dims, chunksizes=chunks, zlib=False)
+            self.nc[name].setncatts(variable.attrs)
+
+    def append(self, block):
+        """
+        Append one block of time steps.
+
+        Parameters:
+          block (xarray.Dataset): Data variables of dimensions (valid_time, latitude, longitude).
+        """
+        if "valid_time" not in self.nc.dimensions:
+            self._define(block)
+
+        times = block["valid_time"].values.astype("datetime64[s]")
+        stop = self.n_times + times.size
+        self.nc["valid_time"][self.n_times:stop] = (times - np.datetime64(0, "s")).astype(np.int64)
+        for name, variable in block.data_vars.items():
+            self.nc[name][self.n_times:stop] = variable.transpose(*self.nc[name].dimensions).values
+        self.n_times = stop
+
+    def close(self):
+        self.nc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ZarrStreamWriter:
+    def __init__(self, store):
+        """
+        Write to a Zarr store, appending along 'valid_time'. Requires the 'zarr' package.
+
+        Parameters:
+          store (str): Path to the output Zarr store.
+        """
+        self.store = store
+        self.n_times = 0
+
+    def append(self, block):
+        if self.n_times == 0:
+            block.to_zarr(self.store, mode="w")
+        else:
+            block.to_zarr(self.store, append_dim="valid_time")
+        self.n_times += block.sizes["valid_time"]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_stream_writer(path):
+    """
+    Open the incremental writer matching the output path ('.zarr' for Zarr, NetCDF otherwise).
+    """
+    if path.rstrip("/").endswith(".zarr"):
+        return ZarrStreamWriter(path)
+    return NetCDFStreamWriter(path)
@@ -0,0 +1,167 @@
+# Persistent on-disk cache of regridding weights.
+#
+# Every weight matrix is stored in its own directory, named after a hash of the grid geometry
+# (source latitude/longitude, target latitude/longitude and method), as plain '.npy' files
+# that are memory-mapped on load. Later runs and other worker processes reuse them without
+# recomputing anything. The cache is bounded in size and evicts the least recently used
+# entries first.
+#
+# Usage:
+#   python -m ERA5_Interpolation.weight_cache --cache_dir /path/to/cache list
+#   python -m ERA5_Interpolation.weight_cache --cache_dir /path/to/cache purge
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+if __package__ in (None, ""):
+    # Allow running this file directly as a script.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ERA5_Interpolation.regrid_engines import SparseRegridder
+
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+# Storage format of the entries; part of the key, so entries of older formats are never loaded.
+CACHE_FORMAT = 'csr-1'
+
+
+def geometry_key(src_lat, src_lon, dst_lat, dst_lon, method):
+    """
+    Hash the grid geometry that fully determines a weight matrix.
+
+    Returns:
+      str: Hexadecimal SHA-256 digest.
+    """
+    digest = hashlib.sha256(f"{CACHE_FORMAT}:{method}".encode())
+    for axis in (src_lat, src_lon, dst_lat, dst_lon):
+        axis = np.ascontiguousarray(axis, dtype=np.float64)
+        digest.update(str(axis.shape).encode())
+        digest.update(axis.tobytes())
+    return digest.hexdigest()
+
+
+def _directory_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+class WeightCache:
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Open (and create if needed) a weight cache directory.
+
+        Parameters:
+          cache_dir (str): Directory holding one sub-directory per cached weight matrix.
+          max_bytes (int): Size limit of the whole cache. Least recently used entries are
+            evicted once it is exceeded (default: 512 MiB).
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entries(self):
+        """
+        List the cached weight matrices, least recently used first.
+
+        Returns:
+          list: (key, size_in_bytes, last_used_timestamp) tuples.
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            # Skip partially written entries (see 'get_or_create').
+            if not entry.is_dir() or entry.name.startswith('.'):
+                continue
+            entries.append((entry.name, _directory_size(entry.path), entry.stat().st_mtime))
+        return sorted(entries, key=lambda item: item[2])
+
+    def get_or_create(self, src_lat, src_lon, dst_lat, dst_lon, method='linear'):
+        """
+        Load the regridder for a grid pair, computing and storing it on a cache miss.
+
+        Returns:
+          SparseRegridder: Regridder whose weights are memory-mapped from the cache.
+        """
+        key = geometry_key(src_lat, src_lon, dst_lat, dst_lon, method)
+        entry_path = os.path.join(self.cache_dir, key)
+
+        if not os.path.isdir(entry_path):
+            regridder = SparseRegridder(src_lat, src_lon, dst_lat, dst_lon, method=method)
+            # Write into a hidden temporary directory and rename it into place, so that
+            # concurrent workers never see a partially written entry.
+            tmp_path = tempfile.mkdtemp(prefix='.tmp-', dir=self.cache_dir)
+            regridder.save(tmp_path)
+            try:
+                os.rename(tmp_path, entry_path)
+            except OSError:
+                # Another process stored the same entry first.
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            self.evict(keep=key)
+
+        # Record the access for the LRU policy.
+        now = time.time()
+        os.utime(entry_path, (now, now))
+        return SparseRegridder.load(entry_path, mmap_mode='r')
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used entries until the cache fits within 'max_bytes'.
+
+        Parameters:
+          keep (str): Key of an entry that must not be evicted, e.g. the one just stored.
+
+        Returns:
+          list: Keys of the removed entries.
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = []
+        for key, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            total -= size
+            removed.append(key)
+        return removed
+
+    def purge(self):
+        """
+        Remove every cached weight matrix.
+
+        Returns:
+          int: Number of removed entries.
+        """
+        entries = self.entries()
+        for key, _, _ in entries:
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+        return len(entries)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Inspect or purge the regridding weight cache")
+    parser.add_argument("--cache_dir", type=str, required=True, help="Path to the cache directory")
+    parser.add_argument("--max_bytes", type=int, default=DEFAULT_MAX_BYTES,
+                        help="Size limit applied by the 'evict' command")
+    parser.add_argument("command", choices=["list", "evict", "purge"],
+                        help="'list' the entries, 'evict' down to --max_bytes, or 'purge' everything")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    cache = WeightCache(args.cache_dir, max_bytes=args.max_bytes)
+
+    if args.command == "list":
+        entries = cache.entries()
+        for key, size, last_used in entries:
+            print(f"{key[:16]}  {size / 1024:10.1f} KiB  last used {time.ctime(last_used)}")
+        print(f"{len(entries)} entries, {sum(size for _, size, _ in entries) / 1024 ** 2:.2f} MiB")
+    elif args.command == "evict":
+        print(f"Evicted {len(cache.evict())} entries.")
+    else:
+        print(f"Purged {cache.purge()} entries.")
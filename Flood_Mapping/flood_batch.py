@@ -0,0 +1,386 @@
+# Batch flood mapping of many events with Earth Engine.
+#
+# floodMapping.py maps one hardcoded AOI and date pair, prints its flooded area with a blocking
+# getInfo call and always builds the geemap layers. Here the same pipeline is a function that
+# only builds the (lazy, server-side) graph of an event; the flooded areas of a whole table of
+# events are then evaluated in groups, one request per group of events instead of one per event,
+# and a group that fails is split in halves and retried, so that one bad event does not lose
+# the others. Maps are only built on request.
+#
+# floodMapping.py collapses each date window with .mosaic(), which keeps the last scene of every
+# pixel, and thresholds a single after/before ratio, so the result depends on the scene order.
+# With a baseline ('median' or a percentile such as 'p20'), 'flood_series_graph' reduces the
+# before window to a per-pixel baseline instead and maps every acquisition date of the after
+# window against it: the baseline and the static masks are computed once per event and reused
+# by all dates, and the flooded area of every date is returned as a time series.
+#
+# The 'ee' module is passed in (imported lazily by default), so everything but the final
+# requests can be exercised with a stand-in module.
+#
+# Event table (CSV), one row per event, AOI as a (west, south, east, north) rectangle:
+#   event_id,west,south,east,north,before_start,before_end,after_start,after_end
+#   mumbai_2019,72.5,19,75,22,2017-07-15,2019-08-10,2019-08-10,2023-03-23
+#
+# Usage:
+#   python Flood_Mapping/flood_batch.py events.csv --output flood_areas.csv --group_size 25 --workers 4
+#   python Flood_Mapping/flood_batch.py events.csv --output flood_series.csv --baseline median
+
+import os, csv, argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# Same parameters as floodMapping.py.
+DIFF_THRESHOLD = 1.5
+PERMANENT_WATER_SEASONALITY = 5
+SLOPE_THRESHOLD = 5
+CONNECTED_PIXEL_THRESHOLD = 2
+CONNECTED_PIXEL_MAX_SIZE = 25
+SCALE = 30
+MAX_PIXELS = 1e10
+TILE_SCALE = 16
+# Number of events evaluated in one request.
+DEFAULT_GROUP_SIZE = 25
+# Per-pixel reduction of the before window in the time series mode.
+DEFAULT_BASELINE = "median"
+EVENT_FIELDS = ("event_id", "west", "south", "east", "north", "before_start", "before_end", "after_start", "after_end")
+RESULT_FIELDS = ("event_id", "before_images", "after_images", "flooded_ha", "error")
+SERIES_FIELDS = ("event_id", "date", "images", "before_images", "flooded_ha", "error")
+
+
+def _default_ee():
+    # Imported lazily so that the graphs can be built with a stand-in module without earthengine-api.
+    import ee
+    return ee
+
+
+def read_events(path):
+    """
+    Reads an event table (see the header of this file).
+
+    Returns:
+      list: One dict per event, with the AOI bounds as floats.
+    """
+    with open(path, newline="") as events_file:
+        reader = csv.DictReader(events_file)
+        missing = [field for field in EVENT_FIELDS if field not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f"The event table {path} misses the columns {', '.join(missing)}.")
+        events = []
+        for row in reader:
+            event = {field: row[field].strip() for field in EVENT_FIELDS}
+            for field in ("west", "south", "east", "north"):
+                event[field] = float(event[field])
+            events.append(event)
+    ids = [event["event_id"] for event in events]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"The event table {path} has duplicate event ids.")
+    return events
+
+
+def baseline_percentile(baseline):
+    """
+    Percentile of a baseline name: 'median' is the 50th percentile, 'p20' the 20th.
+    """
+    name = str(baseline).strip().lower()
+    if name == "median":
+        return 50.0
+    try:
+        percentile = float(name[1:]) if name.startswith("p") else float("nan")
+    except ValueError:
+        percentile = float("nan")
+    if not 0 <= percentile <= 100:
+        raise ValueError(f"Unknown baseline '{baseline}': expected 'median' or a percentile such as 'p20'.")
+    return percentile
+
+
+# ---------------------------
+# 1. Lazy graphs
+# ---------------------------
+def sentinel1_collection(ee, aoi):
+    """
+    Sentinel-1 GRD VH backscatter over the AOI, filtered as in floodMapping.py.
+    """
+    return ee.ImageCollection('COPERNICUS/S1_GRD')\
+        .filterBounds(aoi)\
+        .filter(ee.Filter.eq('instrumentMode', 'IW'))\
+        .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))\
+        .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VH'))\
+        .filter(ee.Filter.eq('orbitProperties_pass', 'ASCENDING'))\
+        .filter(ee.Filter.eq('resolution_meters', 10))\
+        .select(['VH'])
+
+
+def flood_graph(event, ee=None, diff_threshold=DIFF_THRESHOLD, slope_threshold=SLOPE_THRESHOLD,
+                connected_pixel_threshold=CONNECTED_PIXEL_THRESHOLD, scale=SCALE):
+    """
+    Builds the flood-mapping graph of one event, following floodMapping.py. Nothing is sent to
+    Earth Engine.
+
+    Parameters:
+      event (dict): Event as returned by 'read_events'; an 'aoi' entry (ee.Geometry), if any,
+        is used instead of the rectangle bounds.
+      ee: The Earth Engine module (default: 'import ee').
+
+    Returns:
+      dict: The ee objects of the event: 'aoi', 'before', 'after', 'flooded' (images),
+        'before_images', 'after_images' (image counts of the date windows) and 'flooded_ha'
+        (flooded area in hectares, null if a date window has no image).
+    """
+    ee = ee or _default_ee()
+    aoi = event.get("aoi") or ee.Geometry.Rectangle([event["west"], event["south"], event["east"], event["north"]])
+    collection = sentinel1_collection(ee, aoi)
+    before_collection = collection.filter(ee.Filter.date(event["before_start"], event["before_end"]))
+    after_collection = collection.filter(ee.Filter.date(event["after_start"], event["after_end"]))
+    before = before_collection.mosaic().clip(aoi)
+    after = after_collection.mosaic().clip(aoi)
+
+    # Difference threshold, permanent water, slope and connected pixel count masks.
+    flooded = _change_mask(before, after, _static_mask(ee, aoi, before, slope_threshold),
+                           diff_threshold, connected_pixel_threshold)
+    area = _flooded_area(ee, flooded, aoi, scale)
+
+    # An empty date window has no bands to threshold: its area is null instead of an error.
+    before_images, after_images = before_collection.size(), after_collection.size()
+    flooded_ha = ee.Algorithms.If(before_images.min(after_images).gt(0), area, None)
+    return {"aoi": aoi, "before": before, "after": after, "flooded": flooded,
+            "before_images": before_images, "after_images": after_images, "flooded_ha": flooded_ha}
+
+
+def _static_mask(ee, aoi, terrain, slope_threshold):
+    # Permanent water and slope masks, which do not depend on the after image.
+    permanent_water = ee.Image("JRC/GSW1_4/GlobalSurfaceWater").select('seasonality')\
+        .gt(PERMANENT_WATER_SEASONALITY).clip(aoi)
+    slope = ee.Algorithms.Terrain(terrain).select('slope')
+    return permanent_water.And(slope.lt(slope_threshold))
+
+
+def _change_mask(before, after, static_mask, diff_threshold, connected_pixel_threshold):
+    flooded = after.divide(before).gt(diff_threshold).rename(['Water']).selfMask()
+    flooded = flooded.updateMask(static_mask)
+    connections = flooded.connectedPixelCount(CONNECTED_PIXEL_MAX_SIZE)
+    return flooded.updateMask(connections.gt(connected_pixel_threshold))
+
+
+def _flooded_area(ee, flooded, aoi, scale):
+    # Flooded area in hectares.
+    stats = flooded.multiply(ee.Image.pixelArea()).reduceRegion(
+        reducer=ee.Reducer.sum(), geometry=aoi, scale=scale, maxPixels=MAX_PIXELS, tileScale=TILE_SCALE)
+    return ee.Number(stats.get('Water')).divide(10000)
+
+
+def baseline_composite(ee, collection, baseline=DEFAULT_BASELINE):
+    """
+    Reduces an image collection to its per-pixel median or percentile (see 'baseline_percentile'),
+    which, unlike .mosaic(), does not depend on the order of the scenes.
+    """
+    percentile = baseline_percentile(baseline)
+    reducer = ee.Reducer.median() if percentile == 50 else ee.Reducer.percentile([percentile])
+    return collection.reduce(reducer).rename(['VH'])
+
+
+def flood_series_graph(event, ee=None, baseline=DEFAULT_BASELINE, diff_threshold=DIFF_THRESHOLD,
+                       slope_threshold=SLOPE_THRESHOLD, connected_pixel_threshold=CONNECTED_PIXEL_THRESHOLD,
+                       scale=SCALE):
+    """
+    Builds the flood time series graph of one event: the before window is reduced to a per-pixel
+    baseline, and the mosaic of every acquisition date (UTC day) of the after window is compared
+    with it, with the masks of 'flood_graph'. The baseline, the permanent water and the slope
+    masks are shared by all dates. Nothing is sent to Earth Engine.
+
+    Parameters:
+      event (dict): Event as returned by 'read_events' (see 'flood_graph').
+      ee: The Earth Engine module (default: 'import ee').
+      baseline (str): 'median' or a percentile such as 'p20' (default: 'median').
+
+    Returns:
+      dict: The ee objects of the event: 'aoi', 'baseline' (image), 'dates' (list of
+        'YYYY-MM-dd' strings), 'floods' (collection of the flood masks of the dates, with a
+        'date' property), 'frequency' (number of flooded dates of every pixel), 'before_images',
+        'after_images' and 'series' (list of dicts with the 'date', the number of 'images' and
+        the 'flooded_ha' of every date, null if the before window has no image).
+    """
+    ee = ee or _default_ee()
+    aoi = event.get("aoi") or ee.Geometry.Rectangle([event["west"], event["south"], event["east"], event["north"]])
+    collection = sentinel1_collection(ee, aoi)
+    before_collection = collection.filter(ee.Filter.date(event["before_start"], event["before_end"]))
+    after_collection = collection.filter(ee.Filter.date(event["after_start"], event["after_end"]))
+    reference = baseline_composite(ee, before_collection, baseline).clip(aoi)
+    static_mask = _static_mask(ee, aoi, reference, slope_threshold)
+    before_images, after_images = before_collection.size(), after_collection.size()
+
+    dates = ee.List(after_collection.aggregate_array('system:time_start'))\
+        .map(lambda time: ee.Date(time).format('YYYY-MM-dd')).distinct().sort()
+
+    def date_flood(date):
+        # Flood mask of the scenes of one date, and their number.
+        start = ee.Date(date)
+        scenes = after_collection.filterDate(start, start.advance(1, 'day'))
+        flooded = _change_mask(reference, scenes.mosaic().clip(aoi), static_mask,
+                               diff_threshold, connected_pixel_threshold)
+        return flooded, scenes.size()
+
+    def date_summary(date):
+        flooded, images = date_flood(date)
+        area = ee.Algorithms.If(before_images.gt(0), _flooded_area(ee, flooded, aoi, scale), None)
+        return ee.Dictionary({"date": date, "images": images, "flooded_ha": area})
+
+    floods = ee.ImageCollection.fromImages(dates.map(lambda date: date_flood(date)[0].set('date', date)))
+    frequency = floods.map(lambda flooded: flooded.unmask(0)).sum().clip(aoi).selfMask()
+    return {"aoi": aoi, "baseline": reference, "dates": dates, "floods": floods, "frequency": frequency,
+            "before_images": before_images, "after_images": after_images, "series": dates.map(date_summary)}
+
+
+def _summary(ee, event, graph):
+    return ee.Dictionary({"event_id": event["event_id"], "before_images": graph["before_images"],
+                          "after_images": graph["after_images"], "flooded_ha": graph["flooded_ha"]})
+
+
+def _series_summary(ee, event, graph):
+    return ee.Dictionary({"event_id": event["event_id"], "before_images": graph["before_images"],
+                          "series": graph["series"]})
+
+
+# ---------------------------
+# 2. Grouped evaluation
+# ---------------------------
+def _evaluate_group(ee, events, graphs, summary=_summary):
+    # One request for the whole group; if it fails, each half is retried to isolate the failure.
+    try:
+        return [dict(row, error=None) for row in
+                ee.List([summary(ee, event, graph) for event, graph in zip(events, graphs)]).getInfo()]
+    except Exception as error:
+        if len(events) == 1:
+            return [{"event_id": events[0]["event_id"], "error": str(error)}]
+    middle = len(events) // 2
+    return _evaluate_group(ee, events[:middle], graphs[:middle], summary) + \
+        _evaluate_group(ee, events[middle:], graphs[middle:], summary)
+
+
+def _evaluate_groups(ee, events, graphs, summary, group_size, workers):
+    groups = [(events[start:start + group_size], graphs[start:start + group_size])
+              for start in range(0, len(events), group_size)]
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda group: _evaluate_group(ee, *group, summary), groups))
+    else:
+        results = [_evaluate_group(ee, *group, summary) for group in groups]
+    return [row for rows in results for row in rows]
+
+
+def evaluate_events(events, ee=None, group_size=DEFAULT_GROUP_SIZE, workers=1, **options):
+    """
+    Computes the flooded area of many events.
+
+    The graphs of all events are built first; the areas are then requested in groups of
+    'group_size' events, with up to 'workers' requests in flight.
+
+    Parameters:
+      events (list): Events as returned by 'read_events'.
+      ee: The Earth Engine module, already initialized (default: 'import ee').
+      group_size (int): Number of events per request (default: 25).
+      workers (int): Number of concurrent requests (default: 1).
+      options: Thresholds passed to 'flood_graph'.
+
+    Returns:
+      list: One dict per event, in the order of 'events', with the fields of RESULT_FIELDS;
+        'error' is None for the events that were evaluated.
+    """
+    ee = ee or _default_ee()
+    graphs = [flood_graph(event, ee, **options) for event in events]
+    rows = _evaluate_groups(ee, events, graphs, _summary, group_size, workers)
+    return [{field: row.get(field) for field in RESULT_FIELDS} for row in rows]
+
+
+def evaluate_series(events, ee=None, baseline=DEFAULT_BASELINE, group_size=DEFAULT_GROUP_SIZE, workers=1, **options):
+    """
+    Computes the flood time series of many events (see 'flood_series_graph'), requested in
+    groups of events as in 'evaluate_events'.
+
+    Parameters:
+      events (list): Events as returned by 'read_events'.
+      ee: The Earth Engine module, already initialized (default: 'import ee').
+      baseline (str): 'median' or a percentile such as 'p20' (default: 'median').
+      group_size (int): Number of events per request (default: 25).
+      workers (int): Number of concurrent requests (default: 1).
+      options: Thresholds passed to 'flood_series_graph'.
+
+    Returns:
+      list: One dict per event and acquisition date, with the fields of SERIES_FIELDS, in the
+        order of 'events' and of the dates. Events without any after date, or that failed,
+        have a single row with a null 'date'.
+    """
+    ee = ee or _default_ee()
+    graphs = [flood_series_graph(event, ee, baseline, **options) for event in events]
+    rows = []
+    for row in _evaluate_groups(ee, events, graphs, _series_summary, group_size, workers):
+        event = {"event_id": row["event_id"], "before_images": row.get("before_images"), "error": row["error"]}
+        for point in row.get("series") or [{}]:
+            rows.append({field: point.get(field, event.get(field)) for field in SERIES_FIELDS})
+    return rows
+
+
+def write_results(path, rows, fields=RESULT_FIELDS):
+    with open(path, "w", newline="") as results_file:
+        writer = csv.DictWriter(results_file, fieldnames=fields)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({field: row.get(field) for field in fields})
+
+
+# ---------------------------
+# 3. Maps (interactive use only)
+# ---------------------------
+def flood_map(graph, geemap=None):
+    """
+    Builds the geemap.Map of an event graph: the before and after mosaics and the flooded area.
+    """
+    if geemap is None:
+        import geemap
+    Map = geemap.Map()
+    Map.centerObject(graph["aoi"], 8)
+    Map.addLayer(graph["before"], {'min': -25, 'max': 0}, 'Before Floods', False)
+    Map.addLayer(graph["after"], {'min': -25, 'max': 0}, 'After Floods', False)
+    Map.addLayer(graph["flooded"], {'min': 0, 'max': 1, 'palette': ['Red']}, 'Flooded Area')
+    return Map
+
+
+def flood_series_map(graph, geemap=None):
+    """
+    Builds the geemap.Map of a time series graph: the baseline and the number of flooded dates of every pixel.
+    """
+    if geemap is None:
+        import geemap
+    Map = geemap.Map()
+    Map.centerObject(graph["aoi"], 8)
+    Map.addLayer(graph["baseline"], {'min': -25, 'max': 0}, 'Baseline', False)
+    Map.addLayer(graph["frequency"], {'min': 1, 'max': 10, 'palette': ['yellow', 'red']}, 'Flooded Dates')
+    return Map
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Flooded areas of a table of events with Earth Engine")
+    parser.add_argument("events", type=str, help="CSV event table (event_id, AOI bounds, before and after windows)")
+    parser.add_argument("--output", type=str, required=True, help="CSV file of the flooded areas")
+    parser.add_argument("--group_size", type=int, default=DEFAULT_GROUP_SIZE, help="Events per request")
+    parser.add_argument("--workers", type=int, default=4, help="Number of concurrent requests")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Reduce the before window to a per-pixel 'median' or percentile (e.g. 'p20') and write "
+                             "the flooded area of every after date instead of a single mosaic ratio")
+    parser.add_argument("--project", type=str, default=os.environ.get("EE_PROJECT"),
+                        help="Earth Engine cloud project (default: $EE_PROJECT)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    ee = _default_ee()
+    ee.Initialize(project=args.project)
+
+    events = read_events(args.events)
+    if args.baseline is None:
+        rows = evaluate_events(events, ee, group_size=args.group_size, workers=args.workers)
+        write_results(args.output, rows)
+    else:
+        rows = evaluate_series(events, ee, args.baseline, group_size=args.group_size, workers=args.workers)
+        write_results(args.output, rows, SERIES_FIELDS)
+    failed = len({row["event_id"] for row in rows if row["error"] is not None})
+    print(f"{len(events)} events, {failed} failed; results written to {args.output}")
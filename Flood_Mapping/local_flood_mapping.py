@@ -0,0 +1,582 @@
+# Offline version of the flood-mapping pipeline of floodMapping.py, on rasters held on disk.
+#
+# The Earth Engine steps are reproduced with NumPy/SciPy on Sentinel-1 GRD backscatter (in dB)
+# already on a common grid: mosaicking, the (optional) speckle filter, the after/before change
+# ratio threshold, the permanent-water mask, the slope mask, the connected-pixel-count mask and
+# the flooded area in hectares. Scenes are processed in tiles, in parallel, and every tile is
+# read with a halo wide enough for the neighbourhood steps, so the result does not depend on
+# the tiling.
+#
+# With a baseline ('median' or a percentile such as 'p20'), the before scenes are reduced to a
+# per-pixel baseline instead of a mosaic, and the after scenes of every acquisition date are
+# compared with it ('map_flood_series'): each tile computes the baseline and the static masks
+# once and maps all dates against them, which gives a mask and a flooded area per date.
+#
+# Usage:
+#   python Flood_Mapping/local_flood_mapping.py --before before.tif --after after.tif \
+#       --seasonality gsw_seasonality.tif --output flooded.tif --workers 8
+#   python Flood_Mapping/local_flood_mapping.py --before S1*_2018*.tif --after S1*_2019*.tif \
+#       --baseline median --seasonality gsw_seasonality.tif --output flooded_dates.tif --series flood_series.csv
+
+import os, re, sys, csv, argparse, datetime, warnings, multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+if __package__ in (None, ""):
+    # Allow running this file directly as a script.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Flood_Mapping.flood_batch import DEFAULT_BASELINE, baseline_percentile
+from Flood_Mapping.speckle_filter import REFINED_LEE_HALO, refined_lee
+
+# Same parameters as floodMapping.py.
+DIFF_THRESHOLD = 1.5
+PERMANENT_WATER_SEASONALITY = 5
+SLOPE_THRESHOLD = 5
+CONNECTED_PIXEL_THRESHOLD = 2
+CONNECTED_PIXEL_MAX_SIZE = 25
+# Halo of the speckle filter (7x7 Refined Lee window) and of the slope (4-connected neighbours).
+FILTER_HALO = REFINED_LEE_HALO
+SLOPE_HALO = 1
+# Mean Earth radius in metres, used for the pixel areas of latitude/longitude rasters.
+EARTH_RADIUS = 6371008.8
+DEFAULT_TILE_SIZE = 2048
+# Worker processes are spawned rather than forked, as in mainGR.py.
+SPAWN = multiprocessing.get_context("spawn")
+
+
+# ---------------------------
+# 1. Raster input and output
+# ---------------------------
+class _GeoTIFFWindows:
+    # Array-like view of the first band of a GeoTIFF that reads only the requested window.
+    def __init__(self, path):
+        import rasterio
+
+        self.path = path
+        with rasterio.open(path) as src:
+            self.shape = (src.height, src.width)
+            self.nodata = src.nodata
+
+    def __getitem__(self, key):
+        import rasterio
+        from rasterio.windows import Window
+
+        rows, cols = key
+        with rasterio.open(self.path) as src:
+            window = Window(cols.start, rows.start, cols.stop - cols.start, rows.stop - rows.start)
+            data = src.read(1, window=window).astype("float64")
+        if self.nodata is not None:
+            data[data == self.nodata] = np.nan
+        return data
+
+
+def _geographic_pixel_area(lat, lon):
+    # Area in m² of every row of a regular latitude/longitude grid.
+    lat = np.asarray(lat, dtype=float)
+    dlat = abs(float(lat[1] - lat[0]))
+    dlon = np.deg2rad(abs(float(lon[1] - lon[0])))
+    upper = np.deg2rad(np.clip(lat + dlat / 2, -90, 90))
+    lower = np.deg2rad(np.clip(lat - dlat / 2, -90, 90))
+    return EARTH_RADIUS ** 2 * dlon * np.abs(np.sin(upper) - np.sin(lower))
+
+
+def read_raster(path, variable=None):
+    """
+    Opens a single-band raster lazily: tiles are read from disk only when they are processed.
+
+    GeoTIFFs are read with rasterio (nodata becomes NaN). NetCDF files are read with xarray;
+    'variable' selects the data variable (default: the first one), whose last two dimensions
+    must be (y, x) or (latitude, longitude).
+
+    Parameters:
+      path (str): Path of a GeoTIFF (.tif/.tiff) or NetCDF (.nc) file.
+      variable (str): NetCDF variable name.
+
+    Returns:
+      tuple: (source, meta) where 'source' supports source[row_slice, col_slice] and has a
+        'shape', and 'meta' holds the 'pixel_size' (dx, dy) in metres, the 'pixel_area' in m²
+        (a scalar, or one value per row for latitude/longitude grids) and what is needed to
+        write an output on the same grid.
+    """
+    if path.endswith((".tif", ".tiff")):
+        import rasterio
+
+        with rasterio.open(path) as src:
+            profile = src.profile
+            transform = src.transform
+            if src.crs is not None and src.crs.is_geographic:
+                rows = np.arange(src.height) + 0.5
+                lat = transform.f + transform.e * rows
+                lon = transform.c + transform.a * np.array([0.5, 1.5])
+                pixel_area = _geographic_pixel_area(lat, lon)
+                pixel_size = (np.sqrt(pixel_area.mean()),) * 2
+            else:
+                pixel_size = (abs(transform.a), abs(transform.e))
+                pixel_area = pixel_size[0] * pixel_size[1]
+        return _GeoTIFFWindows(path), {"format": "GTiff", "profile": profile,
+                                       "pixel_size": pixel_size, "pixel_area": pixel_area}
+
+    import xarray as xr
+
+    ds = xr.open_dataset(path)
+    data = ds[variable or list(ds.data_vars)[0]].squeeze(drop=True)
+    y_dim, x_dim = data.dims[-2:]
+    y = ds[y_dim].values
+    x = ds[x_dim].values
+    if y_dim in ("latitude", "lat"):
+        pixel_area = _geographic_pixel_area(y, x)
+        pixel_size = (np.sqrt(pixel_area.mean()),) * 2
+    else:
+        pixel_size = (abs(float(x[1] - x[0])), abs(float(y[1] - y[0])))
+        pixel_area = pixel_size[0] * pixel_size[1]
+    return data, {"format": "NetCDF", "coords": {y_dim: y, x_dim: x}, "dims": (y_dim, x_dim),
+                  "pixel_size": pixel_size, "pixel_area": pixel_area}
+
+
+def write_mask(path, mask, meta, dates=None):
+    """
+    Writes a flood mask (1 = flooded, 0 = not flooded) on the grid described by 'meta' (see 'read_raster').
+    A stack of masks (date, y, x) is written as one band per date (GeoTIFF) or along a 'date'
+    dimension (NetCDF), labelled with 'dates'.
+    """
+    mask = np.asarray(mask, dtype="uint8")
+    masks = mask[np.newaxis] if mask.ndim == 2 else mask
+    if meta["format"] == "GTiff":
+        import rasterio
+
+        profile = dict(meta["profile"], dtype="uint8", count=masks.shape[0], nodata=None, compress="deflate")
+        with rasterio.open(path, "w", **profile) as dst:
+            dst.write(masks)
+            if dates is not None:
+                dst.descriptions = tuple(str(date) for date in dates)
+    else:
+        import xarray as xr
+
+        if mask.ndim == 2:
+            data, coords = (meta["dims"], mask), meta["coords"]
+        else:
+            data, coords = (("date",) + tuple(meta["dims"]), mask), dict(meta["coords"], date=list(dates))
+        xr.Dataset({"Water": data}, coords=coords).to_netcdf(path, encoding={"Water": {"zlib": True, "complevel": 4}})
+
+
+def acquisition_date(path):
+    """
+    Acquisition date ('YYYY-MM-DD') in the name of a scene, e.g. the first date of a Sentinel-1
+    product name (S1A_IW_GRDH_1SDV_20190812T003553_...) or '2019-08-12' in 'vh_2019-08-12.tif'.
+    """
+    name = os.path.basename(path)
+    for match in re.finditer(r"(?<!\d)(\d{4})-?(\d{2})-?(\d{2})(?=T\d|\D|$)", name):
+        try:
+            return datetime.date(*map(int, match.groups())).isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f"No acquisition date in the file name {name}.")
+
+
+def write_series(path, dates, area_ha):
+    """
+    Writes the flooded area of every date to a CSV file (date, flooded_ha).
+    """
+    with open(path, "w", newline="") as series_file:
+        writer = csv.writer(series_file)
+        writer.writerow(("date", "flooded_ha"))
+        writer.writerows(zip(dates, area_ha))
+
+
+# ---------------------------
+# 2. Pipeline steps
+# ---------------------------
+def mosaic(images):
+    """
+    Mosaics co-registered images like ee.ImageCollection.mosaic: later images are drawn on top,
+    and NaN (masked) pixels show the images below.
+    """
+    result = np.array(images[0], dtype=float)
+    for image in images[1:]:
+        image = np.asarray(image, dtype=float)
+        result = np.where(np.isnan(image), result, image)
+    return result
+
+
+def composite(images, baseline=DEFAULT_BASELINE):
+    """
+    Reduces co-registered images to their per-pixel median or percentile ('median' or e.g.
+    'p20', see flood_batch.baseline_percentile), ignoring NaN pixels. Unlike 'mosaic', the
+    result does not depend on the order of the images; pixels without any value are NaN.
+    """
+    stack = np.asarray(images, dtype=float)
+    percentile = baseline_percentile(baseline)
+    with warnings.catch_warnings():
+        # All-NaN pixels.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        if percentile == 50:
+            return np.nanmedian(stack, axis=0)
+        return np.nanpercentile(stack, percentile, axis=0)
+
+
+def to_natural(img):
+    return 10.0 ** (img / 10.0)
+
+
+def to_db(img):
+    return 10.0 * np.log10(img)
+
+
+def slope_degrees(elevation, pixel_size):
+    """
+    Slope in degrees like ee.Terrain.slope: gradients from the 4-connected neighbours, so the
+    outermost pixels (and neighbours of NaN pixels) have no slope (NaN).
+    """
+    dx, dy = pixel_size
+    slope = np.full(elevation.shape, np.nan)
+    dz_dx = (elevation[1:-1, 2:] - elevation[1:-1, :-2]) / (2 * dx)
+    dz_dy = (elevation[2:, 1:-1] - elevation[:-2, 1:-1]) / (2 * dy)
+    slope[1:-1, 1:-1] = np.degrees(np.arctan(np.hypot(dz_dx, dz_dy)))
+    return slope
+
+
+def connected_pixel_count(mask, max_size=CONNECTED_PIXEL_MAX_SIZE):
+    """
+    Size of the 8-connected component of every pixel of 'mask', capped at 'max_size'
+    (0 outside the mask), like ee.Image.connectedPixelCount.
+    """
+    from scipy import ndimage
+
+    labels, _ = ndimage.label(mask, structure=np.ones((3, 3), dtype=bool))
+    sizes = np.bincount(labels.ravel())
+    sizes[0] = 0
+    return np.minimum(sizes[labels], max_size)
+
+
+def flood_halo(speckle_filter=False, connected_pixel_threshold=CONNECTED_PIXEL_THRESHOLD):
+    """
+    Number of pixels a tile must be extended by on every side for its result to be exact.
+
+    A pixel's connected-pixel count exceeds the threshold if and only if the first
+    threshold+1 pixels of a breadth-first search of its component do, and those lie within
+    'connected_pixel_threshold' pixels of it; the slope (and the filter) read one more ring.
+    """
+    return connected_pixel_threshold + SLOPE_HALO + (FILTER_HALO if speckle_filter else 0)
+
+
+def flood_mask(before, after, seasonality=None, elevation=None, pixel_size=(30.0, 30.0),
+               speckle_filter=False, diff_threshold=DIFF_THRESHOLD, slope_threshold=SLOPE_THRESHOLD,
+               connected_pixel_threshold=CONNECTED_PIXEL_THRESHOLD, max_size=CONNECTED_PIXEL_MAX_SIZE):
+    """
+    Flood mask of one (tile of a) scene, following floodMapping.py step by step.
+
+    Parameters:
+      before, after (numpy.ndarray): Backscatter mosaics in dB; NaN marks missing pixels.
+      seasonality (numpy.ndarray): JRC Global Surface Water 'seasonality'. As in floodMapping.py,
+        only pixels with seasonality > 5 are kept. None skips this step.
+      elevation (numpy.ndarray): Terrain used for the slope mask. None uses 'before', as
+        ee.Algorithms.Terrain(before) does in floodMapping.py.
+      pixel_size (tuple): (dx, dy) pixel size in metres, used for the slope.
+      speckle_filter (bool): Threshold the Refined Lee filtered mosaics (see speckle_filter.py).
+        floodMapping.py computes the filtered images for display only and thresholds the
+        unfiltered ones (default: False).
+      diff_threshold (float): Threshold of the after/before ratio (default: 1.5).
+      slope_threshold (float): Maximum slope in degrees (default: 5).
+      connected_pixel_threshold (int): Minimum connected pixel count, exclusive (default: 2).
+      max_size (int): Cap of the connected pixel count (default: 25).
+
+    Returns:
+      numpy.ndarray: Boolean flood mask.
+    """
+    terrain = before if elevation is None else elevation
+    if speckle_filter:
+        before = to_db(refined_lee(to_natural(before)))
+        after = to_db(refined_lee(to_natural(after)))
+    return change_mask(before, after, static_mask(terrain, seasonality, pixel_size, slope_threshold),
+                       diff_threshold, connected_pixel_threshold, max_size)
+
+
+def static_mask(terrain, seasonality=None, pixel_size=(30.0, 30.0), slope_threshold=SLOPE_THRESHOLD):
+    """
+    Pixels that the permanent-water and slope steps of floodMapping.py keep, which do not
+    depend on the after image.
+    """
+    keep = slope_degrees(terrain, pixel_size) < slope_threshold
+    if seasonality is not None:
+        keep &= seasonality > PERMANENT_WATER_SEASONALITY
+    return keep
+
+
+def change_mask(before, after, keep, diff_threshold=DIFF_THRESHOLD,
+                connected_pixel_threshold=CONNECTED_PIXEL_THRESHOLD, max_size=CONNECTED_PIXEL_MAX_SIZE):
+    """
+    Change ratio threshold of 'after' against 'before' within the 'keep' mask ('static_mask'),
+    followed by the connected-pixel-count mask.
+    """
+    # Comparisons with NaN are False, like masked pixels in Earth Engine.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        flooded = after / before > diff_threshold
+    flooded &= keep
+    flooded &= connected_pixel_count(flooded, max_size) > connected_pixel_threshold
+    return flooded
+
+
+def flood_series_mask(before, after, seasonality=None, elevation=None, pixel_size=(30.0, 30.0),
+                      baseline=DEFAULT_BASELINE, speckle_filter=False, diff_threshold=DIFF_THRESHOLD,
+                      slope_threshold=SLOPE_THRESHOLD, connected_pixel_threshold=CONNECTED_PIXEL_THRESHOLD,
+                      max_size=CONNECTED_PIXEL_MAX_SIZE):
+    """
+    Flood masks of a series of dates against one baseline, for one (tile of a) scene.
+
+    The before images are reduced to a per-pixel baseline ('composite'); the baseline, its
+    speckle filter and the static masks are computed once and reused for every date, which
+    is then thresholded as in 'flood_mask'.
+
+    Parameters:
+      before (list): Backscatter images in dB of the before window.
+      after (list): Backscatter mosaic in dB of every after date.
+      baseline (str): 'median' or a percentile such as 'p20' (default: 'median').
+      Others: As in 'flood_mask'; the terrain defaults to the (unfiltered) baseline.
+
+    Returns:
+      numpy.ndarray: Boolean flood masks, (date, y, x).
+    """
+    reference = composite(before, baseline)
+    keep = static_mask(reference if elevation is None else elevation, seasonality, pixel_size, slope_threshold)
+    if speckle_filter:
+        reference = to_db(refined_lee(to_natural(reference)))
+    flooded = np.empty((len(after),) + reference.shape, dtype=bool)
+    for index, image in enumerate(after):
+        if speckle_filter:
+            image = to_db(refined_lee(to_natural(image)))
+        flooded[index] = change_mask(reference, image, keep, diff_threshold, connected_pixel_threshold, max_size)
+    return flooded
+
+
+# ---------------------------
+# 3. Tiled processing
+# ---------------------------
+def _read_haloed(source, rows, cols, halo):
+    # Reads a tile extended by 'halo' pixels; the parts outside the scene are NaN.
+    if source is None:
+        return None
+    height, width = source.shape
+    top, bottom = max(rows.start - halo, 0), min(rows.stop + halo, height)
+    left, right = max(cols.start - halo, 0), min(cols.stop + halo, width)
+    data = np.asarray(source[slice(top, bottom), slice(left, right)], dtype=float)
+    pad = ((top - (rows.start - halo), rows.stop + halo - bottom), (left - (cols.start - halo), cols.stop + halo - right))
+    return np.pad(data, pad, constant_values=np.nan)
+
+
+def _flood_tile(before, after, seasonality, elevation, halo, options):
+    # Flood mask of the core of one haloed tile.
+    flooded = flood_mask(before, after, seasonality, elevation, **options)
+    return flooded[halo:flooded.shape[0] - halo, halo:flooded.shape[1] - halo]
+
+
+def _tiles(shape, tile_size):
+    height, width = shape
+    return [(slice(top, min(top + tile_size, height)), slice(left, min(left + tile_size, width)))
+            for top in range(0, height, tile_size) for left in range(0, width, tile_size)]
+
+
+def _map_tiles(function, sources, out, halo, tile_size, workers, *args):
+    # Writes function(*haloed tiles of 'sources', *args) into the tiles of the last two
+    # dimensions of 'out', in a pool of 'workers' processes when 'workers' > 1, with at most two
+    # tiles per worker read ahead. A source can be a list of sources, passed as a list of tiles.
+    def read(source, rows, cols):
+        if isinstance(source, (list, tuple)):
+            return [read(item, rows, cols) for item in source]
+        return _read_haloed(source, rows, cols, halo)
+
+    def tile_inputs(rows, cols):
+        return [read(source, rows, cols) for source in sources]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=SPAWN) as executor:
+            pending = {}
+            for rows, cols in _tiles(out.shape[-2:], tile_size):
+                pending[executor.submit(function, *tile_inputs(rows, cols), *args)] = (rows, cols)
+                # Bound the number of tiles held in memory.
+                while len(pending) >= 2 * workers:
+                    future = next(iter(pending))
+                    out[(Ellipsis,) + pending.pop(future)] = future.result()
+            for future, (rows, cols) in pending.items():
+                out[..., rows, cols] = future.result()
+    else:
+        for rows, cols in _tiles(out.shape[-2:], tile_size):
+            out[..., rows, cols] = function(*tile_inputs(rows, cols), *args)
+    return out
+
+
+def _flood_series_tile(before, after, seasonality, elevation, halo, options):
+    # Flood masks of the core of one haloed tile; 'after' holds the scenes of every date, mosaicked here.
+    flooded = flood_series_mask(before, [mosaic(scenes) for scenes in after], seasonality, elevation, **options)
+    return flooded[:, halo:flooded.shape[1] - halo, halo:flooded.shape[2] - halo]
+
+
+def _filter_tile(img, halo, db):
+    # Refined Lee filter of the core of one haloed tile.
+    filtered = to_db(refined_lee(to_natural(img))) if db else refined_lee(img)
+    return filtered[halo:filtered.shape[0] - halo, halo:filtered.shape[1] - halo]
+
+
+def filter_scene(img, db=True, tile_size=DEFAULT_TILE_SIZE, workers=1, dtype="float32"):
+    """
+    Applies the Refined Lee speckle filter to a whole scene, tile by tile.
+
+    Every tile is read with a halo of REFINED_LEE_HALO pixels, so the result is identical to
+    filtering the scene at once; a full 10 m Sentinel-1 scene never has to be held in memory
+    in float64.
+
+    Parameters:
+      img: Backscatter image, as an array or a lazy source from 'read_raster'.
+      db (bool): The image is in dB: it is filtered in natural units and converted back, as in
+        floodMapping.py (default: True).
+      tile_size (int): Tile edge length in pixels (default: 2048).
+      workers (int): Number of worker processes (default: 1).
+      dtype (str): Data type of the result (default: 'float32').
+
+    Returns:
+      numpy.ndarray: Filtered image; pixels within 3 pixels of a NaN or of the border are NaN.
+    """
+    out = np.empty(img.shape, dtype=dtype)
+    return _map_tiles(_filter_tile, (img,), out, REFINED_LEE_HALO, tile_size, workers, REFINED_LEE_HALO, db)
+
+
+def map_floods(before, after, seasonality=None, elevation=None, pixel_size=(30.0, 30.0), pixel_area=None,
+               tile_size=DEFAULT_TILE_SIZE, workers=1, **options):
+    """
+    Maps the flooded pixels of a scene and their area, tile by tile.
+
+    Every tile is read with a halo of 'flood_halo' pixels, so the mask is identical to the mask
+    of the whole scene computed at once. Tiles are processed in a pool of 'workers' processes
+    when 'workers' > 1, with at most two tiles per worker read ahead.
+
+    Parameters:
+      before, after: Backscatter mosaics in dB, as arrays or lazy sources from 'read_raster'.
+      seasonality, elevation: Optional rasters on the same grid (see 'flood_mask').
+      pixel_size (tuple): (dx, dy) pixel size in metres.
+      pixel_area (float or numpy.ndarray): Pixel area in m², a scalar or one value per row
+        (default: dx * dy).
+      tile_size (int): Tile edge length in pixels (default: 2048).
+      workers (int): Number of worker processes (default: 1).
+      options: Thresholds passed to 'flood_mask'.
+
+    Returns:
+      dict: 'flooded' (uint8 mask, 1 = flooded) and 'area_ha' (flooded area in hectares).
+    """
+    height, width = before.shape
+    halo = flood_halo(options.get("speckle_filter", False),
+                      options.get("connected_pixel_threshold", CONNECTED_PIXEL_THRESHOLD))
+    options = dict(options, pixel_size=pixel_size)
+    if pixel_area is None:
+        pixel_area = pixel_size[0] * pixel_size[1]
+    row_area = np.broadcast_to(np.asarray(pixel_area, dtype=float), (height,))
+
+    flooded = np.zeros((height, width), dtype="uint8")
+    _map_tiles(_flood_tile, (before, after, seasonality, elevation), flooded, halo, tile_size, workers,
+               halo, options)
+
+    area_m2 = float((flooded.sum(axis=1) * row_area).sum())
+    return {"flooded": flooded, "area_ha": area_m2 / 10000}
+
+
+def map_flood_series(before, after, seasonality=None, elevation=None, pixel_size=(30.0, 30.0), pixel_area=None,
+                     baseline=DEFAULT_BASELINE, tile_size=DEFAULT_TILE_SIZE, workers=1, **options):
+    """
+    Maps the flooded pixels and area of every after date against a per-pixel baseline of the
+    before scenes, tile by tile (see 'flood_series_mask').
+
+    Each tile is read once for all dates: its baseline, static masks and halo are shared by
+    the dates, instead of a 'map_floods' run per date recomputing them. Tiles are processed as
+    in 'map_floods', so the masks do not depend on the tiling.
+
+    Parameters:
+      before (list): Backscatter scenes in dB of the before window, as arrays or lazy sources
+        from 'read_raster' (or a (scene, y, x) array).
+      after (dict): Scenes of every after date, {date: scene or list of scenes}; the scenes of
+        a date are mosaicked in the given order.
+      baseline (str): 'median' or a percentile such as 'p20' (default: 'median').
+      Others: As in 'map_floods'.
+
+    Returns:
+      dict: 'dates' (sorted), 'flooded' (uint8 masks, (date, y, x)) and 'area_ha' (flooded
+        area of every date in hectares).
+    """
+    dates = sorted(after)
+    scenes = [list(after[date]) if isinstance(after[date], (list, tuple)) else [after[date]] for date in dates]
+    before = list(before)
+    height, width = before[0].shape
+    halo = flood_halo(options.get("speckle_filter", False),
+                      options.get("connected_pixel_threshold", CONNECTED_PIXEL_THRESHOLD))
+    options = dict(options, pixel_size=pixel_size, baseline=baseline)
+    if pixel_area is None:
+        pixel_area = pixel_size[0] * pixel_size[1]
+    row_area = np.broadcast_to(np.asarray(pixel_area, dtype=float), (height,))
+
+    flooded = np.zeros((len(dates), height, width), dtype="uint8")
+    _map_tiles(_flood_series_tile, (before, scenes, seasonality, elevation), flooded, halo, tile_size, workers,
+               halo, options)
+
+    area_m2 = flooded.sum(axis=2) @ row_area
+    return {"dates": dates, "flooded": flooded, "area_ha": area_m2 / 10000}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline Sentinel-1 flood mapping on local rasters")
+    parser.add_argument("--before", type=str, nargs="+", required=True,
+                        help="Backscatter rasters (dB) before the event, mosaicked in the given order")
+    parser.add_argument("--after", type=str, nargs="+", required=True,
+                        help="Backscatter rasters (dB) after the event, mosaicked in the given order")
+    parser.add_argument("--seasonality", type=str, default=None, help="JRC GSW seasonality raster on the same grid")
+    parser.add_argument("--elevation", type=str, default=None,
+                        help="Terrain raster for the slope mask (default: the before mosaic, as in floodMapping.py)")
+    parser.add_argument("--variable", type=str, default=None, help="Variable of NetCDF inputs")
+    parser.add_argument("--output", type=str, required=True, help="Output flood mask (.tif or .nc)")
+    parser.add_argument("--speckle_filter", action="store_true", help="Threshold the speckle-filtered mosaics")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Reduce the before rasters to a per-pixel 'median' or percentile (e.g. 'p20') and map "
+                             "every after date (from the file names) against it; --output gets one band per date")
+    parser.add_argument("--series", type=str, default=None, help="CSV file of the flooded area of every date")
+    parser.add_argument("--tile_size", type=int, default=DEFAULT_TILE_SIZE, help="Tile edge length in pixels")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    return parser.parse_args()
+
+
+def _main_series(args):
+    # Time series mode: the after rasters are grouped by the acquisition date in their names.
+    before = [read_raster(path, args.variable) for path in args.before]
+    meta = before[0][1]
+    after = {}
+    for path in args.after:
+        after.setdefault(acquisition_date(path), []).append(read_raster(path, args.variable)[0])
+    seasonality = read_raster(args.seasonality)[0] if args.seasonality else None
+    elevation = read_raster(args.elevation)[0] if args.elevation else None
+
+    result = map_flood_series([source for source, _ in before], after, seasonality, elevation,
+                              pixel_size=meta["pixel_size"], pixel_area=meta["pixel_area"], baseline=args.baseline,
+                              tile_size=args.tile_size, workers=args.workers, speckle_filter=args.speckle_filter)
+    write_mask(args.output, result["flooded"], meta, result["dates"])
+    if args.series:
+        write_series(args.series, result["dates"], result["area_ha"])
+    for date, area in zip(result["dates"], result["area_ha"]):
+        print(f'{date} Flooded Area (hectares): {area}')
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.baseline is not None:
+        _main_series(args)
+        sys.exit()
+
+    # A single raster is read lazily tile by tile; several rasters of a date are mosaicked first.
+    sources = {}
+    for name in ("before", "after"):
+        rasters = [read_raster(path, args.variable) for path in getattr(args, name)]
+        meta = rasters[0][1]
+        sources[name] = rasters[0][0] if len(rasters) == 1 else \
+            mosaic([source[slice(0, source.shape[0]), slice(0, source.shape[1])] for source, _ in rasters])
+    seasonality = read_raster(args.seasonality)[0] if args.seasonality else None
+    elevation = read_raster(args.elevation)[0] if args.elevation else None
+
+    result = map_floods(sources["before"], sources["after"], seasonality, elevation,
+                        pixel_size=meta["pixel_size"], pixel_area=meta["pixel_area"], tile_size=args.tile_size,
+                        workers=args.workers, speckle_filter=args.speckle_filter)
+    write_mask(args.output, result["flooded"], meta)
+    print('Flooded Area (hectares):', result["area_ha"])
@@ -0,0 +1,162 @@
+# Refined Lee speckle filter for SAR backscatter, as a vectorized NumPy kernel.
+#
+# Port of the Refined Lee filter commonly used with Earth Engine (Lee, 1981; Lee et al., 1999):
+# local 3x3 statistics are sampled at 9 positions of a 7x7 window, the strongest of 4
+# gradients picks one of 8 edge-aligned 7x7 half windows, and the pixel is replaced by the
+# minimum mean square error estimate computed from that window's mean and variance.
+#
+# All window sums are built from shifted views of the (NaN-padded) image and added in the same
+# order for every pixel, so the cost per pixel does not depend on the image size and the
+# result of a pixel does not depend on where its tile starts: tiles read with a halo of
+# REFINED_LEE_HALO pixels reproduce the whole-scene result exactly.
+
+import numpy as np
+
+# Radius of the 7x7 window: pixels closer than this to a NaN or to the scene border are NaN.
+REFINED_LEE_HALO = 3
+_SIZE = 2 * REFINED_LEE_HALO + 1
+DEFAULT_BLOCK_ROWS = 64
+
+
+def _directional_kernels():
+    # The 8 edge-aligned half windows, in the order of the direction codes 1-8: the
+    # rectangular and the triangular kernel, each rotated clockwise by 0, 90, 180 and 270
+    # degrees (direction d + 4 is the opposite of direction d).
+    rect = np.zeros((_SIZE, _SIZE), dtype=bool)
+    rect[REFINED_LEE_HALO:] = True
+    diag = np.tril(np.ones((_SIZE, _SIZE), dtype=bool))
+    kernels = []
+    for rotation in range(4):
+        kernels.append(np.rot90(rect, -rotation))
+        kernels.append(np.rot90(diag, -rotation))
+    return kernels
+
+
+DIRECTIONAL_KERNELS = _directional_kernels()
+
+
+def _kernel_rows(kernel):
+    # Every row of the kernels is one run of columns: (first column, length) per row.
+    rows = []
+    for row in kernel:
+        columns = np.flatnonzero(row)
+        rows.append((int(columns[0]), columns.size) if columns.size else None)
+    return rows
+
+
+_KERNEL_ROWS = [_kernel_rows(kernel) for kernel in DIRECTIONAL_KERNELS]
+_KERNEL_SIZE = int(DIRECTIONAL_KERNELS[0].sum())
+
+
+def _segment_table():
+    # Index, in the stack built by '_row_segments', of the column run of every kernel row
+    # (0 is an empty run), shape (8 directions, 7 rows).
+    runs = [None] + sorted({run for rows in _KERNEL_ROWS for run in rows if run is not None})
+    table = np.array([[runs.index(run) for run in rows] for rows in _KERNEL_ROWS])
+    return runs, table
+
+
+_RUNS, _SEGMENT_TABLE = _segment_table()
+
+
+def _row_segments(padded, width):
+    # Stack of the sums of every column run of the kernels, for every row of the padded image:
+    # segments[i, row, x] = sum of padded[row, x + first : x + first + length] for _RUNS[i].
+    # Every kernel row is a prefix or a suffix of the 7 columns, built up one column at a time.
+    sums = {}
+    prefix = np.zeros((padded.shape[0], width))
+    suffix = np.zeros((padded.shape[0], width))
+    for length in range(1, _SIZE + 1):
+        prefix = prefix + padded[:, length - 1:length - 1 + width]
+        sums[(0, length)] = prefix
+        first = _SIZE - length
+        if first > 0:
+            suffix = suffix + padded[:, first:first + width]
+            sums[(first, length)] = suffix
+    return np.stack([np.zeros((padded.shape[0], width)) if run is None else sums[run] for run in _RUNS])
+
+
+def _directional_sums(segments, direction, height):
+    # Sum of the image over the directional kernel of every pixel: one gather per kernel row.
+    total = np.zeros(direction.shape)
+    for row in range(_SIZE):
+        index = _SEGMENT_TABLE[direction, row]
+        total += np.take_along_axis(segments[:, row:row + height], index[np.newaxis], axis=0)[0]
+    return total
+
+
+def refined_lee(img, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    Applies the Refined Lee speckle filter.
+    Image must be in the natural unit i.e., not in dB!
+
+    Parameters:
+      img (numpy.ndarray): 2-D backscatter image in natural units; NaN marks missing pixels.
+      block_rows (int): The image is filtered in strips of this many rows, small enough for
+        the intermediate arrays to stay in the CPU cache (default: 64).
+
+    Returns:
+      numpy.ndarray: Filtered image. Pixels whose 7x7 window contains a NaN or crosses the
+        image border are NaN.
+    """
+    img = np.asarray(img, dtype=float)
+    padded = np.pad(img, REFINED_LEE_HALO, constant_values=np.nan)
+    result = np.empty(img.shape)
+    for top in range(0, img.shape[0], block_rows):
+        bottom = min(top + block_rows, img.shape[0])
+        result[top:bottom] = _refined_lee_block(padded[top:bottom + 2 * REFINED_LEE_HALO])
+    return result
+
+
+def _refined_lee_block(padded):
+    # Refined Lee filter of the centre of an image block padded by REFINED_LEE_HALO pixels.
+    halo = REFINED_LEE_HALO
+    height, width = padded.shape[0] - 2 * halo, padded.shape[1] - 2 * halo
+    img = padded[halo:halo + height, halo:halo + width]
+    padded_sq = padded * padded
+
+    # 3x3 mean and variance, for the centres of the padded image without its outer ring.
+    def box3(a):
+        rows = a[:, :-2] + a[:, 1:-1] + a[:, 2:]
+        return (rows[:-2] + rows[1:-1] + rows[2:]) / 9
+
+    mean3 = box3(padded)
+    variance3 = box3(padded_sq) - mean3 * mean3
+
+    # Sample the 3x3 statistics at the 9 positions (-2, 0, 2) x (-2, 0, 2) of the 7x7 window.
+    offsets = [(dy, dx) for dy in (-2, 0, 2) for dx in (-2, 0, 2)]
+    sample_mean = np.stack([mean3[halo - 1 + dy:halo - 1 + dy + height, halo - 1 + dx:halo - 1 + dx + width]
+                            for dy, dx in offsets])
+    sample_var = np.stack([variance3[halo - 1 + dy:halo - 1 + dy + height, halo - 1 + dx:halo - 1 + dx + width]
+                           for dy, dx in offsets])
+    # The 9 sampled 3x3 windows cover the whole 7x7 window.
+    missing = np.isnan(sample_mean).any(axis=0)
+
+    # 4 gradients (vertical, diagonal, horizontal, anti-diagonal) and the strongest of them.
+    pairs = [(1, 7), (6, 2), (3, 5), (0, 8)]
+    gradients = np.stack([np.abs(sample_mean[a] - sample_mean[b]) for a, b in pairs])
+    strongest = np.argmax(np.nan_to_num(gradients, nan=-1.0), axis=0)
+
+    # Direction 1-4 if the edge faces one way, 5-8 if it faces the other.
+    centre = sample_mean[4]
+    facing = np.stack([(sample_mean[a] - centre) > (centre - sample_mean[b]) for a, b in pairs])
+    facing = np.take_along_axis(facing, strongest[np.newaxis], axis=0)[0]
+    direction = np.where(facing, strongest, strongest + 4)
+
+    # Local noise variance: mean of the 5 lowest sampled variance / mean² ratios.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sample_stats = sample_var / (sample_mean * sample_mean)
+    sigma_v = np.partition(sample_stats, 4, axis=0)[:5].mean(axis=0)
+
+    # Mean and variance over the directional window of every pixel.
+    dir_mean = _directional_sums(_row_segments(padded, width), direction, height) / _KERNEL_SIZE
+    dir_var = _directional_sums(_row_segments(padded_sq, width), direction, height) / _KERNEL_SIZE \
+        - dir_mean * dir_mean
+
+    # Minimum mean square error estimate; flat windows (no variance) keep their mean.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        var_x = (dir_var - dir_mean * dir_mean * sigma_v) / (sigma_v + 1.0)
+        b = np.where(dir_var > 0, var_x / dir_var, 0.0)
+    result = dir_mean + b * (img - dir_mean)
+    result[missing] = np.nan
+    return result
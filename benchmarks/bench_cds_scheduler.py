@@ -0,0 +1,187 @@
+# Check and benchmark cds_scheduler.CDSDownloadScheduler against a stand-in CDS, without cdsapi.
+#
+# The stand-in queues every submitted request for a fixed latency before it completes, and is
+# shared by the clients of all worker threads (and of a restarted scheduler). Jobs exercise:
+#
+#   transient   the first status request fails with a network error: the same request is polled again
+#   rejected    the CDS reports the first request as failed: the job is submitted again
+#   broken      every request fails: the job ends failed after the retries, with the backoff delays
+#   resumed     the run is killed while the request is queued: a new scheduler on the same
+#               journal polls the journaled request ID instead of submitting it again
+#
+# The journal states, submissions and retry delays are checked, and the time of the run is
+# compared with one request at a time. The script exits with status 1 if a check fails.
+#
+# Usage:
+#   python benchmarks/bench_cds_scheduler.py --jobs 16 --workers 4 --latency 0.2
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cds_scheduler import COMPLETED, FAILED, QUEUED, RUNNING, CDSDownloadScheduler, RequestFailed
+
+DATASET = "reanalysis-era5-single-levels"
+BACKOFF = 0.01
+POLL_INTERVAL = 0.001
+MAX_RETRIES = 2
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="CDS download scheduler check and benchmark")
+    parser.add_argument("--jobs", type=int, default=16, help="Number of ordinary download jobs")
+    parser.add_argument("--workers", type=int, default=4, help="Number of requests kept in flight")
+    parser.add_argument("--latency", type=float, default=0.2, help="Simulated seconds a request is queued")
+    return parser.parse_args()
+
+
+class FakeCDS:
+    # The server side: requests by ID, shared by all clients.
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = {}
+        self.submissions = {}
+        self.faults = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def client(self):
+        return FakeClient(self)
+
+
+class FakeClient:
+    # One client per worker thread, with the submit/status/download contract of the scheduler.
+    def __init__(self, server):
+        self.server = server
+
+    def submit(self, dataset, request):
+        server = self.server
+        with server._lock:
+            request_id = f"request-{next(server._ids)}"
+            target = request["target"]
+            server.submissions[target] = server.submissions.get(target, 0) + 1
+            server.requests[request_id] = {"target": target, "ready": time.perf_counter() + server.latency,
+                                           "submission": server.submissions[target]}
+        return request_id
+
+    def status(self, request_id):
+        server = self.server
+        entry = server.requests[request_id]
+        fault = server.faults.get(entry["target"])
+        if fault == "transient" and not entry.setdefault("polled", False):
+            entry["polled"] = True
+            raise ConnectionError("connection reset while polling")
+        if fault == "broken" or (fault == "rejected" and entry["submission"] == 1):
+            raise RequestFailed(f"CDS request {request_id} is failed")
+        return COMPLETED if time.perf_counter() >= entry["ready"] else QUEUED
+
+    def download(self, request_id, target):
+        with open(target, "w") as target_file:
+            target_file.write(self.server.requests[request_id]["target"])
+
+
+class _Killed(BaseException):
+    # Raised by the sleep of the first scheduler of the resume check, as a kill would stop it.
+    pass
+
+
+def make_scheduler(directory, server, workers, sleep=time.sleep, delays=None):
+    def recording_sleep(seconds):
+        if delays is not None and seconds != POLL_INTERVAL:
+            delays.append(seconds)
+        sleep(seconds)
+
+    scheduler = CDSDownloadScheduler(directory, client_factory=server.client, workers=workers,
+                                     max_retries=MAX_RETRIES, backoff=BACKOFF, poll_interval=POLL_INTERVAL,
+                                     sleep=recording_sleep)
+    return scheduler
+
+
+def submit_all(scheduler, targets):
+    for target in targets:
+        scheduler.submit(DATASET, {"target": target}, target)
+
+
+def run_checks(directory, latency, workers, n_jobs):
+    failures = []
+
+    def check(condition, message):
+        print(f"{'ok' if condition else 'FAILED'}: {message}")
+        if not condition:
+            failures.append(message)
+
+    server = FakeCDS(latency)
+    server.faults = {"transient.nc": "transient", "rejected.nc": "rejected", "broken.nc": "broken"}
+    targets = [f"job_{index:03d}.nc" for index in range(n_jobs)] + sorted(server.faults)
+    delays = []
+    scheduler = make_scheduler(directory, server, workers, delays=delays)
+    submit_all(scheduler, targets)
+    start = time.perf_counter()
+    summary = scheduler.run()
+    seconds = time.perf_counter() - start
+    journal = json.load(open(scheduler.journal_path))
+
+    check(sorted(summary[COMPLETED]) == sorted(set(targets) - {"broken.nc"}) and summary[FAILED] == ["broken.nc"],
+          "every job completed except the broken one")
+    check(all(journal[target]["state"] == COMPLETED for target in summary[COMPLETED]) and
+          journal["broken.nc"]["state"] == FAILED, "journal states")
+    check(all(open(os.path.join(directory, target)).read() == target for target in summary[COMPLETED]),
+          "targets written")
+    check(not any(name.endswith(".part") for name in os.listdir(directory)), "no temporary file left")
+    check(server.submissions["transient.nc"] == 1 and journal["transient.nc"]["attempts"] == 2,
+          "a network error polls the same request again")
+    check(server.submissions["rejected.nc"] == 2, "a request failed on the CDS is submitted again")
+    check(server.submissions["broken.nc"] == MAX_RETRIES + 1 and journal["broken.nc"]["request_id"] is None,
+          "a failed job is given up after the retries and resubmitted on the next run")
+    # First retries of the transient, rejected and broken jobs, then the second retry of the broken one,
+    # each within [0.5, 1] times the doubled backoff.
+    attempts = [0, 0, 0, 1]
+    check(len(delays) == len(attempts) and all(0.5 * BACKOFF * 2 ** attempt <= delay <= BACKOFF * 2 ** attempt
+                                               for delay, attempt in zip(sorted(delays), attempts)),
+          "exponential backoff between retries")
+    check(all("queue_seconds" in journal[target] for target in summary[COMPLETED]), "queue times journaled")
+
+    # A second run skips the completed jobs.
+    rerun = make_scheduler(directory, server, workers)
+    submit_all(rerun, targets)
+    check(sorted(rerun.run()["skipped"]) == sorted(summary[COMPLETED]), "completed jobs are skipped")
+
+    # Killed while queued, then resumed from the journal by a new scheduler.
+    resume_dir = os.path.join(directory, "resume")
+
+    def kill(seconds):
+        raise _Killed()
+
+    killed = make_scheduler(resume_dir, server, 1, sleep=kill)
+    submit_all(killed, ["resumed.nc"])
+    try:
+        killed.run()
+    except _Killed:
+        pass
+    entry = json.load(open(killed.journal_path))["resumed.nc"]
+    check(entry["state"] == RUNNING and entry["request_id"] is not None, "the request ID is journaled while queued")
+    resumed = make_scheduler(resume_dir, server, 1)
+    submit_all(resumed, ["resumed.nc"])
+    check(resumed.run()[COMPLETED] == ["resumed.nc"] and server.submissions["resumed.nc"] == 1,
+          "an interrupted job polls its request instead of submitting it again")
+    return failures, seconds
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        failures, seconds = run_checks(tmp, args.latency, args.workers, args.jobs)
+    # Roughly one queue latency per job (and per retry) with one request at a time.
+    print(f"{args.jobs + 3} jobs with {args.workers} requests in flight: {seconds:.2f} s "
+          f"(about {(args.jobs + 5) * args.latency:.2f} s one at a time)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# Benchmark the fused derived-variable stage of mainGR.merge_and_filter_nc against separate passes.
+#
+# Synthetic regional files (one int16-packed file per variable and period, as written by mainGR.py,
+# with missing t2m values) are merged three times:
+#
+#   separate  merge, then re-open the merged file to compute wind speed/direction, and the regional
+#             files to compute the daily aggregates of every hour with xarray (the merged file
+#             lacks the filtered hour)
+#   fused     merge with derived={"frequency": "D"}, computing them from the chunks in memory
+#   appended  the same, in two merges split in the middle of a day, so that the second one
+#             completes the last stored daily bin
+#
+# The daily aggregates of all runs must match; the time and the bytes read (rchar of
+# /proc/self/io, Linux only) of each run are reported. The script exits with status 1 if they
+# do not match.
+#
+# Usage:
+#   python benchmarks/bench_derived_variables.py --n_times 2160 --time_chunk 720
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import mainGR
+from derived_variables import wind_direction, wind_speed
+
+VARIABLES = ("t2m", "tp", "u10", "v10")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fused derived-variable stage benchmark")
+    parser.add_argument("--n_times", type=int, default=2160, help="Number of hourly time steps")
+    parser.add_argument("--time_chunk", type=int, default=720, help="Time steps per merged chunk")
+    return parser.parse_args()
+
+
+def make_regional_files(directory, n_times, parts=((0, None),)):
+    """
+    Write the regional files of the time steps [start, stop) of every part, one file per variable and part
+    ("GR_<variable>_2000_<start>.nc").
+    """
+    lat = np.arange(42, 33.75, -0.25)
+    lon = np.arange(19, 28.25, 0.25)
+    times = pd.date_range("2000-01-01", periods=n_times, freq="h")
+    rng = np.random.default_rng(0)
+    for variable in VARIABLES:
+        values = 3 * rng.standard_normal((n_times, lat.size, lon.size)) + (280 if variable == "t2m" else 0)
+        if variable == "tp":
+            values = np.abs(values) * 1e-3
+        if variable == "t2m":
+            # Missing values, some of them in the day split between the merges of the appended run.
+            values[::7, :3, :3] = np.nan
+            values[:, 5, 5] = np.nan
+        ds = xr.Dataset({variable: (["valid_time", "latitude", "longitude"], values.astype("float32"))},
+                        coords={"valid_time": times, "latitude": lat, "longitude": lon})
+        encoding = {variable: {"dtype": "int16", "scale_factor": 1e-6 if variable == "tp" else 0.002,
+                               "add_offset": 280.0 if variable == "t2m" else 0.0, "_FillValue": -32767}}
+        for start, stop in parts:
+            ds.isel(valid_time=slice(start, stop)).to_netcdf(
+                os.path.join(directory, f"GR_{variable}_2000_{start}.nc"), encoding=encoding)
+
+
+def separate_passes(directory, merged_path):
+    stem = merged_path[:-len(".nc")]
+    with xr.open_dataset(merged_path) as ds:
+        speed = xr.apply_ufunc(wind_speed, ds["u10"], ds["v10"])
+        direction = xr.apply_ufunc(wind_direction, ds["u10"], ds["v10"])
+        xr.Dataset({"wind_speed": speed, "wind_direction": direction}).astype("float32").to_netcdf(f"{stem}_derived.nc")
+    # The daily aggregates cover every hour, including the one filtered out of the merged file.
+    paths = [os.path.join(directory, f"GR_{variable}_2000_0.nc") for variable in VARIABLES]
+    with xr.open_mfdataset(paths) as ds:
+        ds = ds.load()
+        speed = xr.apply_ufunc(wind_speed, ds["u10"], ds["v10"])
+        daily = ds.resample(valid_time="1D")
+        speed_daily = speed.resample(valid_time="1D")
+        xr.Dataset({"t2m_mean": daily.mean()["t2m"], "t2m_max": daily.max()["t2m"], "t2m_min": daily.min()["t2m"],
+                    "tp_sum": daily.sum()["tp"], "wind_speed_mean": speed_daily.mean(),
+                    "wind_speed_max": speed_daily.max()}).astype("float32").to_netcdf(f"{stem}_daily.nc")
+
+
+def _bytes_read():
+    with open("/proc/self/io") as io_file:
+        return next(int(line.split(":")[1]) for line in io_file if line.startswith("rchar"))
+
+
+def main():
+    args = parse_args()
+    results = {}
+    # Split of the appended run, in the middle of a day.
+    split = (args.n_times // 2) // 24 * 24 + 11
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("separate", "fused", "appended"):
+            directory = os.path.join(tmp, mode)
+            os.makedirs(directory)
+            derived = None if mode == "separate" else {"frequency": "D"}
+            read_before, start = _bytes_read(), time.perf_counter()
+            if mode == "appended":
+                make_regional_files(directory, args.n_times, parts=((0, split),))
+                mainGR.merge_and_filter_nc(directory, output_filename="GR_merged.nc", time_chunk=args.time_chunk,
+                                           derived=derived)
+                make_regional_files(directory, args.n_times, parts=((split, None),))
+            else:
+                make_regional_files(directory, args.n_times)
+            output = mainGR.merge_and_filter_nc(directory, output_filename="GR_merged.nc", time_chunk=args.time_chunk,
+                                                derived=derived)
+            if mode == "separate":
+                separate_passes(directory, output)
+            seconds, read_mb = time.perf_counter() - start, (_bytes_read() - read_before) / 1024 ** 2
+            with xr.open_dataset(os.path.join(directory, "GR_merged_daily.nc")) as daily:
+                results[mode] = daily[["t2m_mean", "t2m_max", "tp_sum", "wind_speed_mean"]].load()
+            print(f"{mode:9s} {seconds:7.2f} s, read {read_mb:8.1f} MiB")
+    failures = []
+    for mode in ("fused", "appended"):
+        error = max(float(np.abs(results[mode][name] - results["separate"][name]).max() /
+                          np.abs(results["separate"][name]).max()) for name in results[mode].data_vars)
+        nan_match = all(np.array_equal(np.isnan(results[mode][name]), np.isnan(results["separate"][name]))
+                        for name in results[mode].data_vars)
+        print(f"{mode}: max relative difference of the daily aggregates: {error:.2e}, same missing cells: {nan_match}")
+        if not (error <= 1e-6 and nan_match):
+            failures.append(mode)
+    if failures:
+        print(f"FAILED: {', '.join(failures)}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
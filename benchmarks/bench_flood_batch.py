@@ -0,0 +1,173 @@
+# Check and benchmark the grouped evaluation of Flood_Mapping/flood_batch.py against a stand-in
+# 'ee' module, without Earth Engine.
+#
+# The stand-in records every call as a lazy node and evaluates only what a request needs: the
+# image counts of the date windows (none for windows starting in 1900) and a flooded area equal
+# to a fixed fraction of the AOI rectangle. Rectangles with west >= east fail on the "server".
+# Every request waits a fixed latency, so grouped evaluation can be compared with one request
+# per event. The script exits with status 1 if a check fails.
+#
+# Usage:
+#   python benchmarks/bench_flood_batch.py --events 200 --group_size 25 --latency 0.05
+
+import argparse
+import math
+import os
+import sys
+import threading
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Flood_Mapping.flood_batch import evaluate_events
+
+# Flooded fraction of every AOI, and area of one square degree in m² in the stand-in.
+FLOODED_FRACTION = 0.01
+SQUARE_DEGREE_M2 = 1e10
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Grouped Earth Engine evaluation check and benchmark")
+    parser.add_argument("--events", type=int, default=200, help="Number of events")
+    parser.add_argument("--group_size", type=int, default=25, help="Events per request")
+    parser.add_argument("--workers", type=int, default=4, help="Number of concurrent requests")
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated seconds per request")
+    return parser.parse_args()
+
+
+class _Node:
+    # A lazy call: 'op' applied to 'receiver' (None for constructors) with the given arguments.
+    def __init__(self, server, op, receiver, args, kwargs):
+        self.server, self.op, self.receiver, self.args, self.kwargs = server, op, receiver, args, kwargs
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: _Node(self.server, name, self, args, kwargs)
+
+    def getInfo(self):
+        return self.server.request(self)
+
+
+class _Constructor:
+    # ee.Image, ee.Filter, ...: callable, and a namespace of static functions.
+    def __init__(self, server, name):
+        self.server, self.name = server, name
+
+    def __call__(self, *args, **kwargs):
+        return _Node(self.server, self.name, None, args, kwargs)
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: _Node(self.server, name, None, args, kwargs)
+
+
+class FakeEarthEngine:
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.module = types.ModuleType("ee")
+        for name in ("Geometry", "ImageCollection", "Filter", "Image", "Algorithms", "Reducer",
+                     "Number", "Dictionary", "List"):
+            setattr(self.module, name, _Constructor(self, name))
+        self.module.Initialize = self.module.Authenticate = lambda *args, **kwargs: None
+
+    def request(self, node):
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+        return self.evaluate(node)
+
+    def evaluate(self, value):
+        if isinstance(value, (list, tuple)):
+            return [self.evaluate(item) for item in value]
+        if isinstance(value, dict):
+            return {key: self.evaluate(item) for key, item in value.items()}
+        if not isinstance(value, _Node):
+            return value
+        op, receiver, args, kwargs = value.op, value.receiver, value.args, value.kwargs
+        if op == "Rectangle":
+            west, south, east, north = args[0]
+            if west >= east:
+                raise ValueError("Geometry.Rectangle: invalid coordinates")
+            return (east - west) * (north - south)
+        if op == "ImageCollection":
+            return 3
+        if op == "filter":
+            images = self.evaluate(receiver)
+            condition = args[0]
+            return 0 if condition.op == "date" and str(condition.args[0]).startswith("1900") else images
+        if op in ("filterBounds", "select", "size"):
+            return self.evaluate(receiver)
+        if op == "reduceRegion":
+            return {"Water": FLOODED_FRACTION * self.evaluate(kwargs["geometry"]) * SQUARE_DEGREE_M2}
+        if op == "get":
+            return self.evaluate(receiver).get(*self.evaluate(list(args)))
+        if op == "If":
+            condition, true_case, false_case = args
+            return self.evaluate(true_case if self.evaluate(condition) else false_case)
+        if op in ("Number", "Dictionary", "List"):
+            return self.evaluate(args[0])
+        operations = {"divide": lambda a, b: a / b, "min": min, "gt": lambda a, b: a > b}
+        if op in operations:
+            return operations[op](self.evaluate(receiver), self.evaluate(args[0]))
+        raise NotImplementedError(f"The stand-in cannot evaluate '{op}'.")
+
+
+def make_events(n_events):
+    events = []
+    for index in range(n_events):
+        west, south = 20 + (index % 10) * 0.5, 35 + (index // 10) * 0.1
+        events.append({"event_id": f"event_{index:04d}", "west": west, "south": south,
+                       "east": west + 0.25 + 0.01 * (index % 7), "north": south + 0.2,
+                       "before_start": "2019-01-01", "before_end": "2019-02-01",
+                       "after_start": "2019-02-01", "after_end": "2019-03-01"})
+    # One event without images before it, and one with an invalid AOI.
+    events[3]["before_start"] = "1900-01-01"
+    events[3]["before_end"] = "1900-02-01"
+    events[5]["east"] = events[5]["west"]
+    return events
+
+
+def check(rows, events):
+    for row, event in zip(rows, events):
+        if row["event_id"] != event["event_id"]:
+            return "rows out of order"
+        if event is events[3]:
+            if row["flooded_ha"] is not None or row["before_images"] != 0 or row["error"]:
+                return "empty date window not reported as a null area"
+        elif event is events[5]:
+            if not row["error"]:
+                return "invalid AOI not reported as an error"
+        else:
+            expected = FLOODED_FRACTION * (event["east"] - event["west"]) * (event["north"] - event["south"]) \
+                * SQUARE_DEGREE_M2 / 10000
+            if row["error"] or not math.isclose(row["flooded_ha"], expected):
+                return f"wrong area for {event['event_id']}"
+    return "ok" if len(rows) == len(events) else "missing rows"
+
+
+def main():
+    args = parse_args()
+    if args.events < 6:
+        sys.exit("--events must be at least 6: events 3 and 5 are the failure cases.")
+    events = make_events(args.events)
+    failures = []
+    for label, group_size, workers in (("one request per event", 1, 1),
+                                       (f"groups of {args.group_size}", args.group_size, 1),
+                                       (f"groups of {args.group_size}, {args.workers} workers",
+                                        args.group_size, args.workers)):
+        fake = FakeEarthEngine(args.latency)
+        start = time.perf_counter()
+        rows = evaluate_events(events, fake.module, group_size=group_size, workers=workers)
+        seconds = time.perf_counter() - start
+        result = check(rows, events)
+        if result != "ok":
+            failures.append(f"{label}: {result}")
+        print(f"{args.events} events, {label}: {fake.requests} requests, {seconds:.2f} s, check: {result}")
+
+    if failures:
+        print(f"FAILED: {', '.join(failures)}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# Check and benchmark the offline flood-mapping pipeline of Flood_Mapping/local_flood_mapping.py
+# on a small synthetic fixture.
+#
+# The fixture is a flat scene with planted flood patches of known size: rectangles, small
+# clusters that the connected-pixel-count mask must drop (1 and 2 pixels) or keep (3 pixels),
+# a patch outside permanent water (JRC seasonality <= 5) and a patch on a steep slope. The tiled
+# and parallel runs must reproduce the whole-scene mask exactly and the expected hectares. The
+# script exits with status 1 if a check fails.
+#
+# Usage:
+#   python benchmarks/bench_flood_mapping.py --size 2048 --tile_size 512 --workers 4
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Flood_Mapping.local_flood_mapping import flood_mask, map_floods, read_raster, write_mask
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline flood-mapping check and benchmark")
+    parser.add_argument("--size", type=int, default=1024, help="Scene edge length in pixels")
+    parser.add_argument("--tile_size", type=int, default=256, help="Tile edge length in pixels")
+    parser.add_argument("--workers", type=int, default=4, help="Number of worker processes")
+    return parser.parse_args()
+
+
+def make_fixture(size, rng):
+    """
+    Build (before, after, seasonality, elevation, expected_mask) on 30 m pixels.
+    """
+    before = -8 + 0.3 * rng.standard_normal((size, size))
+    after = before + 0.3 * rng.standard_normal((size, size))
+    seasonality = np.full((size, size), 12.0)
+    elevation = np.zeros((size, size))
+    expected = np.zeros((size, size), dtype=bool)
+
+    def flood(rows, cols, kept=True):
+        after[rows, cols] = -20 + 0.3 * rng.standard_normal(after[rows, cols].shape)
+        expected[rows, cols] = kept
+
+    # Large patches, one of them across what will be tile boundaries.
+    flood(slice(100, 180), slice(100, 300))
+    flood(slice(size // 2 - 40, size // 2 + 40), slice(size // 4 - 30, size // 4 + 30))
+    # Isolated pixel and 2-pixel pair (dropped), 3-pixel L shape (kept).
+    flood(slice(400, 401), slice(50, 51), kept=False)
+    flood(slice(420, 421), slice(50, 52), kept=False)
+    flood(slice(440, 442), slice(50, 51))
+    flood(slice(441, 442), slice(51, 52))
+    # Patch outside permanent water.
+    flood(slice(600, 640), slice(600, 640), kept=False)
+    seasonality[600:640, 600:640] = 3
+    # Patch on a 45 degree slope.
+    flood(slice(700, 740), slice(100, 140), kept=False)
+    elevation[:, :] = 0
+    elevation[690:750, 90:150] = 30.0 * np.arange(60)[np.newaxis, :]
+    return before, after, seasonality, elevation, expected
+
+
+def geotiff_round_trip(before, after, seasonality, elevation, tile_size, workers):
+    """
+    Map the fixture from GeoTIFF inputs through the lazy tile reader; None without rasterio.
+    """
+    try:
+        import rasterio
+        from rasterio.transform import from_origin
+    except ImportError:
+        return None
+    size = before.shape[0]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        profile = dict(driver="GTiff", height=size, width=size, count=1, dtype="float32",
+                       crs="EPSG:32634", transform=from_origin(500000, 4200000, 30, 30), nodata=-9999)
+        paths = {}
+        for name, data in (("before", before), ("after", after), ("seasonality", seasonality),
+                           ("elevation", elevation)):
+            paths[name] = os.path.join(tmp_dir, f"{name}.tif")
+            with rasterio.open(paths[name], "w", **profile) as dst:
+                dst.write(data.astype("float32"), 1)
+        sources = {name: read_raster(path) for name, path in paths.items()}
+        meta = sources["before"][1]
+        result = map_floods(*(sources[name][0] for name in ("before", "after", "seasonality", "elevation")),
+                            pixel_size=meta["pixel_size"], pixel_area=meta["pixel_area"],
+                            tile_size=tile_size, workers=workers)
+        write_mask(os.path.join(tmp_dir, "flooded.tif"), result["flooded"], meta)
+    return result
+
+
+def main():
+    args = parse_args()
+    failures = []
+
+    def check(condition, message):
+        if not condition:
+            failures.append(message)
+        return condition
+
+    rng = np.random.default_rng(0)
+    size = max(args.size, 1024)
+    before, after, seasonality, elevation, expected = make_fixture(size, rng)
+    pixel_size = (30.0, 30.0)
+    expected_ha = expected.sum() * 900 / 10000
+
+    start = time.perf_counter()
+    whole = flood_mask(before, after, seasonality, elevation, pixel_size=pixel_size)
+    whole_seconds = time.perf_counter() - start
+    print(f"scene {size}x{size}: whole-scene mask {whole_seconds:.3f} s, "
+          f"matches the planted floods: {check(np.array_equal(whole, expected), 'whole-scene mask')}")
+
+    for workers in (1, args.workers):
+        start = time.perf_counter()
+        result = map_floods(before, after, seasonality, elevation, pixel_size=pixel_size,
+                            tile_size=args.tile_size, workers=workers)
+        seconds = time.perf_counter() - start
+        print(f"tiles of {args.tile_size}, {workers} workers: {seconds:.3f} s "
+              f"({size * size / seconds / 1e6:.1f} Mpixels/s), identical to whole scene: "
+              f"{check(np.array_equal(result['flooded'].astype(bool), whole), f'tiled mask, {workers} workers')}, "
+              f"area {result['area_ha']:.2f} ha (expected {expected_ha:.2f} ha)")
+        check(np.isclose(result["area_ha"], expected_ha), f"flooded area, {workers} workers")
+
+    # GeoTIFF round trip through the lazy tile reader, when rasterio is available.
+    result = geotiff_round_trip(before, after, seasonality, elevation, args.tile_size, args.workers)
+    if result is not None:
+        print(f"GeoTIFF inputs: area {result['area_ha']:.2f} ha, matches the planted floods: "
+              f"{check(np.array_equal(result['flooded'].astype(bool), expected), 'GeoTIFF inputs')}")
+
+    if failures:
+        print(f"FAILED: {', '.join(failures)}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# Check and benchmark the time series mode of Flood_Mapping/local_flood_mapping.py.
+#
+# The fixture is a flat scene seen on several before dates, one of them with a wet patch and
+# one covering only part of the scene, and on several after dates with planted floods of known
+# size that grow and recede. The flood masks of every date are computed:
+#
+#   per date     the baseline composite and 'map_floods' again for every date, as a loop over
+#                single-mosaic runs would
+#   series       'map_flood_series', tiled, with the baseline and static masks shared by the dates
+#
+# Both must find the planted floods of every date; the series must match a whole-scene
+# 'flood_series_mask' exactly. The mosaic baseline of floodMapping.py is also shown to depend
+# on the scene order, unlike the median. The script exits with status 1 if a check fails.
+#
+# Usage:
+#   python benchmarks/bench_flood_series.py --size 1024 --dates 8 --tile_size 256 --workers 4
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Flood_Mapping.local_flood_mapping import composite, flood_series_mask, map_flood_series, map_floods, mosaic
+
+PIXEL_HA = 900 / 10000
+# Smallest scene whose planted floods are large enough for the connected-pixel-count mask.
+MIN_SIZE = 128
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Flood time series check and benchmark")
+    parser.add_argument("--size", type=int, default=1024, help="Scene edge length in pixels")
+    parser.add_argument("--before", type=int, default=6, help="Number of before scenes")
+    parser.add_argument("--dates", type=int, default=8, help="Number of after dates")
+    parser.add_argument("--tile_size", type=int, default=256, help="Tile edge length in pixels")
+    parser.add_argument("--workers", type=int, default=4, help="Number of worker processes")
+    return parser.parse_args()
+
+
+def make_fixture(size, n_before, n_dates, rng):
+    """
+    Build (before scenes, {date: after scene}, seasonality, expected masks) on 30 m pixels.
+
+    Patches are placed and sized in fractions of the scene, so that they fit any size from
+    MIN_SIZE and any number of dates.
+    """
+    def at(fraction):
+        return int(round(fraction * size))
+
+    ground = -8 + 0.2 * rng.standard_normal((size, size))
+    before = [ground + 0.2 * rng.standard_normal((size, size)) for _ in range(n_before)]
+    # A wet before scene (last, so that it is on top of a mosaic) and a partial one.
+    before[-1][at(0.1):at(0.2), at(0.1):at(0.3)] = -20
+    before[0][:, size // 2:] = np.nan
+    seasonality = np.full((size, size), 12.0)
+
+    after, expected = {}, []
+    peak = max((n_dates - 1) // 2, 1)
+    for index in range(n_dates):
+        scene = ground + 0.2 * rng.standard_normal((size, size))
+        mask = np.zeros((size, size), dtype=bool)
+        # A flood that grows from 2 % to 8 % of the scene edge, then recedes, in the wet patch
+        # of the before scene and elsewhere.
+        extent = at(0.02 + 0.06 * min(index, n_dates - 1 - index) / peak)
+        centre = at(0.15)
+        mask[centre - extent // 2:centre + extent // 2, at(0.12):at(0.28)] = True
+        mask[size // 2:size // 2 + extent, size // 3:size // 3 + 2 * extent] = True
+        scene[mask] = -20 + 0.2 * rng.standard_normal(mask.sum())
+        after[f"2019-08-{10 + index:02d}"] = scene
+        expected.append(mask)
+    return before, after, seasonality, np.array(expected)
+
+
+def main():
+    args = parse_args()
+    if args.size < MIN_SIZE:
+        sys.exit(f"--size must be at least {MIN_SIZE} pixels.")
+    failures = []
+
+    def check(condition, message):
+        if not condition:
+            failures.append(message)
+        return condition
+
+    rng = np.random.default_rng(0)
+    before, after, seasonality, expected = make_fixture(args.size, args.before, args.dates, rng)
+    print(f"scene {args.size}x{args.size}, {args.before} before scenes, {args.dates} after dates")
+
+    reordered = before[::-1]
+    print(f"median baseline independent of the scene order: "
+          f"{check(np.array_equal(composite(before), composite(reordered), equal_nan=True), 'median order')}; "
+          f"mosaic baseline: {np.array_equal(mosaic(before), mosaic(reordered), equal_nan=True)}")
+
+    start = time.perf_counter()
+    per_date = []
+    for date in sorted(after):
+        reference = composite(before)
+        per_date.append(map_floods(reference, after[date], seasonality, tile_size=args.tile_size)["flooded"])
+    per_date_seconds = time.perf_counter() - start
+    print(f"per date        {per_date_seconds:7.3f} s, matches the planted floods: "
+          f"{check(np.array_equal(np.array(per_date, dtype=bool), expected), 'per date masks')}")
+
+    mosaic_area = map_floods(mosaic(before), after[sorted(after)[0]], seasonality)["area_ha"]
+    print(f"mosaic baseline, first date: {mosaic_area:.2f} ha (expected {expected[0].sum() * PIXEL_HA:.2f} ha)")
+
+    whole = flood_series_mask(before, [after[date] for date in sorted(after)], seasonality)
+    for workers in (1, args.workers):
+        start = time.perf_counter()
+        result = map_flood_series(before, after, seasonality, tile_size=args.tile_size, workers=workers)
+        seconds = time.perf_counter() - start
+        areas_ok = check(np.allclose(result["area_ha"], expected.sum(axis=(1, 2)) * PIXEL_HA),
+                         f"series areas, {workers} workers")
+        identical = check(np.array_equal(result['flooded'], whole), f"series masks, {workers} workers")
+        print(f"series, {workers} workers {seconds:7.3f} s ({per_date_seconds / seconds:.1f}x), identical to the "
+              f"whole scene: {identical}, areas match: {areas_ok}")
+    print("flooded ha per date:", ", ".join(f"{area:.1f}" for area in result["area_ha"]))
+
+    if failures:
+        print(f"FAILED: {', '.join(failures)}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Check the cold-start cost of importing every module of the repository.
+#
+# Each module is imported in a fresh interpreter with 'python -X importtime'; the best of a few
+# runs must stay within the module's budget, and no module may import the heavy optional
+# dependencies (Earth Engine, geemap, cdsapi, matplotlib, scipy) at import time: those are only
+# imported by the functions that use them. The exit status is 1 if any module fails, so the
+# check can run in CI.
+#
+# Usage:
+#   python benchmarks/bench_import_time.py --repeat 3 --scale 1.0
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be imported when importing any module of the repository.
+LAZY_MODULES = ("ee", "geemap", "cdsapi", "matplotlib", "scipy")
+
+# Cold-start budgets in milliseconds: about twice the measured time, by heaviest dependency.
+XARRAY_BUDGET = 1000
+NUMPY_BUDGET = 300
+STDLIB_BUDGET = 100
+BUDGETS = {
+    "mainGR": XARRAY_BUDGET,
+    "region_subset": XARRAY_BUDGET,
+    "derived_variables": XARRAY_BUDGET,
+    "cds_planner": STDLIB_BUDGET,
+    "cds_scheduler": STDLIB_BUDGET,
+    "pipeline_metrics": STDLIB_BUDGET,
+    "era5_inventory": STDLIB_BUDGET,
+    "era5_single_data_acquisition": STDLIB_BUDGET,
+    "ERA5_Interpolation.era5_surface_data_acquisition": STDLIB_BUDGET,
+    "ERA5_Interpolation.regrid": NUMPY_BUDGET,
+    "ERA5_Interpolation.regrid_engines": NUMPY_BUDGET,
+    "ERA5_Interpolation.weight_cache": NUMPY_BUDGET,
+    "ERA5_Interpolation.stream_writer": NUMPY_BUDGET,
+    "ERA5_Interpolation.point_extraction": NUMPY_BUDGET,
+    "ERA5_Interpolation.ERA5_Interpolation_Script": XARRAY_BUDGET,
+    "ERA5_Interpolation.batch_interpolation": XARRAY_BUDGET,
+    "Flood_Mapping.floodMapping": STDLIB_BUDGET,
+    "Flood_Mapping.flood_batch": STDLIB_BUDGET,
+    "Flood_Mapping.local_flood_mapping": NUMPY_BUDGET,
+    "Flood_Mapping.speckle_filter": NUMPY_BUDGET,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import-time budget check")
+    parser.add_argument("--repeat", type=int, default=3, help="Imports per module; the fastest one counts")
+    parser.add_argument("--scale", type=float, default=1.0, help="Factor applied to every budget (e.g. on slow machines)")
+    return parser.parse_args()
+
+
+def import_profile(module):
+    """
+    Import 'module' in a fresh interpreter and return (total milliseconds, top-level modules imported).
+    Raises ImportError with the last line of the traceback if the import fails.
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               cwd=ROOT, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise ImportError(completed.stderr.strip().splitlines()[-1])
+    # Lines are "import time: self [us] | cumulative | imported package", the requested module last.
+    rows = [line.split("|") for line in completed.stderr.splitlines() if line.startswith("import time:")]
+    rows = [row for row in rows if row[1].strip().isdigit()]
+    imported = {row[2].strip().split(".")[0] for row in rows}
+    return int(rows[-1][1]) / 1000, imported
+
+
+def main():
+    args = parse_args()
+    failures = 0
+    for module, budget in BUDGETS.items():
+        try:
+            profiles = [import_profile(module) for _ in range(args.repeat)]
+        except ImportError as error:
+            failures += 1
+            print(f"{module:50s} import failed: {error}  FAILED")
+            continue
+        milliseconds = min(total for total, _ in profiles)
+        eager = sorted(set(LAZY_MODULES) & profiles[0][1])
+        ok = milliseconds <= budget * args.scale and not eager
+        failures += not ok
+        print(f"{module:50s} {milliseconds:8.1f} ms (budget {budget * args.scale:6.0f} ms)"
+              f"{'  imports ' + ', '.join(eager) if eager else ''}  {'ok' if ok else 'FAILED'}")
+    print(f"{len(BUDGETS) - failures}/{len(BUDGETS)} modules within budget")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
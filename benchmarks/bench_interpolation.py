@@ -0,0 +1,102 @@
+# Benchmark the batched regridding engine of NetCDFInterpolator against the original
+# per-time-step RegularGridInterpolator path.
+#
+# Usage:
+#   python benchmarks/bench_interpolation.py --n_times 720 --grid_step 0.02
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy.interpolate import RegularGridInterpolator
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ERA5_Interpolation.ERA5_Interpolation_Script import NetCDFInterpolator
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Regridding benchmark")
+    parser.add_argument("--n_times", type=int, default=240, help="Number of hourly time steps")
+    parser.add_argument("--grid_step", type=float, default=0.02, help="Target grid step in degrees")
+    parser.add_argument("--method", type=str, default="linear", choices=["linear", "nearest"])
+    parser.add_argument("--time_chunk", type=int, default=240, help="Time steps per batched block")
+    return parser.parse_args()
+
+
+def make_era5_like_file(path, n_times):
+    """
+    Write a synthetic ERA5-shaped file on the 0.25 degree Greece grid (descending latitudes).
+    """
+    lat = np.arange(42, 33.75, -0.25)
+    lon = np.arange(19, 28.25, 0.25)
+    times = pd.date_range("2000-01-01", periods=n_times, freq="h")
+    rng = np.random.default_rng(0)
+    values = 280 + 10 * rng.standard_normal((n_times, lat.size, lon.size))
+    ds = xr.Dataset(
+        {"t2m": (["valid_time", "latitude", "longitude"], values)},
+        coords={"valid_time": times, "latitude": lat, "longitude": lon},
+    )
+    ds.to_netcdf(path)
+
+
+def interpolate_per_step(dataset, variable_name, grid_step, method):
+    """
+    Reference implementation: the original loop, rebuilding the interpolator per time step.
+    """
+    interpolated_data = []
+    for time_value in dataset.valid_time:
+        time_step = dataset.sel(valid_time=time_value)
+        lat = time_step['latitude'].values
+        lon = time_step['longitude'].values
+        variable = time_step[variable_name].values
+        num_lat_points = int((lat.max() - lat.min()) / grid_step) + 1
+        num_lon_points = int((lon.max() - lon.min()) / grid_step) + 1
+        new_lat = np.linspace(lat.min(), lat.max(), num=num_lat_points)
+        new_lon = np.linspace(lon.min(), lon.max(), num=num_lon_points)
+        interpolating_function = RegularGridInterpolator((lat, lon), variable, method=method)
+        new_lon_grid, new_lat_grid = np.meshgrid(new_lon, new_lat)
+        new_points = np.array([new_lat_grid.flatten(), new_lon_grid.flatten()]).T
+        interpolated_variable = interpolating_function(new_points).reshape(new_lat_grid.shape)
+        interpolated_data.append(xr.Dataset(
+            {variable_name: (['latitude', 'longitude'], interpolated_variable)},
+            coords={'latitude': new_lat, 'longitude': new_lon, 'valid_time': time_value.values},
+        ))
+    return xr.concat(interpolated_data, dim='valid_time')
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "t2m_bench.nc")
+        make_era5_like_file(path, args.n_times)
+
+        interpolator = NetCDFInterpolator(path, "t2m", grid_step=args.grid_step,
+                                          method=args.method, time_chunk=args.time_chunk)
+        interpolator.dataset.load()
+
+        start = time.perf_counter()
+        reference = interpolate_per_step(interpolator.dataset, "t2m", args.grid_step, args.method)
+        per_step_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        interpolator.interpolate()
+        batched = xr.concat(interpolator.interpolated_data, dim='valid_time')
+        batched_seconds = time.perf_counter() - start
+
+        max_abs_diff = float(np.abs(batched["t2m"].values - reference["t2m"].values).max())
+        interpolator.dataset.close()
+
+    n_points = batched["t2m"].size
+    print(f"time steps: {args.n_times}, target grid: {batched.sizes['latitude']}x{batched.sizes['longitude']}")
+    print(f"per-step path: {per_step_seconds:.3f} s ({n_points / per_step_seconds / 1e6:.2f} Mpoints/s)")
+    print(f"batched path:  {batched_seconds:.3f} s ({n_points / batched_seconds / 1e6:.2f} Mpoints/s)")
+    print(f"speed-up: {per_step_seconds / batched_seconds:.1f}x, max abs difference: {max_abs_diff:.3e}")
+
+
+if __name__ == "__main__":
+    main()
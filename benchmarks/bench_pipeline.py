@@ -0,0 +1,231 @@
+# End-to-end benchmark of the processing pipeline on synthetic ERA5-shaped data.
+#
+# Synthetic CDS-style downloads (one ZIP per variable and year, each holding one global NetCDF
+# file packed as int16) are generated with a configurable grid, number of time steps, variables
+# and years. The stages are then timed one after the other on them, as mainGR.py and the
+# interpolation script chain them:
+#
+#   extract      mainGR.extract_zip_files
+#   subset       mainGR.process_netcdf_files (Greece)
+#   merge        mainGR.merge_and_filter_nc
+#   interpolate  NetCDFInterpolator.stream_to_file (every variable of the merged file)
+#   flood        local_flood_mapping.map_floods on the fixture of bench_flood_mapping.py
+#
+# Every stage runs in a fresh process, which reports its wall time, its peak resident set size
+# (including worker processes) and the bytes it read and wrote (rchar/wchar of /proc/self/io,
+# which include the reaped workers and the pipes to them, so the benchmark needs Linux). Each
+# run is appended to a JSON history together with the commit and the configuration; stages that
+# are slower than the last run of the same configuration by more than --tolerance are reported
+# as regressions.
+#
+# Usage:
+#   python benchmarks/bench_pipeline.py --grid_step 0.5 --n_times 48 --n_variables 2 --n_years 2
+
+import argparse
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import pipeline_metrics
+from region_subset import REGIONS
+
+# ERA5 short names of the synthetic variables, in the order they are added.
+VARIABLES = ("t2m", "tp", "u10", "v10", "msl", "sp", "d2m", "tcwv")
+STAGES = ("extract", "subset", "merge", "interpolate", "flood")
+DEFAULT_HISTORY = os.path.join(ROOT, "benchmarks", "pipeline_history.json")
+SPAWN = multiprocessing.get_context("spawn")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark")
+    parser.add_argument("--grid_step", type=float, default=0.5, help="Step of the global source grid in degrees")
+    parser.add_argument("--n_times", type=int, default=48, help="Hourly time steps per file (one file per year)")
+    parser.add_argument("--n_variables", type=int, default=2, choices=range(1, len(VARIABLES) + 1),
+                        help="Number of variables")
+    parser.add_argument("--n_years", type=int, default=2, help="Number of years (files per variable)")
+    parser.add_argument("--target_step", type=float, default=0.05, help="Interpolation grid step in degrees")
+    parser.add_argument("--flood_size", type=int, default=2048, help="Edge length of the flood scene in pixels")
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes or threads of every stage")
+    parser.add_argument("--stages", type=str, nargs="+", default=list(STAGES), choices=STAGES,
+                        help="Stages to run (later stages need the outputs of the earlier ones)")
+    parser.add_argument("--history", type=str, default=DEFAULT_HISTORY, help="JSON file the results are appended to")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative slow-down from the previous comparable run reported as a regression")
+    parser.add_argument("--work_dir", type=str, default=None,
+                        help="Directory for the fixtures and outputs (default: a temporary directory)")
+    return parser.parse_args()
+
+
+# ---------------------------
+# 1. Synthetic fixtures
+# ---------------------------
+def make_era5_file(path, variable, year, n_times, grid_step, rng):
+    """
+    Write one global ERA5-shaped file: descending latitudes, 0-360 longitudes, 'valid_time',
+    values packed as int16 as in CDS downloads.
+    """
+    lat = np.arange(90, -90 - grid_step / 2, -grid_step)
+    lon = np.arange(0, 360, grid_step)
+    times = pd.date_range(f"{year}-01-01", periods=n_times, freq="h")
+    # A smooth field with a daily cycle and a little noise, so that compression behaves realistically.
+    field = 20 * np.cos(np.deg2rad(lat))[:, np.newaxis] + 2 * np.sin(np.deg2rad(lon))
+    cycle = 5 * np.sin(2 * np.pi * np.arange(n_times) / 24)
+    values = (field + cycle[:, np.newaxis, np.newaxis]
+              + 0.1 * rng.standard_normal((n_times, lat.size, lon.size))).astype("float32")
+    ds = xr.Dataset(
+        {variable: (["valid_time", "latitude", "longitude"], values)},
+        coords={"valid_time": times, "latitude": lat, "longitude": lon},
+    )
+    encoding = {variable: {"dtype": "int16", "scale_factor": 0.002, "add_offset": 0.0, "_FillValue": -32767}}
+    ds.to_netcdf(path, encoding=encoding)
+
+
+def make_downloads(data_dir, n_variables, n_years, n_times, grid_step):
+    """
+    Write one deflated ZIP per variable and year, named like the CDS targets of
+    era5_single_data_acquisition.py ("<variable>_Y<year>.nc.zip"). Returns the total ZIP size.
+    """
+    rng = np.random.default_rng(0)
+    total = 0
+    for variable in VARIABLES[:n_variables]:
+        for year in range(2000, 2000 + n_years):
+            zip_path = os.path.join(data_dir, f"{variable}_Y{year}.nc.zip")
+            with tempfile.NamedTemporaryFile(suffix=".nc", dir=data_dir) as nc_file:
+                make_era5_file(nc_file.name, variable, year, n_times, grid_step, rng)
+                with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zip_ref:
+                    zip_ref.write(nc_file.name, "data_stream-oper_stepType-instant.nc")
+            total += os.path.getsize(zip_path)
+    return total
+
+
+# ---------------------------
+# 2. Stages
+# ---------------------------
+def _stage(name, dirs, config):
+    # Runs one stage in the current process.
+    import mainGR
+
+    lat_min, lat_max, lon_min, lon_max = REGIONS["greece"]["bounds"]
+    if name == "extract":
+        mainGR.extract_zip_files(dirs["data"], dirs["extract"], workers=config["workers"])
+    elif name == "subset":
+        mainGR.process_netcdf_files(dirs["extract"], dirs["regional"], lat_min, lat_max, lon_min, lon_max,
+                                    workers=config["workers"])
+    elif name == "merge":
+        mainGR.merge_and_filter_nc(dirs["regional"], output_filename=dirs["merged"])
+    elif name == "interpolate":
+        from ERA5_Interpolation.ERA5_Interpolation_Script import NetCDFInterpolator
+
+        interpolator = NetCDFInterpolator(dirs["merged"], grid_step=config["target_step"])
+        interpolator.stream_to_file(dirs["interpolated"])
+        interpolator.dataset.close()
+    elif name == "flood":
+        from benchmarks.bench_flood_mapping import make_fixture
+        from Flood_Mapping.local_flood_mapping import map_floods
+
+        before, after, seasonality, elevation, _ = make_fixture(config["flood_size"], np.random.default_rng(0))
+        start = time.perf_counter()
+        map_floods(before, after, seasonality, elevation, tile_size=512, workers=config["workers"])
+        return time.perf_counter() - start
+    return None
+
+
+def run_stage(name, dirs, config):
+    """
+    Run one stage and return its metrics. Called in a fresh process by 'measure'.
+    """
+    seconds, metrics = pipeline_metrics.measure(_stage, name, dirs, config)
+    # The children are the stage's reaped worker processes.
+    peak_rss_mb = max(metrics["peak_rss_mb"], metrics.get("children_peak_rss_mb") or 0)
+    return {"seconds": metrics["seconds"] if seconds is None else seconds, "peak_rss_mb": peak_rss_mb,
+            "read_mb": metrics["read_bytes"] / 1024 ** 2, "written_mb": metrics["written_bytes"] / 1024 ** 2}
+
+
+def measure(name, dirs, config):
+    with ProcessPoolExecutor(max_workers=1, mp_context=SPAWN) as executor:
+        return executor.submit(run_stage, name, dirs, config).result()
+
+
+# ---------------------------
+# 3. History
+# ---------------------------
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def append_history(path, run):
+    """
+    Append a run to the JSON history and return the previous run with the same configuration.
+    """
+    history = []
+    if os.path.exists(path):
+        with open(path) as history_file:
+            history = json.load(history_file)
+    previous = next((past for past in reversed(history) if past["config"] == run["config"]), None)
+    history.append(run)
+    tmp_path = f"{path}.part"
+    with open(tmp_path, "w") as history_file:
+        json.dump(history, history_file, indent=1)
+    os.replace(tmp_path, path)
+    return previous
+
+
+def main():
+    args = parse_args()
+    config = {key: getattr(args, key) for key in ("grid_step", "n_times", "n_variables", "n_years", "target_step",
+                                                   "flood_size", "workers")}
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as work_dir:
+        dirs = {name: os.path.join(work_dir, name) for name in ("data", "extract", "regional")}
+        for directory in dirs.values():
+            os.makedirs(directory)
+        dirs["merged"] = os.path.join(work_dir, "GR_merged_filtered.nc")
+        dirs["interpolated"] = os.path.join(work_dir, "GR_interpolated.nc")
+
+        zip_bytes = make_downloads(dirs["data"], args.n_variables, args.n_years, args.n_times, args.grid_step)
+        print(f"{args.n_variables} variables x {args.n_years} years of {args.n_times} steps on a "
+              f"{args.grid_step} degree grid: {zip_bytes / 1024 ** 2:.1f} MiB of ZIP files")
+
+        stages = {}
+        for name in STAGES:
+            if name not in args.stages:
+                continue
+            stages[name] = measure(name, dirs, config)
+            metrics = stages[name]
+            print(f"{name:12s} {metrics['seconds']:8.3f} s, peak RSS {metrics['peak_rss_mb']:7.1f} MiB, "
+                  f"read {metrics['read_mb']:8.1f} MiB, written {metrics['written_mb']:8.1f} MiB")
+
+    run = {"date": datetime.datetime.now().isoformat(timespec="seconds"), "commit": _commit(),
+           "python": sys.version.split()[0], "config": config, "stages": stages}
+    previous = append_history(args.history, run)
+    if previous is None:
+        print(f"Recorded in {args.history} (no previous run with this configuration)")
+        return
+    for name, metrics in stages.items():
+        before = previous["stages"].get(name)
+        if before is None:
+            continue
+        ratio = metrics["seconds"] / before["seconds"]
+        flag = "  REGRESSION" if ratio > 1 + args.tolerance else ""
+        print(f"{name:12s} {ratio:5.2f}x the time of {previous['commit'] or previous['date']}{flag}")
+    print(f"Recorded in {args.history}")
+
+
+if __name__ == "__main__":
+    main()
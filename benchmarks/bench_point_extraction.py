@@ -0,0 +1,121 @@
+# Check and benchmark station series extraction (ERA5_Interpolation/point_extraction.py).
+#
+# A synthetic file shaped like the output of NetCDFInterpolator.stream_to_file (descending
+# latitudes, one chunk per time step) is written, and the series of random stations are
+# extracted:
+#
+#   per station   xarray .interp of every station on the lazily opened file (the reference)
+#   extractor     PointExtractor on the same file
+#   time-major    PointExtractor on the copy written by rechunk_time_major
+#
+# The extracted series must match the reference; the number of hyperslab reads and the
+# time of each path are reported. The script exits with status 1 if a check fails.
+#
+# Usage:
+#   python benchmarks/bench_point_extraction.py --n_times 2920 --grid_step 0.1 --stations 500
+
+import argparse
+import math
+import os
+import sys
+import tempfile
+import time
+
+import netCDF4
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ERA5_Interpolation.point_extraction import DEFAULT_TIME_BLOCK, PointExtractor, rechunk_time_major
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Point extraction check and benchmark")
+    parser.add_argument("--n_times", type=int, default=2920, help="Number of 3-hourly time steps")
+    parser.add_argument("--grid_step", type=float, default=0.1, help="Grid step in degrees")
+    parser.add_argument("--stations", type=int, default=500, help="Number of stations")
+    parser.add_argument("--reference_stations", type=int, default=25,
+                        help="Stations extracted with xarray .interp (the time is scaled to all stations)")
+    parser.add_argument("--method", type=str, default="linear", choices=["linear", "nearest"])
+    return parser.parse_args()
+
+
+def make_interpolated_like_file(path, n_times, grid_step):
+    """
+    Write a float32 file on a Greece grid, chunked by single time steps as stream_to_file does.
+    """
+    lat = np.round(np.arange(42, 34 - grid_step / 2, -grid_step), 6)
+    lon = np.round(np.arange(19, 28 + grid_step / 2, grid_step), 6)
+    times = pd.date_range("2000-01-01", periods=n_times, freq="3h")
+    rng = np.random.default_rng(0)
+    values = (280 + 5 * np.sin(2 * np.pi * np.arange(n_times) / 8)[:, np.newaxis, np.newaxis]
+              + rng.standard_normal((n_times, lat.size, lon.size))).astype("float32")
+    ds = xr.Dataset(
+        {"t2m": (["valid_time", "latitude", "longitude"], values, {"units": "K"})},
+        coords={"valid_time": times, "latitude": lat, "longitude": lon},
+    )
+    ds.to_netcdf(path, encoding={"t2m": {"chunksizes": (1, lat.size, lon.size)}})
+    return lat, lon
+
+
+def count_reads(extractor, path):
+    # Hyperslab reads issued by PointExtractor.read_cells.
+    with netCDF4.Dataset(path) as nc:
+        chunk_time, chunk_lat, chunk_lon = nc["t2m"].chunking()
+        n_times = nc["t2m"].shape[0]
+    block = chunk_time * max(1, -(-DEFAULT_TIME_BLOCK // chunk_time))
+    return len(extractor.read_plan((chunk_lat, chunk_lon))) * math.ceil(n_times / block)
+
+
+def main():
+    args = parse_args()
+    failures = []
+    rng = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "interpolated.nc")
+        time_major_path = os.path.join(tmp, "interpolated_time_major.nc")
+        lat, lon = make_interpolated_like_file(path, args.n_times, args.grid_step)
+        station_lat = rng.uniform(lat.min(), lat.max(), args.stations)
+        station_lon = rng.uniform(lon.min(), lon.max(), args.stations)
+
+        start = time.perf_counter()
+        with xr.open_dataset(path) as ds:
+            reference = np.stack([
+                ds["t2m"].interp(latitude=station_lat[i], longitude=station_lon[i], method=args.method).values
+                for i in range(args.reference_stations)])
+        per_station = (time.perf_counter() - start) * args.stations / args.reference_stations
+        print(f"{args.stations} stations x {args.n_times} steps on a {lat.size}x{lon.size} grid")
+        print(f"per station  {per_station:8.2f} s (estimated from {args.reference_stations} stations), "
+              f"{args.n_times * args.stations} reads")
+
+        start = time.perf_counter()
+        extractor = PointExtractor(lat, lon, station_lat, station_lon, method=args.method)
+        series = extractor.extract(path, "t2m")
+        seconds = time.perf_counter() - start
+        error = np.nanmax(np.abs(series.values[:args.reference_stations] - reference))
+        # Both interpolate the same float32 values in float64: they must agree to rounding.
+        if not error <= 1e-9 * np.nanmax(np.abs(reference)):
+            failures.append("extractor series")
+        print(f"extractor    {seconds:8.2f} s, {count_reads(extractor, path)} reads, "
+              f"{extractor.n_cells} cells, max error {error:.2e}")
+
+        start = time.perf_counter()
+        rechunk_time_major(path, time_major_path)
+        rechunk_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        time_major = extractor.extract(time_major_path, "t2m")
+        seconds = time.perf_counter() - start
+        identical = np.array_equal(time_major.values, series.values, equal_nan=True)
+        print(f"time-major   {seconds:8.2f} s, {count_reads(extractor, time_major_path)} reads "
+              f"(rechunking took {rechunk_seconds:.2f} s), identical: {identical}")
+        if not identical:
+            failures.append("time-major series")
+
+    if failures:
+        print(f"FAILED: {', '.join(failures)}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
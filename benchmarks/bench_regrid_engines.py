@@ -0,0 +1,107 @@
+# Benchmark the sparse regridding engines of regrid_engines.py against the current separable
+# RegridStencil path, and check their accuracy.
+#
+# - bilinear and nearest must match RegridStencil (and so RegularGridInterpolator) to rounding.
+# - conservative must preserve the area integral of a precipitation-like field over the target
+#   domain, which bilinear interpolation does not.
+#
+# Usage:
+#   python benchmarks/bench_regrid_engines.py --n_times 240 --grid_step 0.02
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ERA5_Interpolation.regrid import RegridStencil, target_grid
+from ERA5_Interpolation.regrid_engines import SparseRegridder, cell_edges, overlap_matrix
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Regridding engine benchmark")
+    parser.add_argument("--n_times", type=int, default=240, help="Number of time steps in one block")
+    parser.add_argument("--grid_step", type=float, default=0.02, help="Target grid step in degrees")
+    return parser.parse_args()
+
+
+def precipitation_like(n_times, shape, rng):
+    """
+    Intermittent, skewed totals: mostly dry cells and a few heavy ones, as in total_precipitation.
+    """
+    wet = rng.random((n_times,) + shape) < 0.3
+    return np.where(wet, rng.gamma(0.5, 2e-3, (n_times,) + shape), 0.0)
+
+
+def cell_areas(lat, lon):
+    """
+    Areas of the cells of a regular grid on the unit sphere, shape (n_lat, n_lon).
+    """
+    lat_lower, lat_upper = cell_edges(lat, -90.0, 90.0)
+    lon_lower, lon_upper = cell_edges(lon)
+    return np.outer(np.sin(np.deg2rad(lat_upper)) - np.sin(np.deg2rad(lat_lower)),
+                    np.deg2rad(lon_upper - lon_lower))
+
+
+def source_integral(data, src_lat, src_lon, dst_lat, dst_lon):
+    """
+    Area integral of source fields over the domain covered by the target cells.
+    """
+    def axis_fraction(src_lower, src_upper, dst_lower, dst_upper):
+        # Length of every source cell inside [dst_lower.min(), dst_upper.max()].
+        inside = overlap_matrix(src_lower, src_upper, np.array([dst_lower.min()]), np.array([dst_upper.max()]))
+        return inside.toarray()[0]
+
+    src_lat_edges = [np.sin(np.deg2rad(edge)) for edge in cell_edges(src_lat, -90.0, 90.0)]
+    dst_lat_edges = [np.sin(np.deg2rad(edge)) for edge in cell_edges(dst_lat, -90.0, 90.0)]
+    lat_part = axis_fraction(*src_lat_edges, *dst_lat_edges)
+    lon_part = np.deg2rad(axis_fraction(*cell_edges(src_lon), *cell_edges(dst_lon)))
+    return (data * np.outer(lat_part, lon_part)).sum(axis=(-2, -1))
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(0)
+    # The 0.25 degree Greece grid, with descending latitudes as in ERA5.
+    lat = np.arange(42, 33.75, -0.25)
+    lon = np.arange(19, 28.25, 0.25)
+    new_lat, new_lon = target_grid(lat, lon, args.grid_step)
+    temperature = 280 + 10 * rng.standard_normal((args.n_times, lat.size, lon.size))
+    precipitation = precipitation_like(args.n_times, (lat.size, lon.size), rng)
+    n_points = args.n_times * new_lat.size * new_lon.size
+    print(f"time steps: {args.n_times}, target grid: {new_lat.size}x{new_lon.size}")
+
+    for method in ("linear", "nearest"):
+        stencil, stencil_setup = timed(RegridStencil, lat, lon, new_lat, new_lon, method)
+        regridder, sparse_setup = timed(SparseRegridder, lat, lon, new_lat, new_lon, method)
+        reference, stencil_seconds = timed(stencil.apply, temperature)
+        result, sparse_seconds = timed(regridder.apply, temperature)
+        print(f"{method:12s} stencil {stencil_setup:.3f} s setup + {stencil_seconds:.3f} s "
+              f"({n_points / stencil_seconds / 1e6:.1f} Mpoints/s) | sparse {sparse_setup:.3f} s setup + "
+              f"{sparse_seconds:.3f} s ({n_points / sparse_seconds / 1e6:.1f} Mpoints/s, "
+              f"{regridder.weights.nnz} weights) | max abs difference {np.abs(result - reference).max():.2e}")
+
+    regridder, setup = timed(SparseRegridder, lat, lon, new_lat, new_lon, "conservative")
+    _, seconds = timed(regridder.apply, temperature)
+    print(f"{'conservative':12s} sparse {setup:.3f} s setup + {seconds:.3f} s "
+          f"({n_points / seconds / 1e6:.1f} Mpoints/s, {regridder.weights.nnz} weights)")
+
+    # Conservation of the precipitation integral over the target domain.
+    expected = source_integral(precipitation, lat, lon, new_lat, new_lon)
+    areas = cell_areas(new_lat, new_lon)
+    for method in ("linear", "conservative"):
+        regridded = SparseRegridder(lat, lon, new_lat, new_lon, method).apply(precipitation)
+        error = np.abs((regridded * areas).sum(axis=(-2, -1)) - expected) / expected
+        print(f"{method:12s} precipitation integral: max relative error {error.max():.2e}")
+
+
+if __name__ == "__main__":
+    main()
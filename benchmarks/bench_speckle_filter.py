@@ -0,0 +1,145 @@
+# Check and benchmark the Refined Lee speckle filter of Flood_Mapping/speckle_filter.py, in
+# megapixels per second.
+#
+# - On a small image, the vectorized kernel must match a direct pixel-by-pixel implementation of
+#   the filter to rounding, built from the 7x7 directional weights of the Earth Engine script.
+# - On a large image, the tiled (and parallel) filtering of Flood_Mapping/local_flood_mapping.py
+#   must reproduce the whole-image result exactly.
+#
+# The script exits with status 1 if a check fails.
+#
+# Usage:
+#   python benchmarks/bench_speckle_filter.py --size 4096 --tile_size 1024 --workers 4
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Flood_Mapping.local_flood_mapping import filter_scene, to_db, to_natural
+from Flood_Mapping.speckle_filter import REFINED_LEE_HALO, refined_lee
+
+# Weights of the edge-aligned 7x7 windows, as written in the Earth Engine Refined Lee script
+# (ee.Kernel.fixed(7, 7, rect_weights / diag_weights, 3, 3, false)).
+RECT_WEIGHTS = [[0, 0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0, 0],
+                [0, 0, 0, 0, 0, 0, 0],
+                [1, 1, 1, 1, 1, 1, 1],
+                [1, 1, 1, 1, 1, 1, 1],
+                [1, 1, 1, 1, 1, 1, 1],
+                [1, 1, 1, 1, 1, 1, 1]]
+DIAG_WEIGHTS = [[1, 0, 0, 0, 0, 0, 0],
+                [1, 1, 0, 0, 0, 0, 0],
+                [1, 1, 1, 0, 0, 0, 0],
+                [1, 1, 1, 1, 0, 0, 0],
+                [1, 1, 1, 1, 1, 0, 0],
+                [1, 1, 1, 1, 1, 1, 0],
+                [1, 1, 1, 1, 1, 1, 1]]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Refined Lee speckle filter check and benchmark")
+    parser.add_argument("--size", type=int, default=2048, help="Image edge length in pixels")
+    parser.add_argument("--tile_size", type=int, default=512, help="Tile edge length in pixels")
+    parser.add_argument("--workers", type=int, default=4, help="Number of worker processes")
+    return parser.parse_args()
+
+
+def speckled_scene(size, rng, looks=4):
+    """
+    Backscatter in dB: land and water regions with a diagonal edge, under gamma speckle.
+    """
+    rows, cols = np.mgrid[:size, :size]
+    sigma0 = np.where(rows + cols < size, 0.1, 0.01)
+    return to_db(sigma0 * rng.gamma(looks, 1.0 / looks, (size, size)))
+
+
+def rotate(weights, rotations):
+    """
+    Rotate a square weight matrix clockwise by 90 degrees 'rotations' times, as ee.Kernel.rotate.
+    """
+    for _ in range(rotations):
+        size = len(weights)
+        weights = [[weights[size - 1 - col][row] for col in range(size)] for row in range(size)]
+    return weights
+
+
+def reference_refined_lee(img):
+    """
+    Direct implementation of the filter, one 7x7 window at a time, with the directional windows
+    of the Earth Engine script: direction 1 uses rect_weights, 2 diag_weights, and 3-8 these
+    kernels rotated 1, 2 and 3 times (rect for odd directions, diag for even ones).
+    """
+    kernels = []
+    for rotations in range(4):
+        kernels.append(np.array(rotate(RECT_WEIGHTS, rotations), dtype=float))
+        kernels.append(np.array(rotate(DIAG_WEIGHTS, rotations), dtype=float))
+    halo = REFINED_LEE_HALO
+    result = np.full(img.shape, np.nan)
+    pairs = [(1, 7), (6, 2), (3, 5), (0, 8)]
+    for y in range(halo, img.shape[0] - halo):
+        for x in range(halo, img.shape[1] - halo):
+            window = img[y - halo:y + halo + 1, x - halo:x + halo + 1]
+            if np.isnan(window).any():
+                continue
+            blocks = [window[dy:dy + 3, dx:dx + 3] for dy in (0, 2, 4) for dx in (0, 2, 4)]
+            means = np.array([block.mean() for block in blocks])
+            variances = np.array([block.var() for block in blocks])
+            gradients = [abs(means[a] - means[b]) for a, b in pairs]
+            strongest = int(np.argmax(gradients))
+            a, b = pairs[strongest]
+            direction = strongest if means[a] - means[4] > means[4] - means[b] else strongest + 4
+            sigma_v = np.sort(variances / means ** 2)[:5].mean()
+            weights = kernels[direction]
+            dir_mean = (weights * window).sum() / weights.sum()
+            dir_var = (weights * (window - dir_mean) ** 2).sum() / weights.sum()
+            var_x = (dir_var - dir_mean ** 2 * sigma_v) / (sigma_v + 1)
+            b = var_x / dir_var if dir_var > 0 else 0.0
+            result[y, x] = dir_mean + b * (window[halo, halo] - dir_mean)
+    return result
+
+
+def main():
+    args = parse_args()
+    failures = []
+
+    def check(condition, message):
+        if not condition:
+            failures.append(message)
+        return condition
+
+    rng = np.random.default_rng(0)
+
+    small = to_natural(speckled_scene(64, rng))
+    small[30, 40] = np.nan
+    vectorized, reference = refined_lee(small), reference_refined_lee(small)
+    difference = np.nanmax(np.abs(vectorized - reference))
+    check(difference <= 1e-9 * np.nanmax(np.abs(reference)), "direct implementation")
+    print(f"64x64 image: max difference to the direct implementation {difference:.2e}, same NaN pixels: "
+          f"{check(np.array_equal(np.isnan(vectorized), np.isnan(reference)), 'NaN pixels')}")
+
+    scene = speckled_scene(args.size, rng)
+    megapixels = scene.size / 1e6
+    start = time.perf_counter()
+    whole = to_db(refined_lee(to_natural(scene))).astype("float32")
+    seconds = time.perf_counter() - start
+    print(f"{args.size}x{args.size} image at once: {seconds:.3f} s ({megapixels / seconds:.2f} Mpixels/s)")
+
+    for workers in (1, args.workers):
+        start = time.perf_counter()
+        tiled = filter_scene(scene, tile_size=args.tile_size, workers=workers)
+        seconds = time.perf_counter() - start
+        print(f"tiles of {args.tile_size}, {workers} workers: {seconds:.3f} s "
+              f"({megapixels / seconds:.2f} Mpixels/s), identical to the whole image: "
+              f"{check(np.array_equal(tiled, whole, equal_nan=True), f'tiled image, {workers} workers')}")
+
+    if failures:
+        print(f"FAILED: {', '.join(failures)}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# Benchmark the regional subsetting of mainGR.process_netcdf_files against the original
+# eager open/sel/to_netcdf path, reporting bytes read and written per file.
+#
+# Bytes are taken from /proc/self/io (rchar/wchar), so the benchmark needs Linux. Both paths
+# can only read whole on-disk chunks, so bytes read mostly depend on --disk_chunk; the chunked
+# path bounds memory to --time_chunk steps and compresses its output.
+#
+# Usage:
+#   python benchmarks/bench_subsetting.py --n_times 96 --compression zlib
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mainGR import process_netcdf_files
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Regional subsetting benchmark")
+    parser.add_argument("--n_times", type=int, default=96, help="Number of hourly time steps")
+    parser.add_argument("--compression", type=str, default="zlib", choices=["zlib", "zstd", "none"])
+    parser.add_argument("--time_chunk", type=int, default=24, help="Time steps per chunk")
+    parser.add_argument("--disk_chunk", type=int, nargs=3, default=[1, 181, 360],
+                        metavar=("TIME", "LAT", "LON"), help="On-disk chunk shape of the synthetic input")
+    return parser.parse_args()
+
+
+def io_counters():
+    """
+    Return the (bytes read, bytes written) of the current process so far.
+    """
+    counters = {}
+    with open("/proc/self/io") as io_file:
+        for line in io_file:
+            key, value = line.split(":")
+            counters[key] = int(value)
+    return counters["rchar"], counters["wchar"]
+
+
+def make_global_file(path, n_times, disk_chunk):
+    """
+    Write a synthetic global 0.25 degree ERA5-shaped file packed as int16.
+    """
+    lat = np.arange(90, -90.25, -0.25)
+    lon = np.arange(0, 360, 0.25)
+    times = pd.date_range("2000-01-01", periods=n_times, freq="h")
+    rng = np.random.default_rng(0)
+    # A smooth field with a daily cycle and a little noise, so that compression behaves realistically.
+    field = 280 + 20 * np.cos(np.deg2rad(lat))[:, np.newaxis] + 2 * np.sin(np.deg2rad(lon))
+    cycle = 5 * np.sin(2 * np.pi * np.arange(n_times) / 24)
+    values = (field + cycle[:, np.newaxis, np.newaxis]
+              + 0.1 * rng.standard_normal((n_times, lat.size, lon.size))).astype("float32")
+    ds = xr.Dataset(
+        {"t2m": (["valid_time", "latitude", "longitude"], values)},
+        coords={"valid_time": times, "latitude": lat, "longitude": lon},
+    )
+    encoding = {"t2m": {"dtype": "int16", "scale_factor": 0.002, "add_offset": 280.0, "_FillValue": -32767,
+                        "chunksizes": tuple(disk_chunk)}}
+    ds.to_netcdf(path, encoding=encoding)
+
+
+def subset_eager(extract_dir, output_dir, lat_min, lat_max, lon_min, lon_max):
+    """
+    Reference implementation: the original process_netcdf_files loop.
+    """
+    for file in os.listdir(extract_dir):
+        if file.endswith(".nc"):
+            ds = xr.open_dataset(os.path.join(extract_dir, file))
+            ds_region = ds.sel(latitude=slice(lat_max, lat_min), longitude=slice(lon_min, lon_max))
+            ds_region.to_netcdf(os.path.join(output_dir, f"GR_{file}"))
+
+
+def measure(function, *args, **kwargs):
+    """
+    Return the wall time, bytes read, bytes written and peak traced memory of one call.
+    """
+    tracemalloc.start()
+    read_before, written_before = io_counters()
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    read_after, written_after = io_counters()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, read_after - read_before, written_after - written_before, peak_memory
+
+
+def main():
+    args = parse_args()
+    region = (34, 42, 19, 28)
+    compression = None if args.compression == "none" else args.compression
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        extract_dir = os.path.join(tmp_dir, "extracted")
+        eager_dir = os.path.join(tmp_dir, "eager")
+        chunked_dir = os.path.join(tmp_dir, "chunked")
+        for directory in (extract_dir, eager_dir, chunked_dir):
+            os.makedirs(directory)
+        make_global_file(os.path.join(extract_dir, "t2m_Y2000.nc"), args.n_times, args.disk_chunk)
+        input_size = os.path.getsize(os.path.join(extract_dir, "t2m_Y2000.nc"))
+
+        eager = measure(subset_eager, extract_dir, eager_dir, *region)
+        chunked = measure(process_netcdf_files, extract_dir, chunked_dir, *region,
+                          compression=compression, time_chunk=args.time_chunk)
+        eager_size = os.path.getsize(os.path.join(eager_dir, "GR_t2m_Y2000.nc"))
+        chunked_size = os.path.getsize(os.path.join(chunked_dir, "GR_t2m_Y2000.nc"))
+
+    print(f"time steps: {args.n_times}, input file: {input_size / 1024 ** 2:.1f} MiB")
+    for name, (seconds, bytes_read, bytes_written, peak_memory), size in (("eager", eager, eager_size),
+                                                                          ("chunked", chunked, chunked_size)):
+        print(f"{name:8s} {seconds:.3f} s, read {bytes_read / 1024 ** 2:.1f} MiB, "
+              f"written {bytes_written / 1024 ** 2:.2f} MiB, output file {size / 1024 ** 2:.2f} MiB, "
+              f"peak memory {peak_memory / 1024 ** 2:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+# Request planner for the Copernicus Climate Data Store (CDS).
+#
+# Takes a declarative spec (variables, date range, hours, area), removes the days that are
+# already on disk, and packs what is left into the smallest set of CDS requests that stay
+# under the per-request field limit: variables missing for the same days are merged into one
+# request, consecutive months of a year are packed together, and requests that would exceed
+# the limit are split by variable and then by day.
+#
+# Example spec (JSON):
+#   {"dataset": "reanalysis-era5-single-levels",
+#    "variables": ["2m_temperature", "total_precipitation"],
+#    "start": "1990-01-01", "end": "1999-12-31",
+#    "hours": ["00:00", "06:00", "12:00", "18:00"],
+#    "area": [42, 19, 34, 28]}
+#
+# What is on disk is taken from the variables and days the files contain (see 'scan_inventory'),
+# so the planner's own multi-variable targets count as downloaded.
+#
+# Usage:
+#   python cds_planner.py spec.json --target_dir /path/to/downloads --dry_run
+
+import os, json, hashlib, argparse, calendar, datetime
+from collections import defaultdict
+from pipeline_metrics import add_metrics_arguments, recorder_from_args
+
+# Default limit on the number of fields (variable x date x hour) of one request.
+DEFAULT_MAX_FIELDS = 120000
+# Native ERA5 single-level grid step in degrees, used to estimate the request size.
+ERA5_GRID_STEP = 0.25
+# Every day number; CDS ignores day numbers that do not exist in a month.
+ALL_DAYS = tuple(range(1, 32))
+# Default inventory database, kept in the download directory.
+INVENTORY_NAME = ".era5_inventory.sqlite"
+# NetCDF short names of ERA5 single-level variables, by CDS name. A spec can add others with
+# "short_names": {"<CDS name>": "<short name>"}.
+ERA5_SHORT_NAMES = {
+    "10m_u_component_of_wind": "u10", "10m_v_component_of_wind": "v10",
+    "100m_u_component_of_wind": "u100", "100m_v_component_of_wind": "v100",
+    "10m_wind_gust_since_previous_post_processing": "fg10",
+    "2m_temperature": "t2m", "2m_dewpoint_temperature": "d2m", "skin_temperature": "skt",
+    "sea_surface_temperature": "sst", "surface_pressure": "sp", "mean_sea_level_pressure": "msl",
+    "total_precipitation": "tp", "convective_precipitation": "cp", "large_scale_precipitation": "lsp",
+    "evaporation": "e", "potential_evaporation": "pev", "runoff": "ro", "snowfall": "sf", "snow_depth": "sd",
+    "total_cloud_cover": "tcc", "boundary_layer_height": "blh",
+    "surface_solar_radiation_downwards": "ssrd", "surface_thermal_radiation_downwards": "strd",
+    "total_column_water": "tcw", "total_column_water_vapour": "tcwv",
+    "convective_available_potential_energy": "cape", "convective_inhibition": "cin", "k_index": "kx",
+    "soil_temperature_level_1": "stl1", "volumetric_soil_water_layer_1": "swvl1",
+    "volumetric_soil_water_layer_2": "swvl2", "volumetric_soil_water_layer_3": "swvl3",
+    "volumetric_soil_water_layer_4": "swvl4",
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Plan the CDS requests of a download spec")
+    parser.add_argument("spec", type=str, help="Path to the JSON download spec")
+    parser.add_argument("--target_dir", type=str, required=True,
+                        help="Directory holding the existing downloads; the plan only covers what is missing")
+    parser.add_argument("--inventory", type=str, default=None,
+                        help="Path to the file inventory (default: .era5_inventory.sqlite in --target_dir)")
+    parser.add_argument("--max_fields", type=int, default=DEFAULT_MAX_FIELDS, help="Maximum fields per request")
+    parser.add_argument("--workers", type=int, default=4, help="Number of requests kept in flight")
+    parser.add_argument("--dry_run", action="store_true", help="Only print the planned requests")
+    add_metrics_arguments(parser)
+    return parser.parse_args()
+
+
+def spec_dates(spec):
+    """
+    Returns every date of the spec's [start, end] range.
+    """
+    start = datetime.date.fromisoformat(spec["start"])
+    end = datetime.date.fromisoformat(spec["end"])
+    return [start + datetime.timedelta(days=n) for n in range((end - start).days + 1)]
+
+
+def covers(row, area=None, hours=()):
+    """
+    Tells whether an inventory record covers the area and hours of a CDS request.
+
+    Parameters:
+      row (dict): Inventory record, with the latitude/longitude extent and the hours of its data.
+      area (list): Requested [north, west, south, east] in degrees, or None for the whole globe.
+      hours (list): Requested hours as "HH:MM".
+
+    Returns:
+      bool: False as well when the record has no extent or hours (e.g. an unreadable file).
+    """
+    if not set(hours) <= set(json.loads(row["hours"] or "[]")):
+        return False
+    if row["lat_min"] is None or row["lon_min"] is None:
+        return False
+    north, west, south, east = area if area else (90, -180, -90, 180)
+    # The CDS snaps the area to the grid: allow half a grid step.
+    lat_tolerance = (row["lat_step"] or 0) / 2 + 1e-6
+    lon_tolerance = (row["lon_step"] or 0) / 2 + 1e-6
+    if row["lat_min"] > south + lat_tolerance or row["lat_max"] < north - lat_tolerance:
+        return False
+    if not area or (row["lon_max"] > 180 and west % 360 > east % 360):
+        # The whole circle, or a box across the prime meridian of a 0-360 grid.
+        return row["lon_max"] - row["lon_min"] + (row["lon_step"] or 0) >= 360 - lon_tolerance
+    if row["lon_max"] > 180:
+        west, east = west % 360, east % 360
+    return row["lon_min"] <= west + lon_tolerance and row["lon_max"] >= east - lon_tolerance
+
+
+def scan_inventory(target_dir, variables, db_path=None, short_names=None, area=None, hours=()):
+    """
+    Lists the (variable, date) pairs already present in 'target_dir'.
+
+    The directory is recorded in the SQLite inventory (see era5_inventory.py), which only opens
+    files that are new or changed since the last scan. Files are attributed to the variables they
+    contain: the inventory records the NetCDF short names of the variables of every NetCDF file and
+    ZIP download (mapped back to CDS names with ERA5_SHORT_NAMES), so multi-variable targets of the
+    planner are found whatever their name. Only files covering 'area' and 'hours' count (see 'covers').
+
+    Parameters:
+      target_dir (str): Download directory.
+      variables (list): CDS variable names.
+      db_path (str): Path to the inventory database (default: ".era5_inventory.sqlite" in 'target_dir').
+      short_names (dict): NetCDF short names of CDS variables missing from ERA5_SHORT_NAMES.
+      area (list): Requested [north, west, south, east], or None for the whole globe.
+      hours (list): Requested hours as "HH:MM".
+
+    Returns:
+      set: (variable, datetime.date) pairs.
+    """
+    from era5_inventory import Inventory
+
+    present = set()
+    if not os.path.isdir(target_dir):
+        return present
+    names = dict(ERA5_SHORT_NAMES, **(short_names or {}))
+    # CDS name of every name a file can record for a variable of the spec.
+    cds_names = {variable: variable for variable in variables}
+    cds_names.update((names[variable], variable) for variable in variables if variable in names)
+    with Inventory(db_path or os.path.join(target_dir, INVENTORY_NAME)) as inventory:
+        inventory.update_directory(target_dir, "download")
+        for row in inventory.find(stage="download", directory=target_dir):
+            contained = {cds_names[name] for name in json.loads(row["variables"] or "[]") if name in cds_names}
+            if contained and covers(row, area, hours):
+                days = inventory.covered_days([row])
+                present.update((variable, day) for variable in contained for day in days)
+    return present
+
+
+def request_days(request):
+    """
+    Returns every existing date of a CDS request's "year", "month" and "day" lists.
+    """
+    def as_list(value):
+        return value if isinstance(value, (list, tuple)) else [value]
+
+    days = []
+    for year in map(int, as_list(request["year"])):
+        for month in map(int, as_list(request["month"])):
+            n_days = calendar.monthrange(year, month)[1]
+            days.extend(datetime.date(year, month, int(day)) for day in as_list(request["day"]) if int(day) <= n_days)
+    return days
+
+
+def is_downloaded(inventory, target_dir, request, short_names=None):
+    """
+    Tells whether every variable and day of a CDS request is already in 'target_dir'.
+
+    The files are looked up in the records of an open era5_inventory.Inventory (scanned by the
+    caller), by the CDS name and the NetCDF short name of each variable, as in 'scan_inventory'.
+    Only files covering the request's "area" and "time" hours count (see 'covers').
+
+    Parameters:
+      inventory (era5_inventory.Inventory): Inventory holding the records of 'target_dir'.
+      target_dir (str): Download directory.
+      request (dict): CDS request with "variable", "year", "month", "day", "time" and optionally "area".
+      short_names (dict): NetCDF short names of CDS variables missing from ERA5_SHORT_NAMES.
+
+    Returns:
+      bool: True if nothing of the request is missing.
+    """
+    names = dict(ERA5_SHORT_NAMES, **(short_names or {}))
+    days = set(request_days(request))
+    if not days:
+        return True
+    variables = request["variable"]
+    for variable in variables if isinstance(variables, (list, tuple)) else [variables]:
+        rows = []
+        for name in {variable, names.get(variable, variable)}:
+            rows += [row for row in inventory.find(stage="download", variable=name, start=min(days).isoformat(),
+                                                   end=max(days).isoformat(), directory=target_dir)
+                     if covers(row, request.get("area"), request.get("time", ()))]
+        if not days <= inventory.covered_days(rows):
+            return False
+    return True
+
+
+def _count_fields(request):
+    # Only existing dates are counted.
+    n_dates = sum(
+        1
+        for year in request["year"] for month in request["month"] for day in request["day"]
+        if int(day) <= calendar.monthrange(int(year), int(month))[1]
+    )
+    return len(request["variable"]) * n_dates * len(request["time"])
+
+
+def estimate_bytes(request, fields):
+    """
+    Estimates the size of a request's NetCDF output (4 bytes per grid point and field).
+    """
+    north, west, south, east = request.get("area", [90, -180, -90, 180])
+    points = (round((north - south) / ERA5_GRID_STEP) + 1) * (round((east - west) / ERA5_GRID_STEP) + 1)
+    return fields * points * 4
+
+
+def _target_name(variables, year, months, days):
+    name = variables[0] if len(variables) == 1 else \
+        f"era5_{len(variables)}vars_{hashlib.sha256(','.join(variables).encode()).hexdigest()[:8]}"
+    target = f"{name}_Y{year}_M{months[0]:02d}-{months[-1]:02d}"
+    if days != ALL_DAYS:
+        # Contiguous day ranges are named by their bounds, other day sets by a hash.
+        contiguous = days[-1] - days[0] + 1 == len(days)
+        target += f"_D{days[0]:02d}-{days[-1]:02d}" if contiguous else \
+            f"_D{hashlib.sha256(str(days).encode()).hexdigest()[:8]}"
+    return f"{target}.nc"
+
+
+def _split(items, size):
+    return [items[n:n + size] for n in range(0, len(items), size)]
+
+
+def plan_requests(spec, inventory=(), max_fields=DEFAULT_MAX_FIELDS):
+    """
+    Builds the minimal set of requests that download what the spec needs and the inventory lacks.
+
+    Parameters:
+      spec (dict): Download spec with "variables", "start", "end", "hours" and optional "dataset",
+        "area", "data_format" and "download_format".
+      inventory (iterable): (variable, datetime.date) pairs already downloaded.
+      max_fields (int): Maximum fields (variable x date x hour) per request.
+
+    Returns:
+      list: Planned jobs as dicts with "dataset", "request", "target", "fields" and "bytes".
+    """
+    inventory = set(inventory)
+    hours = list(spec["hours"])
+
+    # 1. Missing days of every variable, grouped by month.
+    missing = defaultdict(set)
+    for variable in spec["variables"]:
+        for date in spec_dates(spec):
+            if (variable, date) not in inventory:
+                missing[(variable, date.year, date.month)].add(date.day)
+
+    # 2. Merge the variables that miss the same days of the same month into one request.
+    #    Fully missing months use every day number so that months of different length pack together.
+    by_days = defaultdict(list)
+    for (variable, year, month), days in missing.items():
+        if len(days) == calendar.monthrange(year, month)[1]:
+            days = ALL_DAYS
+        by_days[(year, month, tuple(sorted(days)))].append(variable)
+
+    # 3. Pack consecutive months with the same variables and days into one request.
+    groups = defaultdict(list)
+    for (year, month, days), variables in by_days.items():
+        groups[(year, tuple(sorted(variables)), days)].append(month)
+
+    jobs = []
+    for (year, variables, days), months in sorted(groups.items()):
+        months = sorted(months)
+        fields_per_variable_month = len(days) * len(hours)
+
+        # 4. Split requests above the field limit: by variable, then by day, then by month.
+        variable_chunks = _split(list(variables), max(1, max_fields // fields_per_variable_month))
+        day_chunks = [days] if fields_per_variable_month <= max_fields else \
+            _split(days, max(1, max_fields // len(hours)))
+        for variable_chunk in variable_chunks:
+            for day_chunk in day_chunks:
+                months_per_request = max(1, max_fields // (len(variable_chunk) * len(day_chunk) * len(hours)))
+                for month_chunk in _split(months, months_per_request):
+                    request = {
+                        "product_type": ["reanalysis"],
+                        "variable": list(variable_chunk),
+                        "year": [str(year)],
+                        "month": [f"{month:02d}" for month in month_chunk],
+                        "day": [f"{day:02d}" for day in day_chunk],
+                        "time": hours,
+                        "data_format": spec.get("data_format", "netcdf"),
+                        "download_format": spec.get("download_format", "unarchived"),
+                    }
+                    if "area" in spec:
+                        request["area"] = spec["area"]
+                    fields = _count_fields(request)
+                    jobs.append({
+                        "dataset": spec.get("dataset", "reanalysis-era5-single-levels"),
+                        "request": request,
+                        "target": _target_name(list(variable_chunk), year, month_chunk, tuple(day_chunk)),
+                        "fields": fields,
+                        "bytes": estimate_bytes(request, fields),
+                    })
+    return jobs
+
+
+def print_plan(jobs):
+    for job in jobs:
+        print(f"{job['target']}: {job['fields']} fields, ~{job['bytes'] / 1024 ** 2:.1f} MiB")
+    print(f"{len(jobs)} requests, {sum(job['fields'] for job in jobs)} fields, "
+          f"~{sum(job['bytes'] for job in jobs) / 1024 ** 3:.2f} GiB")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with open(args.spec) as spec_file:
+        spec = json.load(spec_file)
+
+    inventory = scan_inventory(args.target_dir, spec["variables"], db_path=args.inventory,
+                               short_names=spec.get("short_names"), area=spec.get("area"), hours=spec["hours"])
+    jobs = plan_requests(spec, inventory, max_fields=args.max_fields)
+    print_plan(jobs)
+
+    if not args.dry_run:
+        from cds_scheduler import CDSDownloadScheduler
+
+        metrics = recorder_from_args(args)
+        scheduler = CDSDownloadScheduler(args.target_dir, workers=args.workers, metrics=metrics)
+        for job in jobs:
+            scheduler.submit(job["dataset"], job["request"], job["target"])
+        with metrics.stage("download", jobs=len(jobs)):
+            scheduler.run()
@@ -0,0 +1,241 @@
+# Concurrent, resumable download scheduler for the Copernicus Climate Data Store (CDS).
+#
+# The acquisition scripts describe one job per target file; the scheduler keeps several
+# requests in flight against the CDS queue, retries failed requests with exponential backoff,
+# writes every target through a temporary file, and records the state of every job in a JSON
+# journal so that a restarted run skips completed jobs. The CDS request ID of every job is
+# journaled as soon as the request is submitted, so an interrupted job resumes by polling its
+# request instead of submitting it again and losing its place in the queue.
+# The time a request waits in the CDS queue and the time its result takes to transfer are
+# measured separately, recorded in the journal and reported to a pipeline_metrics recorder.
+
+import os, json, random, threading, time, hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pipeline_metrics import MetricsRecorder
+
+# Job states recorded in the journal.
+PENDING, RUNNING, COMPLETED, FAILED = "pending", "running", "completed", "failed"
+# States of a CDS request, as reported by the clients' 'status'.
+QUEUED = "queued"
+# Request states of cdsapi (legacy and ecmwf-datastores based) mapped to the states above.
+_CDS_STATES = {"queued": QUEUED, "accepted": QUEUED, "running": RUNNING, "completed": COMPLETED,
+               "successful": COMPLETED}
+
+
+class RequestFailed(RuntimeError):
+    """
+    The CDS reported a request as failed: it has to be submitted again.
+    """
+
+
+def request_key(dataset, request):
+    """
+    Returns a stable hash of a CDS request, used to detect that a journal entry is outdated.
+    """
+    payload = json.dumps({"dataset": dataset, "request": request}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class CDSAPIClient:
+    """
+    Client of the scheduler on top of cdsapi: requests are submitted without waiting, and their
+    results are found again from the request ID, also in a later run.
+    """
+    def __init__(self, client=None):
+        if client is None:
+            # Imported lazily so that the scheduler can be used with a stand-in client without cdsapi.
+            import cdsapi
+            client = cdsapi.Client(wait_until_complete=False, quiet=True)
+        self.client = client
+        self._results = {}
+
+    def _result(self, request_id):
+        result = self._results.get(request_id)
+        if result is None:
+            datastores = getattr(self.client, "client", None)
+            if hasattr(datastores, "get_remote"):
+                # cdsapi >= 0.7 wraps an ecmwf-datastores (or cads-api-client) client.
+                result = datastores.get_remote(request_id)
+            else:
+                import cdsapi.api
+                result = cdsapi.api.Result(self.client, {"request_id": request_id, "state": "queued"})
+            self._results[request_id] = result
+        return result
+
+    def submit(self, dataset, request):
+        result = self.client.retrieve(dataset, request)
+        reply = getattr(result, "reply", None)
+        if isinstance(reply, dict):
+            request_id = reply["request_id"]
+        else:
+            request_id = getattr(result, "request_id", None) or result.request_uid
+        self._results[request_id] = result
+        return request_id
+
+    def status(self, request_id):
+        result = self._result(request_id)
+        if hasattr(result, "update"):
+            result.update()
+            state, error = result.reply.get("state"), result.reply.get("error")
+        else:
+            state, error = result.status, None
+        if state not in _CDS_STATES:
+            raise RequestFailed(f"CDS request {request_id} is {state}: {error}")
+        return _CDS_STATES[state]
+
+    def download(self, request_id, target):
+        self._result(request_id).download(target)
+
+
+class CDSDownloadScheduler:
+    def __init__(self, target_dir, client_factory=None, workers=4, max_retries=5, backoff=30.0,
+                 max_backoff=1800.0, poll_interval=30.0, journal_name=".cds_journal.json", sleep=time.sleep,
+                 metrics=None):
+        """
+        Initialize the scheduler.
+
+        Parameters:
+          target_dir (str): Directory where the targets and the journal are written.
+          client_factory (callable): Returns a new client with 'submit(dataset, request)', which queues
+            a request without waiting and returns its request ID, 'status(request_id)', which returns
+            "queued", "running" or "completed" (or raises RequestFailed), and 'download(request_id, target)';
+            one client is created per worker thread (default: CDSAPIClient).
+          workers (int): Number of requests kept in flight (default: 4).
+          max_retries (int): Retries of a failed request before the job is marked failed (default: 5).
+          backoff (float): Delay in seconds before the first retry, doubled at every retry (default: 30).
+          max_backoff (float): Upper bound of the retry delay in seconds (default: 1800).
+          poll_interval (float): Delay in seconds between two status requests of a queued request (default: 30).
+          journal_name (str): File name of the job journal inside 'target_dir'.
+          sleep (callable): Function used to wait between retries (replaceable in tests).
+          metrics (pipeline_metrics.MetricsRecorder): Recorder of one "download" record per job, with
+            its queue and transfer times (default: None, which keeps the records in memory).
+        """
+        self.target_dir = target_dir
+        self.client_factory = client_factory or CDSAPIClient
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.sleep = sleep
+        self.metrics = metrics if metrics is not None else MetricsRecorder()
+        self.journal_path = os.path.join(target_dir, journal_name)
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        os.makedirs(target_dir, exist_ok=True)
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path) as journal_file:
+                self.journal = json.load(journal_file)
+        else:
+            self.journal = {}
+
+    def _save_journal(self):
+        # Called with the lock held; the journal is replaced atomically.
+        tmp_path = f"{self.journal_path}.part"
+        with open(tmp_path, "w") as journal_file:
+            json.dump(self.journal, journal_file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.journal_path)
+
+    def _update(self, target, **fields):
+        with self._lock:
+            self.journal[target].update(fields)
+            self._save_journal()
+
+    def submit(self, dataset, request, target):
+        """
+        Add a download job. Jobs are identified by their target file name.
+
+        Parameters:
+          dataset (str): CDS dataset name, e.g. "reanalysis-era5-single-levels".
+          request (dict): CDS request.
+          target (str): Target file name, relative to 'target_dir'.
+        """
+        key = request_key(dataset, request)
+        self.jobs[target] = (dataset, request)
+        entry = self.journal.get(target)
+        completed = entry is not None and entry["state"] == COMPLETED and entry["key"] == key \
+            and os.path.exists(os.path.join(self.target_dir, target))
+        if not completed:
+            # New, changed or failed jobs start from scratch; interrupted jobs keep their CDS request.
+            request_id = entry.get("request_id") if entry is not None and entry["key"] == key else None
+            self.journal[target] = {"key": key, "state": PENDING, "attempts": 0, "error": None,
+                                    "request_id": request_id}
+
+    def _client(self):
+        if not hasattr(self._local, "client"):
+            self._local.client = self.client_factory()
+        return self._local.client
+
+    def _run_job(self, target):
+        dataset, request = self.jobs[target]
+        target_path = os.path.join(self.target_dir, target)
+        tmp_path = f"{target_path}.part"
+
+        for attempt in range(self.max_retries + 1):
+            self._update(target, state=RUNNING, attempts=self.journal[target]["attempts"] + 1)
+            try:
+                # The request is submitted once and its ID journaled; a resumed job polls it again.
+                client = self._client()
+                start = time.perf_counter()
+                request_id = self.journal[target].get("request_id")
+                if request_id is None:
+                    request_id = client.submit(dataset, request)
+                    self._update(target, request_id=request_id)
+                while client.status(request_id) != COMPLETED:
+                    self.sleep(self.poll_interval)
+                queued = time.perf_counter()
+                client.download(request_id, tmp_path)
+                transferred = time.perf_counter()
+                os.replace(tmp_path, target_path)
+            except Exception as error:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                # A request that failed on the CDS is submitted again; other errors (e.g. network
+                # errors while polling or downloading) retry the same request.
+                resubmit = isinstance(error, RequestFailed) or attempt == self.max_retries
+                self._update(target, state=PENDING, error=repr(error),
+                             request_id=None if resubmit else self.journal[target].get("request_id"))
+                if attempt == self.max_retries:
+                    break
+                # Exponential backoff with jitter, so that retries do not hit the queue in lockstep.
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                self.sleep(delay * random.uniform(0.5, 1.0))
+                continue
+            timings = {"queue_seconds": queued - start, "transfer_seconds": transferred - queued}
+            self._update(target, state=COMPLETED, error=None, **timings)
+            self.metrics.record("download", file=target, status=COMPLETED, attempts=self.journal[target]["attempts"],
+                                written_bytes=os.path.getsize(target_path), **timings)
+            return True
+
+        self._update(target, state=FAILED)
+        self.metrics.record("download", file=target, status=FAILED, attempts=self.journal[target]["attempts"],
+                            error=self.journal[target]["error"])
+        return False
+
+    def run(self):
+        """
+        Download every submitted job that is not completed yet.
+
+        Returns:
+          dict: Target names per final state ('completed', 'failed', 'skipped').
+        """
+        with self._lock:
+            self._save_journal()
+        todo = [target for target in self.jobs if self.journal[target]["state"] != COMPLETED]
+        summary = {COMPLETED: [], FAILED: [], "skipped": [target for target in self.jobs if target not in todo]}
+        for target in summary["skipped"]:
+            print(f"{target} already downloaded, skipping.")
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self._run_job, target): target for target in todo}
+            for future in as_completed(futures):
+                target = futures[future]
+                if future.result():
+                    summary[COMPLETED].append(target)
+                    print(f"Downloaded {target}")
+                else:
+                    summary[FAILED].append(target)
+                    print(f"Failed to download {target}: {self.journal[target]['error']}")
+        return summary
@@ -0,0 +1,349 @@
+# Declarative derived variables and temporal aggregations, computed block by block.
+#
+# A DerivedStage is fed the blocks of time steps that a pipeline stage already holds in memory
+# (the chunks appended by mainGR.merge_and_filter_nc, the blocks of
+# NetCDFInterpolator.stream_to_file), so no stage re-reads its output to compute them. It adds
+# the registered derived variables (e.g. 10 m wind speed and direction from u10/v10) and appends
+# them to "<output>_derived.nc", and it reduces the variables over "valid_time" bins (daily by
+# default) into "<output>_daily.nc". Bins are reduced with vectorized group reductions
+# (ufunc.reduceat); the last, possibly incomplete, bin of a block is carried over to the next one.
+
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from ERA5_Interpolation.stream_writer import NetCDFStreamWriter
+
+GRID_DIMS = ("valid_time", "latitude", "longitude")
+REDUCTIONS = ("mean", "max", "min", "sum")
+# Reductions of every variable over each time bin; variables absent from the data are skipped.
+DEFAULT_AGGREGATIONS = {
+    "t2m": ("mean", "max", "min"),
+    "tp": ("sum",),
+    "wind_speed": ("mean", "max"),
+}
+# Names of the aggregate outputs of common bin frequencies (pandas period aliases).
+FREQUENCY_NAMES = {"h": "hourly", "D": "daily", "W": "weekly", "M": "monthly", "Y": "yearly"}
+
+
+def wind_speed(u10, v10):
+    return np.hypot(u10, v10)
+
+
+def wind_direction(u10, v10):
+    # Meteorological convention: the direction the wind blows from, in degrees clockwise from north.
+    return np.mod(180.0 + np.degrees(np.arctan2(u10, v10)), 360.0)
+
+
+# Derived variables: ERA5 short names of their inputs, function of the input arrays, attributes.
+DERIVED = {
+    "wind_speed": {"inputs": ("u10", "v10"), "function": wind_speed,
+                   "attrs": {"units": "m s**-1", "long_name": "10 metre wind speed"}},
+    "wind_direction": {"inputs": ("u10", "v10"), "function": wind_direction,
+                       "attrs": {"units": "degrees", "long_name": "10 metre wind direction (from)"}},
+}
+
+
+def register_derived(name, inputs, function, attrs=None):
+    """
+    Adds a derived variable to the registry.
+
+    Parameters:
+      name (str): Name of the derived variable.
+      inputs (tuple): Names of the input variables, passed to 'function' in this order.
+      function (callable): Vectorized function of the input arrays returning the derived array.
+      attrs (dict): Attributes of the derived variable (e.g. units, long_name).
+    """
+    DERIVED[name] = {"inputs": tuple(inputs), "function": function, "attrs": dict(attrs or {})}
+
+
+def add_derived(block, names=None):
+    """
+    Computes derived variables from a block.
+
+    Parameters:
+      block (xarray.Dataset): Loaded block of (valid_time, latitude, longitude) variables.
+      names (list): Registered derived variables to compute. None computes every registered
+        variable whose inputs are in the block; listed variables must have their inputs.
+
+    Returns:
+      xarray.Dataset: The derived variables.
+    """
+    if names is None:
+        names = [name for name, spec in DERIVED.items() if all(input in block for input in spec["inputs"])]
+    derived = {}
+    for name in names:
+        if name not in DERIVED:
+            raise ValueError(f"Unknown derived variable '{name}'. Known variables: {', '.join(sorted(DERIVED))}.")
+        spec = DERIVED[name]
+        missing = [input for input in spec["inputs"] if input not in block]
+        if missing:
+            raise ValueError(f"Derived variable '{name}' needs {', '.join(missing)}, which the data does not have.")
+        inputs = [block[input].transpose(*GRID_DIMS).values for input in spec["inputs"]]
+        derived[name] = (GRID_DIMS, spec["function"](*inputs), spec["attrs"])
+    return xr.Dataset(derived, coords={dim: block[dim].values for dim in GRID_DIMS})
+
+
+def time_bins(times, frequency):
+    """
+    Splits increasing time steps into bins of a pandas period frequency (e.g. "D" or "M").
+
+    Returns:
+      tuple: (labels, starts): the start time of every bin and the position of its first step.
+    """
+    labels = pd.DatetimeIndex(times).to_period(frequency).to_timestamp().values
+    if np.any(labels[1:] < labels[:-1]):
+        raise ValueError("Time steps must be in increasing order to be aggregated.")
+    starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+    return labels[starts], starts
+
+
+def _statistics(reductions):
+    # Running statistics needed by the reductions of a variable.
+    needed = set()
+    for reduction in reductions:
+        if reduction not in REDUCTIONS:
+            raise ValueError(f"Reduction '{reduction}' is not defined. Options are {', '.join(REDUCTIONS)}.")
+        needed.update(("sum", "count") if reduction in ("mean", "sum") else (reduction,))
+    return needed
+
+
+def reduce_bins(values, starts, statistics):
+    """
+    Reduces (time, ...) values over the bins starting at 'starts', ignoring NaN.
+
+    Returns:
+      dict: Running statistics ('sum', 'count', 'max', 'min') of shape (n_bins, ...).
+    """
+    reduced = {}
+    if "sum" in statistics:
+        valid = ~np.isnan(values)
+        reduced["sum"] = np.add.reduceat(np.where(valid, values, 0.0), starts, axis=0)
+        reduced["count"] = np.add.reduceat(valid.astype(np.int32), starts, axis=0)
+    if "max" in statistics:
+        reduced["max"] = np.fmax.reduceat(values, starts, axis=0)
+    if "min" in statistics:
+        reduced["min"] = np.fmin.reduceat(values, starts, axis=0)
+    return reduced
+
+
+def _combine(first, second):
+    # Merges the statistics of the same bin computed from two blocks.
+    merge = {"sum": np.add, "count": np.add, "max": np.fmax, "min": np.fmin}
+    return {key: merge[key](first[key], second[key]) for key in first}
+
+
+def output_stem(output_path):
+    """
+    Returns a stage output path without its ".nc" or ".zarr" extension; derived outputs are
+    named "<stem>_<suffix>.nc".
+    """
+    stem = output_path.rstrip("/")
+    for extension in (".nc", ".zarr"):
+        if stem.endswith(extension):
+            stem = stem[:-len(extension)]
+    return stem
+
+
+class DerivedStage:
+    def __init__(self, derived_file=None, aggregate_file=None, derived=None, aggregations=None, frequency="D",
+                 dtype="float32", append=False):
+        """
+        Set up the derived outputs of a pipeline stage.
+
+        Parameters:
+          derived_file (str): NetCDF file of the derived variables, or None to not write them.
+          aggregate_file (str): NetCDF file of the aggregates, or None to not aggregate.
+          derived (list): Derived variables to compute (see add_derived) (default: None, which
+            computes every registered variable whose inputs are present).
+          aggregations (dict): Reductions per variable, e.g. {'t2m': ('mean', 'max')}; variables
+            (including derived ones) absent from the data are skipped (default: DEFAULT_AGGREGATIONS).
+          frequency (str): pandas period frequency of the bins, e.g. "D" or "M" (default: "D").
+          dtype (str): Data type of the outputs (default: 'float32').
+          append (bool): Extend existing outputs (as mainGR.merge_and_filter_nc extends the merged
+            file): the last stored bin is completed with the new time steps (default: False, which
+            writes new outputs through temporary files renamed on close).
+        """
+        self.derived_file = derived_file
+        self.aggregate_file = aggregate_file
+        self.derived = derived
+        self.aggregations = dict(DEFAULT_AGGREGATIONS if aggregations is None else aggregations)
+        self.statistics = {name: _statistics(reductions) for name, reductions in self.aggregations.items()}
+        self.frequency = frequency
+        self.dtype = dtype
+        self.append = append
+        self._writers = {}
+        self._coords, self._attrs = {}, {}
+        # Last, possibly incomplete, bin: (labels, n_steps, statistics), each with a leading axis of length 1.
+        self._pending = None
+
+    @classmethod
+    def alongside(cls, output_path, frequency="D", **kwargs):
+        """
+        Create a stage writing "<output>_derived.nc" and "<output>_<frequency name>.nc" next to a
+        stage output (e.g. "GR_merged_filtered_derived.nc" and "GR_merged_filtered_daily.nc").
+        """
+        stem = output_stem(output_path)
+        return cls(derived_file=f"{stem}_derived.nc",
+                   aggregate_file=f"{stem}_{FREQUENCY_NAMES.get(frequency, frequency)}.nc",
+                   frequency=frequency, **kwargs)
+
+    @property
+    def output_files(self):
+        return [path for path in (self.derived_file, self.aggregate_file) if path is not None]
+
+    def _writer(self, path):
+        # Opens the writer of an output on first use; new outputs are written to "<path>.part".
+        if path not in self._writers:
+            if self.append and os.path.exists(path):
+                self._writers[path] = NetCDFStreamWriter(path, mode="a")
+                if path == self.aggregate_file:
+                    self._resume(self._writers[path])
+            else:
+                self._writers[path] = NetCDFStreamWriter(f"{path}.part")
+        return self._writers[path]
+
+    def _resume(self, writer):
+        # Reloads the last stored bin, which the next block may complete, and rewinds the writer onto it.
+        if writer.n_times == 0:
+            return
+        nc, last = writer.nc, writer.n_times - 1
+        n_steps = int(nc["n_steps"][last])
+        statistics = {}
+        for name, needed in self.statistics.items():
+            stored_names = {key: f"{name}_{key}" for key in needed}
+            if not all(stored_name in nc.variables for stored_name in stored_names.values()):
+                if any(f"{name}_{reduction}" in nc.variables for reduction in self.aggregations[name]):
+                    raise ValueError(f"{self.aggregate_file} does not store the running statistics of {name}; "
+                                     f"rebuild it to append to it.")
+                continue
+            stored = {key: np.ma.filled(nc[stored_name][last:last + 1].astype(float), np.nan)
+                      for key, stored_name in stored_names.items()}
+            # The bin's sum and valid count are stored as such, so cells with missing steps resume exactly.
+            if "count" in stored:
+                stored["count"] = stored["count"].astype(np.int32)
+                stored["sum"] = np.nan_to_num(stored["sum"])
+            statistics[name] = stored
+        label = np.datetime64(int(nc["valid_time"][last]), "s").astype("datetime64[ns]")
+        self._pending = (np.array([label]), np.array([n_steps]), statistics)
+        writer.n_times = last
+
+    def add(self, block, aggregate_block=None):
+        """
+        Compute the derived variables and aggregates of a loaded block of time steps.
+
+        Parameters:
+          block (xarray.Dataset): Variables of dimensions (valid_time, latitude, longitude), in time order.
+          aggregate_block (xarray.Dataset): Time steps to aggregate when they differ from 'block', e.g.
+            including the steps a stage filters out of its output, so that every bin covers all the
+            steps of its period (default: None, which aggregates 'block').
+        """
+        derived = add_derived(block, self.derived)
+        if self.derived_file is not None and derived.data_vars and block.sizes["valid_time"]:
+            self._writer(self.derived_file).append(derived.astype(self.dtype))
+        if self.aggregate_file is not None:
+            if aggregate_block is None:
+                self._aggregate(block.assign(derived.data_vars))
+            else:
+                self._aggregate(aggregate_block.assign(add_derived(aggregate_block, self.derived).data_vars))
+
+    def _aggregate(self, data):
+        names = [name for name in self.aggregations if name in data]
+        if not names or data.sizes["valid_time"] == 0:
+            return
+        labels, starts = time_bins(data["valid_time"].values, self.frequency)
+        n_steps = np.diff(np.r_[starts, data.sizes["valid_time"]])
+        self._coords = {dim: data[dim].values for dim in ("latitude", "longitude")}
+        self._attrs.update({name: data[name].attrs for name in names})
+        statistics = {name: reduce_bins(data[name].transpose(*GRID_DIMS).values.astype(float), starts,
+                                        self.statistics[name])
+                      for name in names}
+        # Opening the writer first reloads the last stored bin when appending.
+        writer = self._writer(self.aggregate_file)
+
+        if self._pending is not None:
+            pending_labels, pending_steps, pending_statistics = self._pending
+            if labels[0] < pending_labels[0]:
+                raise ValueError("Time steps must be in increasing order to be aggregated.")
+            if labels[0] == pending_labels[0]:
+                n_steps[0] += pending_steps[0]
+                for name, reduced in statistics.items():
+                    if name in pending_statistics:
+                        first = _combine(pending_statistics[name], {key: value[:1] for key, value in reduced.items()})
+                        for key, value in first.items():
+                            reduced[key][:1] = value
+            else:
+                self._emit(writer, *self._pending)
+
+        # Every bin but the last is complete.
+        if labels.size > 1:
+            self._emit(writer, labels[:-1], n_steps[:-1],
+                       {name: {key: value[:-1] for key, value in reduced.items()} for name, reduced in statistics.items()})
+        self._pending = (labels[-1:], n_steps[-1:],
+                         {name: {key: value[-1:] for key, value in reduced.items()} for name, reduced in statistics.items()})
+
+    def _emit(self, writer, labels, n_steps, statistics):
+        data_vars = {}
+        for name, reduced in statistics.items():
+            attrs = self._attrs.get(name, {})
+            for reduction in self.aggregations[name]:
+                if reduction in ("mean", "sum"):
+                    count = reduced["count"]
+                    with np.errstate(invalid="ignore", divide="ignore"):
+                        value = reduced["sum"] / count if reduction == "mean" else reduced["sum"]
+                    value = np.where(count > 0, value, np.nan)
+                else:
+                    value = reduced[reduction]
+                var_attrs = {key: attrs[key] for key in ("units",) if key in attrs}
+                var_attrs["long_name"] = f"{reduction} of {attrs.get('long_name', name)} per {self.frequency} period"
+                data_vars[f"{name}_{reduction}"] = (GRID_DIMS, value.astype(self.dtype), var_attrs)
+            if "count" in reduced:
+                # Running sum and valid count, from which an appended run completes the last bin.
+                if "sum" not in self.aggregations[name]:
+                    data_vars[f"{name}_sum"] = (GRID_DIMS, reduced["sum"].astype(self.dtype), dict(
+                        {key: attrs[key] for key in ("units",) if key in attrs},
+                        long_name=f"sum of the valid {attrs.get('long_name', name)} per {self.frequency} period"))
+                data_vars[f"{name}_count"] = (GRID_DIMS, reduced["count"].astype(np.int32), {
+                    "long_name": f"number of valid {attrs.get('long_name', name)} time steps per {self.frequency} period"})
+        data_vars["n_steps"] = (("valid_time",), np.asarray(n_steps, dtype=np.int32),
+                                {"long_name": "number of time steps aggregated"})
+        coords = dict(self._coords, valid_time=labels)
+        writer.append(xr.Dataset(data_vars, coords=coords))
+
+    def close(self):
+        """
+        Write the last bin, close the outputs and move new outputs into place.
+        """
+        if self._pending is not None:
+            self._emit(self._writer(self.aggregate_file), *self._pending)
+            self._pending = None
+        self._close_writers(keep=True)
+
+    def _close_writers(self, keep):
+        for path, writer in self._writers.items():
+            writer.close()
+            if writer.output_file != path:
+                if keep:
+                    os.replace(writer.output_file, path)
+                else:
+                    os.remove(writer.output_file)
+        self._writers = {}
+
+    def __enter__(self):
+        # When appending, the last stored bin is reloaded now, so that an aggregate file that cannot be
+        # extended fails before anything is written.
+        if self.append and self.aggregate_file is not None and os.path.exists(self.aggregate_file):
+            try:
+                self._writer(self.aggregate_file)
+            except BaseException:
+                self._close_writers(keep=False)
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # New outputs are discarded; appended outputs keep the blocks written before the error.
+            self._close_writers(keep=False)
@@ -0,0 +1,341 @@
+# Persistent SQLite inventory of the ERA5 files handled by this repository.
+#
+# For every file the inventory records its processing stage, variables, covered time range,
+# days and hours, grid step, bounding box, size, modification time and CRC-32, read from the data
+# (of the NetCDF members for ZIP downloads). Directories are rescanned
+# incrementally: only files whose size or modification time changed are opened again. Questions
+# such as "which regional files cover this region and period" are then answered from the
+# database without opening any NetCDF file.
+#
+# Usage:
+#   python era5_inventory.py --db inventory.sqlite scan /path/to/GR_files --stage regional
+#   python era5_inventory.py --db inventory.sqlite query --stage regional --variable t2m \
+#       --start 2000-01-01 --end 2000-12-31 --bbox 34 42 19 28
+
+import os, json, zlib, shutil, sqlite3, zipfile, argparse, datetime, tempfile
+
+# Processing stages used by the pipeline.
+STAGES = ("download", "extracted", "regional", "merged", "interpolated")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    variables TEXT,
+    start TEXT,
+    end TEXT,
+    day_ranges TEXT,
+    hours TEXT,
+    n_times INTEGER,
+    lat_min REAL, lat_max REAL, lon_min REAL, lon_max REAL,
+    lat_step REAL, lon_step REAL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    checksum TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_stage_time ON files (stage, start, end);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+"""
+
+COLUMNS = ("path", "directory", "stage", "variables", "start", "end", "day_ranges", "hours", "n_times",
+           "lat_min", "lat_max", "lon_min", "lon_max", "lat_step", "lon_step", "size", "mtime", "checksum")
+# Columns read from the file itself by 'describe_file'.
+METADATA = COLUMNS[3:15]
+
+
+def file_checksum(path, buffer_size=16 * 1024 * 1024):
+    """
+    Returns the CRC-32 of a file as an 8-digit hexadecimal string.
+    """
+    crc = 0
+    with open(path, "rb") as data_file:
+        while True:
+            chunk = data_file.read(buffer_size)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+    return f"{crc:08x}"
+
+
+def day_ranges(times):
+    """
+    Compresses the days covered by a time coordinate into [first, last] runs of consecutive days.
+    """
+    days = sorted(set(times.astype("datetime64[D]").tolist()))
+    ranges = []
+    for day in days:
+        if ranges and day - ranges[-1][1] == datetime.timedelta(days=1):
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [[first.isoformat(), last.isoformat()] for first, last in ranges]
+
+
+def _axis_summary(values):
+    step = float(abs(values[1] - values[0])) if values.size > 1 else None
+    return float(values.min()), float(values.max()), step
+
+
+def _describe_netcdf(path):
+    # Variables, time coordinate (or None) and latitude/longitude extents of one NetCDF file.
+    import xarray as xr
+
+    with xr.open_dataset(path) as ds:
+        times = ds["valid_time"].values if "valid_time" in ds.coords else None
+        extent = {}
+        if "latitude" in ds.coords and "longitude" in ds.coords:
+            extent["lat_min"], extent["lat_max"], extent["lat_step"] = _axis_summary(ds["latitude"].values)
+            extent["lon_min"], extent["lon_max"], extent["lon_step"] = _axis_summary(ds["longitude"].values)
+        return sorted(ds.data_vars), times, extent
+
+
+def _describe_zip(path, buffer_size=16 * 1024 * 1024):
+    # Describes every NetCDF member of a ZIP download. Each member is copied to a hidden temporary
+    # file next to the archive (downloads are too large to be read into memory) and opened there.
+    members = []
+    with zipfile.ZipFile(path) as archive:
+        for member in archive.infolist():
+            if not member.filename.endswith(".nc"):
+                continue
+            handle, tmp_path = tempfile.mkstemp(suffix=".nc", prefix=".describe-", dir=os.path.dirname(path))
+            try:
+                with os.fdopen(handle, "wb") as tmp_file, archive.open(member) as source:
+                    shutil.copyfileobj(source, tmp_file, buffer_size)
+                members.append(_describe_netcdf(tmp_path))
+            finally:
+                os.remove(tmp_path)
+    return members
+
+
+def describe_file(path):
+    """
+    Reads the metadata of one file.
+
+    NetCDF files are opened to read their coordinates only. The NetCDF members of ZIP archives are
+    described the same way, so the recorded variables, days, hours and extent are those of the data
+    and not of the "<variable>_Y<year>" name; members are combined into one record. Files that
+    cannot be read get an empty record, which never counts as covering anything.
+
+    Returns:
+      dict: Metadata columns of the inventory (METADATA).
+    """
+    import numpy as np
+
+    record = dict.fromkeys(METADATA)
+    try:
+        members = [_describe_netcdf(path)] if path.endswith(".nc") else _describe_zip(path)
+    except (OSError, ValueError, zipfile.BadZipFile):
+        return record
+    if not members:
+        return record
+
+    record["variables"] = json.dumps(sorted({name for variables, _, _ in members for name in variables}))
+    member_times = [times for _, times, _ in members if times is not None]
+    if member_times:
+        times = np.unique(np.concatenate(member_times))
+        record["n_times"] = int(times.size)
+        if times.size:
+            record["start"] = str(times.min().astype("datetime64[s]"))
+            record["end"] = str(times.max().astype("datetime64[s]"))
+            record["day_ranges"] = json.dumps(day_ranges(times))
+            record["hours"] = json.dumps(sorted({str(time)[11:16] for time in times.astype("datetime64[m]")}))
+    extents = [extent for _, _, extent in members]
+    if all(extents):
+        # Members cover the union of their extents.
+        for column in ("lat_min", "lon_min"):
+            record[column] = min(extent[column] for extent in extents)
+        for column in ("lat_max", "lon_max"):
+            record[column] = max(extent[column] for extent in extents)
+        record["lat_step"], record["lon_step"] = extents[0]["lat_step"], extents[0]["lon_step"]
+    return record
+
+
+class Inventory:
+    def __init__(self, db_path):
+        """
+        Open (and create if needed) an inventory database.
+
+        Parameters:
+          db_path (str): Path to the SQLite database file.
+        """
+        self.db_path = db_path
+        # A generous timeout lets several worker processes update the same inventory.
+        self.connection = sqlite3.connect(db_path, timeout=60)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+        columns = {row["name"] for row in self.connection.execute("PRAGMA table_info(files)")}
+        if "hours" not in columns:
+            # Databases written before hours were recorded: every file is described again on its next scan.
+            self.connection.execute("ALTER TABLE files ADD COLUMN hours TEXT")
+            self.connection.execute("UPDATE files SET mtime = -1")
+            self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def update_directory(self, directory, stage, suffixes=(".nc", ".zip")):
+        """
+        Bring the records of a directory up to date.
+
+        Only files that are new or whose size or modification time changed are read; records
+        of files that no longer exist are removed. Temporary ".part" and hidden files are ignored.
+
+        Parameters:
+          directory (str): Directory to scan.
+          stage (str): Processing stage of the files in the directory (see STAGES).
+          suffixes (tuple): File name suffixes to record.
+
+        Returns:
+          tuple: Numbers of (added or updated, removed) records.
+        """
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage '{stage}'. Options are {', '.join(STAGES)}.")
+        directory = os.path.abspath(directory)
+        known = {row["path"]: (row["size"], row["mtime"], row["stage"]) for row in self.connection.execute(
+            "SELECT path, size, mtime, stage FROM files WHERE directory = ?", (directory,))}
+
+        updated = 0
+        present = set()
+        for entry in os.scandir(directory):
+            if not entry.is_file() or entry.name.startswith(".") or not entry.name.endswith(suffixes):
+                continue
+            present.add(entry.path)
+            stat = entry.stat()
+            if known.get(entry.path) == (stat.st_size, stat.st_mtime, stage):
+                continue
+            self._record(entry.path, directory, stage, stat)
+            updated += 1
+
+        removed = [path for path in known if path not in present]
+        self.connection.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in removed])
+        self.connection.commit()
+        return updated, len(removed)
+
+    def update_file(self, path, stage):
+        """
+        Bring the record of a single file up to date, without scanning the rest of its directory.
+
+        Parameters:
+          path (str): File to record; its record is removed if the file no longer exists.
+          stage (str): Processing stage of the file (see STAGES).
+
+        Returns:
+          bool: True if the record was added, updated or removed.
+        """
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage '{stage}'. Options are {', '.join(STAGES)}.")
+        path = os.path.abspath(path)
+        known = self.connection.execute("SELECT size, mtime, stage FROM files WHERE path = ?", (path,)).fetchone()
+        if not os.path.isfile(path):
+            self.connection.execute("DELETE FROM files WHERE path = ?", (path,))
+            self.connection.commit()
+            return known is not None
+        stat = os.stat(path)
+        if known is not None and tuple(known) == (stat.st_size, stat.st_mtime, stage):
+            return False
+        self._record(path, os.path.dirname(path), stage, stat)
+        self.connection.commit()
+        return True
+
+    def _record(self, path, directory, stage, stat):
+        record = describe_file(path)
+        record.update(path=path, directory=directory, stage=stage, size=stat.st_size,
+                      mtime=stat.st_mtime, checksum=file_checksum(path))
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO files ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+            [record[column] for column in COLUMNS])
+
+    def find(self, stage=None, variable=None, start=None, end=None, bbox=None, name_prefix=None, directory=None):
+        """
+        Find the files that overlap a period and a region.
+
+        Parameters:
+          stage (str): Only files of this processing stage.
+          variable (str): Only files containing this variable (NetCDF name, also for ZIP downloads).
+          start, end (str): ISO dates or times; only files whose time range overlaps [start, end].
+          bbox (tuple): (lat_min, lat_max, lon_min, lon_max); only files whose extent overlaps it.
+          name_prefix (str): Only files whose name starts with this prefix.
+          directory (str): Only files in this directory.
+
+        Returns:
+          list: Records as dicts, ordered by start time.
+        """
+        clauses, parameters = [], []
+        if stage is not None:
+            clauses.append("stage = ?")
+            parameters.append(stage)
+        if directory is not None:
+            clauses.append("directory = ?")
+            parameters.append(os.path.abspath(directory))
+        if start is not None:
+            clauses.append("end >= ?")
+            parameters.append(start)
+        if end is not None:
+            # Compare against the end of the day when only a date is given.
+            clauses.append("start <= ?")
+            parameters.append(end if "T" in end else f"{end}T23:59:59")
+        if bbox is not None:
+            lat_min, lat_max, lon_min, lon_max = bbox
+            clauses.append("lat_max >= ? AND lat_min <= ? AND lon_max >= ? AND lon_min <= ?")
+            parameters.extend([lat_min, lat_max, lon_min, lon_max])
+        query = "SELECT * FROM files"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        rows = [dict(row) for row in self.connection.execute(query + " ORDER BY start, path", parameters)]
+
+        if variable is not None:
+            rows = [row for row in rows if variable in json.loads(row["variables"] or "[]")]
+        if name_prefix is not None:
+            rows = [row for row in rows if os.path.basename(row["path"]).startswith(name_prefix)]
+        return rows
+
+    def covered_days(self, rows):
+        """
+        Expand the day ranges of records into a set of datetime.date.
+        """
+        days = set()
+        for row in rows:
+            for first, last in json.loads(row["day_ranges"] or "[]"):
+                day = datetime.date.fromisoformat(first)
+                last = datetime.date.fromisoformat(last)
+                while day <= last:
+                    days.add(day)
+                    day += datetime.timedelta(days=1)
+        return days
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ERA5 file inventory")
+    parser.add_argument("--db", type=str, required=True, help="Path to the SQLite inventory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    scan = subparsers.add_parser("scan", help="Update the records of a directory")
+    scan.add_argument("directory", type=str)
+    scan.add_argument("--stage", type=str, required=True, choices=STAGES)
+    query = subparsers.add_parser("query", help="List the files covering a region and period")
+    query.add_argument("--stage", type=str, choices=STAGES)
+    query.add_argument("--variable", type=str)
+    query.add_argument("--start", type=str, help="ISO start date")
+    query.add_argument("--end", type=str, help="ISO end date")
+    query.add_argument("--bbox", type=float, nargs=4, metavar=("LAT_MIN", "LAT_MAX", "LON_MIN", "LON_MAX"))
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with Inventory(args.db) as inventory:
+        if args.command == "scan":
+            updated, removed = inventory.update_directory(args.directory, args.stage)
+            print(f"{updated} records added or updated, {removed} removed.")
+        else:
+            rows = inventory.find(stage=args.stage, variable=args.variable, start=args.start, end=args.end,
+                                  bbox=args.bbox)
+            for row in rows:
+                print(f"{row['path']}  {row['stage']}  {row['start']} -> {row['end']}  {row['variables']}")
+            print(f"{len(rows)} files.")
@@ -1,60 +1,98 @@
 #data acqusition 
 # The provided Python script automates the download of specific meteorological variables 
 # lsfrom the Copernicus Climate Data Store (CDS) using the cdsapi library.
-import cdsapi
 import os
+import argparse
+from cds_planner import INVENTORY_NAME, is_downloaded
+from cds_scheduler import CDSDownloadScheduler
+from era5_inventory import Inventory
+from pipeline_metrics import add_metrics_arguments, recorder_from_args
 
 # Define the directory path
-directory_path = "/home/vvatellis/WeatherData/ERA5_hourly_data/single_levels"
-# Change to a new directory
-os.chdir(directory_path)
+DIRECTORY_PATH = "/home/vvatellis/WeatherData/ERA5_hourly_data/single_levels"
 
-dataset = "reanalysis-era5-single-levels"
-client = cdsapi.Client()
+DATASET = "reanalysis-era5-single-levels"
 
  #years = ["2000","2020"]
-years = [1990, 1999]
+YEARS = [1990, 1999]
 
-months = [ "01", "02", "03",
+MONTHS = [ "01", "02", "03",
         "04", "05", "06",
         "07", "08", "09",
-        "10", "11", "12"],
+        "10", "11", "12"]
 
-variables= ["10m_u_component_of_wind",
+VARIABLES = ["10m_u_component_of_wind",
         "10m_v_component_of_wind",
         "2m_temperature",
         "mean_sea_level_pressure",
         "total_precipitation"]
 
-for variable in variables:
-    for year in range(years[0], years[-1] +1, 1):
 
-        request = {
-             "product_type": ["reanalysis"],
-            "variable": variable,
-            "year": year,
-            "month": [ "01", "02", "03",
-			 "04", "05", "06",
-        "07", "08", "09",
-        "10", "11", "12"],
-            "day": [
-                "01", "02", "03",
-                "04", "05", "06",
-                "07", "08", "09",
-                "10", "11", "12",
-                "13", "14", "15",
-                "16", "17", "18",
-                "19", "20", "21",
-                "22", "23", "24",
-                "25", "26", "27",
-                "28", "29", "30",
-                "31"
-            ],
-            "time": ["00:00", "06:00", "12:00", "18:00" ],
-            "data_format": "netcdf",
-            "download_format": "zip",
-        }
-
-        target = f"{variable}_Y{year}.nc.zip"
-        client.retrieve(dataset, request, target)
-        print(f"\nDownloaded data for {variable}-{year}")
+def build_jobs(variables=VARIABLES, years=YEARS, months=MONTHS):
+    """
+    Returns the (dataset, request, target) of every download, one per variable and year.
+    """
+    jobs = []
+    for variable in variables:
+        for year in range(years[0], years[-1] +1, 1):
+
+            request = {
+                 "product_type": ["reanalysis"],
+                "variable": variable,
+                "year": year,
+                "month": list(months),
+                "day": [
+                    "01", "02", "03",
+                    "04", "05", "06",
+                    "07", "08", "09",
+                    "10", "11", "12",
+                    "13", "14", "15",
+                    "16", "17", "18",
+                    "19", "20", "21",
+                    "22", "23", "24",
+                    "25", "26", "27",
+                    "28", "29", "30",
+                    "31"
+                ],
+                "time": ["00:00", "06:00", "12:00", "18:00" ],
+                "data_format": "netcdf",
+                "download_format": "zip",
+            }
+
+            target = f"{variable}_Y{year}.nc.zip"
+            jobs.append((DATASET, request, target))
+    return jobs
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Download ERA5 single-level variables from the CDS")
+    parser.add_argument("--target_dir", type=str, default=DIRECTORY_PATH, help="Directory where the downloads are saved")
+    parser.add_argument("--workers", type=int, default=4, help="Number of requests kept in flight")
+    parser.add_argument("--inventory", type=str, default=None,
+                        help="Path to the file inventory (default: .era5_inventory.sqlite in --target_dir)")
+    add_metrics_arguments(parser)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # Keeps several requests in the CDS queue at once and resumes from its journal after a failure;
+    # targets are written inside --target_dir, and cdsapi is only imported by the workers.
+    # Queue and transfer times of every job go to --metrics_log / --prometheus_file.
+    metrics = recorder_from_args(args)
+    scheduler = CDSDownloadScheduler(args.target_dir, workers=args.workers, metrics=metrics)
+    # Requests whose variable, days, hours and area are already in --target_dir, under any file name,
+    # are skipped.
+    with Inventory(args.inventory or os.path.join(args.target_dir, INVENTORY_NAME)) as inventory:
+        inventory.update_directory(args.target_dir, "download")
+        for dataset, request, target in build_jobs():
+            if is_downloaded(inventory, args.target_dir, request):
+                print(f"{target}: already downloaded, skipping.")
+                continue
+            scheduler.submit(dataset, request, target)
+    with metrics.stage("download", jobs=len(scheduler.jobs)):
+        scheduler.run()
+
+
+if __name__ == "__main__":
+    main()
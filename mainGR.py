@@ -1,11 +1,34 @@
 # The script aims to prepare the data 
 
-import os, zipfile
+import os, zipfile, zlib, glob, json
+import contextlib
 import numpy as np
-import matplotlib.pyplot as plt
+import pandas as pd
 import xarray as xr
+import netCDF4
 import shutil
+import tempfile
 import argparse
+import multiprocessing
+import time
+import dask
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from derived_variables import DerivedStage, output_stem
+from era5_inventory import Inventory
+from pipeline_metrics import MetricsRecorder, add_metrics_arguments, measure, recorder_from_args
+from region_subset import REGIONS, subset, subset_many
+
+# Copy buffer used when extracting ZIP members (shutil's default is only 64 KiB).
+DEFAULT_BUFFER_SIZE = 16 * 1024 * 1024
+# Worker processes are spawned rather than forked: forking a process in which Dask or HDF5
+# threads are already running can deadlock the children.
+SPAWN = multiprocessing.get_context("spawn")
+# Number of time steps per chunk of the regional outputs (one month of hourly data).
+DEFAULT_TIME_CHUNK = 720
+# Memory shared by the workers of the fused extract-and-subset mode for ZIP members decompressed
+# into memory: each worker keeps members up to budget / workers in memory and streams larger
+# ones to a scratch file.
+DEFAULT_IN_MEMORY_BUDGET = 2 * 1024 ** 3
 
 
 # ---------------------------
@@ -19,125 +42,691 @@ def parse_args():
                         help="Path to the folder where the data will be extracted")
     parser.add_argument("--output_dir", type=str, default="/home/vvatellis/WeatherData/ERA5_hourly_data/single_level_ERA5_Greece", 
                         help="Path to the output folder where the data for greece will be extracted")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="Number of threads (or processes with --fused) used to extract the ZIP files")
+    parser.add_argument("--buffer_mb", type=int, default=16,
+                        help="Copy buffer size in MiB used when extracting the ZIP files")
+    parser.add_argument("--fused", action="store_true",
+                        help="Subset each ZIP member straight to the regions without writing the full-size files")
+    parser.add_argument("--keep_extracted", action="store_true",
+                        help="With --fused, also keep the full-size extracted files in --extract_dir")
+    parser.add_argument("--scratch_dir", type=str, default=None,
+                        help="With --fused, directory for temporary full-size files too large to decompress in memory")
+    parser.add_argument("--in_memory_mb", type=int, default=DEFAULT_IN_MEMORY_BUDGET // 1024 ** 2,
+                        help="With --fused, MiB of ZIP members decompressed in memory at once, shared by the workers; "
+                             "larger members go through --scratch_dir")
+    parser.add_argument("--compression", type=str, default="zlib", choices=["zlib", "zstd", "none"],
+                        help="Compression of the regional NetCDF files")
+    parser.add_argument("--complevel", type=int, default=4, help="Compression level of the regional NetCDF files")
+    parser.add_argument("--time_chunk", type=int, default=DEFAULT_TIME_CHUNK,
+                        help="Time steps per chunk when reading and writing the regional NetCDF files")
+    parser.add_argument("--regions", type=str, nargs="+", default=["greece"], choices=sorted(REGIONS),
+                        help="Registered regions cut from every file in one read (default: greece)")
+    parser.add_argument("--inventory", type=str, default=None,
+                        help="Path to the SQLite file inventory updated after every stage (see era5_inventory.py)")
+    parser.add_argument("--rebuild_merge", action="store_true",
+                        help="Rebuild the merged file from scratch instead of appending the new files")
+    parser.add_argument("--derived", action="store_true",
+                        help="While merging, also write wind speed/direction and time aggregates next to the merged file")
+    parser.add_argument("--aggregation_frequency", type=str, default="D",
+                        help="pandas period frequency of the aggregates written with --derived (default: D, daily)")
+    add_metrics_arguments(parser)
     
     return parser.parse_args()
 
 
-def merge_and_filter_nc(data_dir, file_pattern="GR_*.nc", filter_hour=19, output_filename="GR_merged_filtered.nc"):
+def _load_manifest(manifest_path):
+    """
+    Loads the merge manifest: the inputs already merged, with their size, modification time and time range,
+    and the 'derived' options of the merge.
+    """
+    if not os.path.exists(manifest_path):
+        return {"inputs": {}}
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def _save_manifest(manifest, manifest_path):
+    tmp_path = f"{manifest_path}.part"
+    with open(tmp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def _file_record(path, row=None):
+    """
+    Returns the manifest record of a file. The time range and variables come from the file's
+    inventory record 'row' when it is up to date; otherwise only the metadata of the file is read.
+    """
+    stat = os.stat(path)
+    if row is not None and row["size"] == stat.st_size and row["mtime"] == stat.st_mtime and row["start"]:
+        start, end, variables = row["start"], row["end"], json.loads(row["variables"] or "[]")
+    else:
+        with xr.open_dataset(path) as ds:
+            times = ds["valid_time"].values.astype("datetime64[s]")
+            variables = sorted(ds.data_vars)
+        start, end = str(times.min()), str(times.max())
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "start": start, "end": end, "variables": variables}
+
+
+def _merged_contents(output_path):
+    """
+    Returns the last time step stored in the merged output (None if it has none) and its
+    variables, or (None, None) if the output does not exist yet.
+    """
+    if not os.path.exists(output_path):
+        return None, None
+    open_store = xr.open_zarr if output_path.rstrip("/").endswith(".zarr") else xr.open_dataset
+    with open_store(output_path) as ds:
+        last_time = ds["valid_time"].values.max() if ds.sizes["valid_time"] else None
+        return last_time, sorted(ds.data_vars)
+
+
+def _describe_layout(files):
+    """
+    Returns a description of the variables of a period's files, e.g. "[t2m], [tp, u10]".
+    """
+    return ", ".join(f"[{', '.join(file_variables)}]" for file_variables in files)
+
+
+def _check_appendable(new_records, groups, last_time, variables, appending):
+    """
+    Raises a ValueError if new inputs cannot be appended to the merged output: inputs that do
+    not start after its last time step, periods whose variables differ from its variables, or
+    periods not split into files of the same variables as the others (e.g. a missing or an extra
+    file), which the nested combine of open_mfdataset cannot align.
+
+    Inputs of an interrupted append ('appending' in the manifest) are compared with the output
+    as it was before that append, since part of their data may already be in it.
+    """
+    for name, record in sorted(new_records.items()):
+        reference = appending["last_time"] if appending.get("inputs", {}).get(name) == record else last_time
+        if reference is not None and pd.Timestamp(record["start"]) <= pd.Timestamp(reference):
+            raise ValueError(f"{name} starts at {record['start']}, not after the last merged time step "
+                             f"({pd.Timestamp(reference)}); use rebuild=True to merge it.")
+
+    layout, layout_period = None, None
+    for (start, end), names in sorted(groups.items()):
+        # The variables of every file of the period, in the order the files are combined.
+        files = [new_records[name]["variables"] for name in names]
+        group_variables = sorted({variable for name in names for variable in new_records[name]["variables"]})
+        if sum(len(file_variables) for file_variables in files) != len(group_variables):
+            raise ValueError(f"The files of {start} to {end} ({', '.join(sorted(names))}) hold a variable more than "
+                             f"once; keep one file per variable and period.")
+        if layout is None:
+            layout, layout_period = files, f"{start} to {end}"
+        if files != layout:
+            raise ValueError(f"The files of {start} to {end} ({', '.join(sorted(names))}) hold the "
+                             f"variables {_describe_layout(files)}, but the files of {layout_period} "
+                             f"hold {_describe_layout(layout)}; every period must have one file of each set of "
+                             f"variables to be merged.")
+        if variables is None:
+            variables = group_variables
+        if group_variables != variables:
+            raise ValueError(f"The files of {start} to {end} hold the variables {', '.join(group_variables)}, but "
+                             f"the merged data holds {', '.join(variables)}; use rebuild=True to merge a new variable "
+                             f"and make sure every period has files of all variables.")
+
+
+def _append_chunk(chunk, output_path, encoding):
+    """
+    Appends a chunk of time steps to the merged output, creating the output on the first call.
+
+    NetCDF outputs are created with an unlimited 'valid_time' dimension and extended in place with
+    the netCDF4 library, which packs the values with the stored scale_factor/add_offset and encodes
+    the times with the stored units. Zarr outputs are extended with 'append_dim'.
+    """
+    # Chunks are bounded by 'time_chunk', so they are loaded and written sequentially.
+    chunk = chunk.load()
+    if output_path.rstrip("/").endswith(".zarr"):
+        if os.path.exists(output_path):
+            chunk.to_zarr(output_path, append_dim="valid_time")
+        else:
+            chunk.to_zarr(output_path, mode="w")
+        return
+
+    if not os.path.exists(output_path):
+        _write_atomic(chunk, output_path, encoding, unlimited_dims=["valid_time"])
+        return
+
+    with netCDF4.Dataset(output_path, "a") as nc:
+        time_var = nc["valid_time"]
+        start = len(time_var)
+        stop = start + chunk.sizes["valid_time"]
+        times = pd.to_datetime(chunk["valid_time"].values).to_pydatetime()
+        time_var[start:stop] = netCDF4.date2num(times, time_var.units, getattr(time_var, "calendar", "standard"))
+        for name, variable in chunk.data_vars.items():
+            if "valid_time" in variable.dims:
+                # Missing values are masked so that netCDF4 stores them as the _FillValue of packed variables
+                # (it packs the masked values too, hence the ignored cast warning).
+                with np.errstate(invalid="ignore"):
+                    nc[name][start:stop] = np.ma.masked_invalid(variable.transpose(*nc[name].dimensions).values)
+
+
+def merge_and_filter_nc(data_dir, file_pattern="GR_*.nc", filter_hour=19, output_filename="GR_merged_filtered.nc",
+                        time_chunk=DEFAULT_TIME_CHUNK, rebuild=False, inventory=None, derived=None, metrics=None):
     """
     Merges multiple NetCDF files from the specified directory, filters out time steps where the hour equals 'filter_hour',
-    and saves the merged and filtered dataset to a new NetCDF file.
+    and appends the result to a merged NetCDF file (or a Zarr store if 'output_filename' ends with ".zarr").
+
+    The merge is incremental:
+      - A manifest ("<output>.manifest.json") records the inputs already merged, with their time range.
+      - Only new inputs are opened. They are grouped by time range (one group holds all variables of
+        a period, e.g. one year) and ordered by time from the manifest records, then combined with
+        xarray's open_mfdataset using combine="nested", which skips comparing the coordinates of every file.
+      - The combined data is appended to the output in chunks of 'time_chunk' time steps, each
+        filtered with one vectorized hour mask. Time steps already in the output are skipped, so a
+        run interrupted while appending can simply be repeated.
+    New inputs must start after the merged data and every period must cover the same variables, split
+    into the same files (one per variable, as written by this module); otherwise a ValueError is raised before anything is appended, and 'rebuild' merges everything again.
+
+    With 'derived', every appended chunk is also passed, while in memory, to a derived_variables.DerivedStage
+    writing the derived variables of the merged time steps and the time aggregates of all time steps (the
+    filtered hour included) next to the output ("<output>_derived.nc" and e.g.
+    "<output>_daily.nc"). They are extended with the merged file; after an interrupted merge, rebuild them
+    with 'rebuild'. Turning 'derived' on (or changing it) for an output merged without it also requires
+    'rebuild'. Files named like the output's derived outputs ("<output stem>_*.nc") are never merged.
 
     Parameters:
       data_dir (str): Directory containing the NetCDF files.
       file_pattern (str): Glob pattern to match files for merging (default: "GR_*.nc").
       filter_hour (int): Hour value to filter out (default: 19 to remove 19:00 data).
       output_filename (str): Name of the output NetCDF file (default: "GR_merged_filtered.nc").
+      time_chunk (int): Number of time steps appended at once (default: 720).
+      rebuild (bool): Discard the existing output and manifest and merge everything again (default: False).
+      inventory (era5_inventory.Inventory): File inventory providing the time range of the inputs without
+        opening them (default: None).
+      derived (dict): Keyword arguments of derived_variables.DerivedStage.alongside (e.g. {"frequency": "D"}),
+        or None to not compute derived outputs (default: None).
+      metrics (pipeline_metrics.MetricsRecorder): Recorder of a "merge" record with the number of files
+        and time steps merged (default: None).
 
     Returns:
       str: Full path to the saved merged and filtered NetCDF file.
     """
-    # Build the file pattern path (e.g., "/path/to/greece_data/GR_*.nc")
-    file_path = os.path.join(data_dir, file_pattern)
-    
-    # Merge all NetCDF files matching the pattern using xarray's open_mfdataset.
-    # 'combine="by_coords"' merges datasets based on their coordinate values.
-    merged_ds = xr.open_mfdataset(file_path, combine='by_coords')
-    
-    # Filter out the time steps where the hour equals filter_hour.
-    # The dt.hour accessor extracts the hour from the time coordinate.
-    filtered_ds = merged_ds.sel(valid_time=merged_ds.valid_time.dt.hour != filter_hour)
-    
-    # Build the full output path.
+    # Build the full output and manifest paths.
     output_path = os.path.join(data_dir, output_filename)
-    
-    # Save the merged and filtered dataset to a new NetCDF file.
-    filtered_ds.to_netcdf(output_path)
-    
-    print(f"Merged and filtered dataset saved to {output_path}")
+    manifest_path = f"{output_path.rstrip('/')}.manifest.json"
+    stage_paths = [] if derived is None else DerivedStage.alongside(output_path, **derived).output_files
+    if rebuild:
+        for path in [output_path, manifest_path] + stage_paths:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+    manifest = _load_manifest(manifest_path)
+    # The manifest records the 'derived' options the whole output was merged with.
+    if derived is not None and os.path.exists(output_path) and manifest.get("derived") != derived:
+        raise ValueError(f"{output_path} was not merged with derived={derived}; use rebuild=True to merge "
+                         f"everything again with them.")
+
+    # Find the inputs that are not in the manifest (or changed since they were merged).
+    inventory_rows = {} if inventory is None else {row["path"]: row for row in inventory.find(directory=data_dir)}
+    new_records = {}
+    # The output and its derived outputs ("<output stem>_*.nc"), with or without 'derived', are never inputs.
+    derived_prefix = f"{os.path.abspath(output_stem(output_path))}_"
+    for path in sorted(glob.glob(os.path.join(data_dir, file_pattern))):
+        if os.path.abspath(path) == os.path.abspath(output_path) or os.path.abspath(path).startswith(derived_prefix):
+            continue
+        name = os.path.basename(path)
+        stat = os.stat(path)
+        merged = manifest["inputs"].get(name)
+        if merged is not None and merged["size"] == stat.st_size and merged["mtime"] == stat.st_mtime:
+            continue
+        if merged is not None:
+            raise ValueError(f"{name} changed since it was merged; use rebuild=True to merge everything again.")
+        new_records[name] = _file_record(path, inventory_rows.get(os.path.abspath(path)))
+
+    if not new_records:
+        print(f"No new files to merge into {output_path}")
+        return output_path
+
+    # Group the new files by time range and order the groups by time, and the files of a group by their variables.
+    groups = {}
+    for name, record in new_records.items():
+        groups.setdefault((record["start"], record["end"]), []).append(name)
+    for names in groups.values():
+        names.sort(key=lambda name: (new_records[name]["variables"], name))
+    nested_paths = [[os.path.join(data_dir, name) for name in groups[time_range]] for time_range in sorted(groups)]
+
+    # Refuse inputs whose data would be dropped or misplaced by an append, before writing anything.
+    last_time, variables = _merged_contents(output_path)
+    appending = manifest.get("appending", {})
+    _check_appendable(new_records, groups, last_time, variables, appending)
+
+    # Record the inputs being appended, so that an interrupted append can be repeated.
+    resumed = any(appending.get("inputs", {}).get(name) == record for name, record in new_records.items())
+    manifest["appending"] = {"inputs": new_records,
+                             "last_time": appending["last_time"] if resumed else
+                             (None if last_time is None else str(pd.Timestamp(last_time)))}
+    _save_manifest(manifest, manifest_path)
+
+    start_time = time.perf_counter()
+    appended_steps = 0
+    merged_ds = xr.open_mfdataset(nested_paths, combine="nested", concat_dim=["valid_time", None])
+    encoding = regional_encoding(merged_ds, time_chunk=time_chunk)
+    # The derived outputs are extended together with an existing merged output.
+    stage = (contextlib.nullcontext() if derived is None
+             else DerivedStage.alongside(output_path, append=last_time is not None, **derived))
+    try:
+        with stage:
+            for start in range(0, merged_ds.sizes["valid_time"], time_chunk):
+                chunk = merged_ds.isel(valid_time=slice(start, start + time_chunk))
+
+                # Vectorized masks per chunk: skip anything already merged, then drop the filtered hour.
+                times = chunk["valid_time"].values
+                new = np.ones(times.size, dtype=bool) if last_time is None else times > last_time
+                if not new.any():
+                    continue
+                chunk = chunk.isel(valid_time=np.flatnonzero(new)).load()
+                keep = pd.DatetimeIndex(chunk["valid_time"].values).hour != filter_hour
+                kept = chunk.isel(valid_time=np.flatnonzero(keep))
+                if keep.any():
+                    _append_chunk(kept, output_path, encoding)
+                    appended_steps += kept.sizes["valid_time"]
+                if derived is not None:
+                    # The aggregates cover every hour of their periods, including the filtered one.
+                    stage.add(kept, aggregate_block=chunk)
+    finally:
+        merged_ds.close()
+
+    # Record the merged inputs only once their data is in the output.
+    manifest["inputs"].update(new_records)
+    manifest["derived"] = derived
+    del manifest["appending"]
+    _save_manifest(manifest, manifest_path)
+
+    if metrics is not None:
+        metrics.record("merge", file=os.path.basename(output_path.rstrip("/")), files=len(new_records),
+                       time_steps=appended_steps, seconds=time.perf_counter() - start_time)
+    print(f"Merged {len(new_records)} new files into {output_path}")
     return output_path
 
 
-def extract_zip_files(data_dir, extract_dir):
+def _list_zip_members(data_dir):
+    """
+    Lists the members of every ZIP file in 'data_dir' with the name of their extracted file.
+
+    If a ZIP contains exactly one file, the name is the ZIP name without the ".zip" extension
+    (e.g., "data1.nc.zip" becomes "data1.nc"). If it contains multiple files, the name is the
+    ZIP base name plus the member's file name.
+
+    Returns:
+      list: (zip_path, member, output_name) tuples.
+    """
+    members_list = []
+    for zip_file in sorted(os.listdir(data_dir)):
+        if zip_file.endswith(".zip"):
+            zip_path = os.path.join(data_dir, zip_file)
+            with zipfile.ZipFile(zip_path, "r") as zip_ref:
+                members = [member for member in zip_ref.infolist() if not member.is_dir()]
+
+            for member in members:
+                if len(members) == 1:
+                    output_name = os.path.splitext(zip_file)[0]
+                else:
+                    output_name = os.path.splitext(zip_file)[0] + "_" + os.path.basename(member.filename)
+                members_list.append((zip_path, member, output_name))
+    return members_list
+
+
+def _member_is_extracted(output_path, member, buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Checks whether 'output_path' holds a complete copy of a ZIP member.
+
+    The file must exist, match the uncompressed size recorded in the ZIP and match its CRC-32,
+    so that truncated outputs left by a killed run are extracted again instead of being skipped.
+
+    Parameters:
+      output_path (str): Path of the extracted file.
+      member (zipfile.ZipInfo): Metadata of the ZIP member.
+      buffer_size (int): Read buffer size in bytes.
+
+    Returns:
+      bool: True if the output is complete.
+    """
+    if not os.path.exists(output_path) or os.path.getsize(output_path) != member.file_size:
+        return False
+    crc = 0
+    with open(output_path, "rb") as extracted_file:
+        while True:
+            chunk = extracted_file.read(buffer_size)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+    return crc == member.CRC
+
+
+def _extract_member(zip_path, member, output_path, buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Extracts one ZIP member to 'output_path' through a temporary file that is renamed once complete.
+    The temporary file is named after the archive too, so that members of different archives
+    extracted to the same name never write to the same temporary file.
+
+    Returns:
+      bool: True if the member was extracted, False if a complete output already existed.
+    """
+    if _member_is_extracted(output_path, member, buffer_size):
+        return False
+
+    tmp_path = f"{output_path}.{os.path.basename(zip_path)}.part"
+    try:
+        # Each thread opens its own handle on the archive; decompression releases the GIL.
+        with zipfile.ZipFile(zip_path, "r") as zip_ref:
+            with zip_ref.open(member) as source_file:
+                with open(tmp_path, "wb") as target_file:
+                    shutil.copyfileobj(source_file, target_file, buffer_size)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+
+def extract_zip_files(data_dir, extract_dir, workers=8, buffer_size=DEFAULT_BUFFER_SIZE, metrics=None):
     """
     Extracts all ZIP files from the specified directory and saves their contents in the extraction directory.
 
     The function does the following:
-      - Iterates over all files in the 'data_dir'.
-      - For each file ending with ".zip":
-          - Opens the ZIP file and lists its contents.
-          - If the ZIP contains exactly one file:
-              - Checks if the output file (with a ".nc" extension) already exists.
-              - If it does not exist, extracts that file and renames it (e.g., "data1.zip" becomes "data1.nc").
-              - Otherwise, skips extraction to save time.
-          - If the ZIP contains multiple files:
-              - For each member file, it checks if the output file (with a prefix based on the ZIP name) already exists.
-              - If it does not exist, extracts and renames the file.
-              - Otherwise, skips that member.
-    
+      - Iterates over all files in the 'data_dir' ending with ".zip" and lists their members.
+      - If a ZIP contains exactly one file, its output name is the ZIP name without the ".zip"
+        extension (e.g., "data1.nc.zip" becomes "data1.nc").
+      - If a ZIP contains multiple files, each output name is the ZIP base name plus the member's file name.
+      - Extracts all members concurrently with a pool of 'workers' threads, each writing to a
+        temporary file that is renamed once complete.
+      - Skips members whose output already exists with the size and CRC-32 recorded in the ZIP;
+        truncated or corrupted outputs are extracted again.
+
     Parameters:
       data_dir (str): Directory path where the ZIP files are located.
       extract_dir (str): Directory path where the extracted files will be saved.
-    
+      workers (int): Number of extraction threads (default: 8).
+      buffer_size (int): Copy buffer size in bytes (default: 16 MiB).
+      metrics (pipeline_metrics.MetricsRecorder): Recorder of one "extract" record per extracted member,
+        with its time and compressed and uncompressed sizes (default: None).
+
     Returns:
       None
     """
-    # Loop over all files in the data directory.
-    for zip_file in os.listdir(data_dir):
-        if zip_file.endswith(".zip"):
-            zip_path = os.path.join(data_dir, zip_file)
-            
-            # Open the ZIP file
-            with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                # Get list of all files contained in the ZIP
-                name_list = zip_ref.namelist()
-                
-                # If there is exactly one file in the ZIP, extract and rename it.
-                if len(name_list) == 1:
-                    # Create output file name by removing the ".zip" extension and appending ".nc"
-                    output_name = os.path.splitext(zip_file)[0]
-                    output_path = os.path.join(extract_dir, output_name)
-                    
-                    # Check if the file already exists
-                    if os.path.exists(output_path):
-                        print(f"File {output_name} already exists. Skipping extraction.")
-                    else:
-                        # Extract the file from the ZIP and save it to the output path.
-                        with zip_ref.open(name_list[0]) as source_file:
-                            with open(output_path, "wb") as target_file:
-                                shutil.copyfileobj(source_file, target_file)
-                        print(f"Extracted: {zip_file} -> {output_name}")
-                else:
-                    # If there are multiple files in the ZIP, extract each file and rename accordingly.
-                    for member in zip_ref.infolist():
-                        # Build output name: ZIP base name plus the member's file name.
-                        member_name = os.path.basename(member.filename)
-                        output_name = os.path.splitext(zip_file)[0] + "_" + member_name
-                        output_path = os.path.join(extract_dir, output_name)
-                        
-                        # Check if this member has already been extracted
-                        if os.path.exists(output_path):
-                            print(f"File {output_name} already exists. Skipping extraction of this member.")
-                        else:
-                            # Extract each member and write to the output path.
-                            with zip_ref.open(member) as source_file:
-                                with open(output_path, "wb") as target_file:
-                                    shutil.copyfileobj(source_file, target_file)
-                            print(f"Extracted member: {output_name}")
-            
-            print(f"Completed processing of {zip_file}.\n")
-
-
-def process_netcdf_files(extract_dir, output_dir, lat_min, lat_max, lon_min, lon_max):
+    metrics = metrics if metrics is not None else MetricsRecorder()
+
+    def extract(zip_path, member, output_path):
+        # Timed in its thread; the byte counts come from the ZIP, as /proc counters are per process.
+        start = time.perf_counter()
+        extracted = _extract_member(zip_path, member, output_path, buffer_size)
+        if extracted:
+            metrics.record("extract", file=os.path.basename(output_path), seconds=time.perf_counter() - start,
+                           read_bytes=member.compress_size, written_bytes=member.file_size)
+        return extracted
+
+    # Collect the members of every ZIP file in the data directory.
+    tasks = [(zip_path, member, os.path.join(extract_dir, output_name))
+             for zip_path, member, output_name in _list_zip_members(data_dir)]
+
+    # Extract the members concurrently.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(extract, zip_path, member, output_path): output_path
+                   for zip_path, member, output_path in tasks}
+        for future in as_completed(futures):
+            output_name = os.path.basename(futures[future])
+            if future.result():
+                print(f"Extracted: {output_name}")
+            else:
+                print(f"File {output_name} already exists. Skipping extraction.")
+
+    print(f"Completed processing of {len(tasks)} ZIP members.\n")
+
+
+def subset_region(ds, lat_min, lat_max, lon_min, lon_max):
+    """
+    Subsets a dataset to a geographic region. Selection is lazy: only the region is read from disk.
+
+    Latitudes may be stored in either order and longitudes in the 0-360 or -180-180 convention
+    (see region_subset.py); a region that does not overlap the grid raises a ValueError.
+
+    Parameters:
+      ds (xarray.Dataset): Dataset with 'latitude' and 'longitude' coordinates.
+      lat_min, lat_max, lon_min, lon_max (float): Boundaries of the target region.
+
+    Returns:
+      xarray.Dataset: The regional subset.
+    """
+    return subset(ds, (lat_min, lat_max, lon_min, lon_max))
+
+
+def region_targets(lat_min, lat_max, lon_min, lon_max, regions=None):
+    """
+    Returns the (file prefix, bounds) of the regions to cut: the named 'regions' from the registry
+    of region_subset.py if given, otherwise the bounds with the "GR" prefix.
+    """
+    if regions is None:
+        return [("GR", (lat_min, lat_max, lon_min, lon_max))]
+    return [(REGIONS[name]["prefix"], REGIONS[name]["bounds"]) for name in regions]
+
+
+def _pending_targets(output_dir, file, targets):
+    # (bounds, output path) of the regions whose output does not exist yet. Outputs are renamed
+    # into place once complete, so an existing file is complete.
+    pending = []
+    for prefix, region in targets:
+        output_path = os.path.join(output_dir, f"{prefix}_{file}")
+        if os.path.exists(output_path):
+            print(f"File {prefix}_{file} already processed, skipping.")
+        else:
+            pending.append((region, output_path))
+    return pending
+
+
+def _write_atomic(ds, output_path, encoding=None, unlimited_dims=None):
+    """
+    Writes a dataset to 'output_path' through a temporary file that is renamed once complete.
+    """
+    tmp_path = f"{output_path}.part"
+    try:
+        ds.to_netcdf(tmp_path, encoding=encoding, unlimited_dims=unlimited_dims)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _extract_and_subset_member(zip_path, member, targets, keep_path=None, scratch_dir=None,
+                               in_memory_limit=DEFAULT_IN_MEMORY_BUDGET, buffer_size=DEFAULT_BUFFER_SIZE,
+                               **options):
+    """
+    Writes the regional subsets of one ZIP member without keeping its full-size extracted file.
+
+    NetCDF4 (HDF5) files need random access, which a compressed ZIP stream cannot provide cheaply,
+    so the member is decompressed into memory if it is smaller than 'in_memory_limit' and into a
+    temporary file in 'scratch_dir' otherwise; that file is deleted as soon as the subset is written.
+    Only the regional hyperslabs are then read from it.
+
+    Parameters:
+      zip_path (str): Path of the ZIP file.
+      member (zipfile.ZipInfo): Member to process.
+      targets (list): (region bounds, output path) pairs; see '_write_subsets'.
+      keep_path (str): If given, the full-size file is extracted to this path and kept.
+      scratch_dir (str): Directory for temporary full-size files (default: the system temporary directory).
+      in_memory_limit (int): Largest member size in bytes that is decompressed into memory.
+      buffer_size (int): Copy buffer size in bytes.
+      options: Encoding options passed to '_write_subsets'.
+    """
+    if keep_path is not None:
+        _extract_member(zip_path, member, keep_path, buffer_size)
+        _subset_file(keep_path, targets, **options)
+        return
+
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        if member.file_size <= in_memory_limit:
+            # Open the decompressed bytes directly with the netCDF4 library, no disk round trip.
+            nc = netCDF4.Dataset(member.filename, mode="r", memory=zip_ref.read(member))
+            with xr.open_dataset(xr.backends.NetCDF4DataStore(nc)) as ds:
+                _write_subsets(ds, targets, **options)
+            return
+
+        with tempfile.NamedTemporaryFile(suffix=".nc", dir=scratch_dir) as scratch_file:
+            with zip_ref.open(member) as source_file:
+                shutil.copyfileobj(source_file, scratch_file, buffer_size)
+            scratch_file.flush()
+            with xr.open_dataset(scratch_file.name) as ds:
+                _write_subsets(ds, targets, **options)
+
+
+def extract_and_subset_zip_files(data_dir, output_dir, lat_min, lat_max, lon_min, lon_max, workers=4,
+                                 keep_dir=None, scratch_dir=None, in_memory_limit=None,
+                                 buffer_size=DEFAULT_BUFFER_SIZE, compression="zlib", complevel=4,
+                                 time_chunk=DEFAULT_TIME_CHUNK, regions=None, metrics=None):
+    """
+    Fused version of 'extract_zip_files' followed by 'process_netcdf_files'.
+
+    Each ZIP member is decompressed and immediately subset to the target regions, and only the
+    regional files (e.g. "GR_") are written to 'output_dir'. Full-size files are not kept unless 'keep_dir'
+    is given, so scratch disk use is bounded by 'workers' members at a time. Members are processed
+    in a pool of 'workers' processes.
+
+    Parameters:
+      data_dir (str): Directory path where the ZIP files are located.
+      output_dir (str): Directory where the regional NetCDF files will be saved.
+      lat_min (float): Minimum latitude of the target region.
+      lat_max (float): Maximum latitude of the target region.
+      lon_min (float): Minimum longitude of the target region.
+      lon_max (float): Maximum longitude of the target region.
+      workers (int): Number of worker processes (default: 4).
+      keep_dir (str): If given, the full-size extracted files are also saved in this directory.
+      scratch_dir (str): Directory for temporary full-size files of members too large for memory.
+      in_memory_limit (int): Largest member size in bytes that is decompressed into memory by a worker
+        (default: 2 GiB divided by 'workers', so that at most 2 GiB are held at once).
+      buffer_size (int): Copy buffer size in bytes (default: 16 MiB).
+      compression (str): "zlib", "zstd" or None for no compression (default: "zlib").
+      complevel (int): Compression level (default: 4).
+      time_chunk (int): Number of time steps read and written per chunk (default: 720).
+      regions (list): Names of registered regions (see region_subset.REGIONS) cut from every member
+        in one read; if given, they replace the bounds above.
+      metrics (pipeline_metrics.MetricsRecorder): Recorder of one "extract_subset" record per member,
+        measured in its worker (default: None).
+
+    Returns:
+      None
+    """
+    metrics = metrics if metrics is not None else MetricsRecorder()
+    targets = region_targets(lat_min, lat_max, lon_min, lon_max, regions)
+    options = dict(compression=compression, complevel=complevel, time_chunk=time_chunk)
+    if in_memory_limit is None:
+        in_memory_limit = DEFAULT_IN_MEMORY_BUDGET // max(workers, 1)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=SPAWN) as executor:
+        futures = {}
+        for zip_path, member, output_name in _list_zip_members(data_dir):
+            pending = _pending_targets(output_dir, output_name, targets)
+            if not pending:
+                continue
+
+            keep_path = None if keep_dir is None else os.path.join(keep_dir, output_name)
+            future = executor.submit(measure, _extract_and_subset_member, zip_path, member, pending,
+                                     keep_path, scratch_dir, in_memory_limit, buffer_size, **options)
+            futures[future] = (os.path.basename(zip_path), pending)
+
+        for future in as_completed(futures):
+            _, file_metrics = future.result()
+            zip_file, pending = futures[future]
+            metrics.record("extract_subset", file=zip_file, outputs=len(pending), **file_metrics)
+            for _, output_path in pending:
+                print(f"Processed: {zip_file} -> {os.path.basename(output_path)}")
+
+    print("✅ All ZIP files processed successfully!")
+
+
+def regional_encoding(ds, compression="zlib", complevel=4, time_chunk=DEFAULT_TIME_CHUNK):
+    """
+    Builds the NetCDF encoding of a regional subset.
+
+    Variables packed as integers with scale_factor/add_offset in the source keep that packing
+    (instead of being written as decoded floats); all gridded variables are compressed and chunked
+    as (time_chunk, full latitude, full longitude).
+
+    Parameters:
+      ds (xarray.Dataset): Dataset to encode.
+      compression (str): "zlib", "zstd" or None for no compression (default: "zlib").
+      complevel (int): Compression level (default: 4).
+      time_chunk (int): Number of time steps per on-disk chunk (default: 720).
+
+    Returns:
+      dict: Encoding argument for 'Dataset.to_netcdf'.
+    """
+    encoding = {}
+    for name, variable in ds.data_vars.items():
+        var_encoding = {}
+        source = variable.encoding
+        if "scale_factor" in source or "add_offset" in source:
+            for key in ("dtype", "scale_factor", "add_offset", "_FillValue", "missing_value"):
+                if key in source:
+                    var_encoding[key] = source[key]
+        if variable.ndim > 0:
+            if compression is not None:
+                var_encoding.update(compression=compression, complevel=complevel, shuffle=True)
+            var_encoding["chunksizes"] = tuple(
+                min(time_chunk, size) if dim == "valid_time" else size
+                for dim, size in zip(variable.dims, variable.shape)
+            )
+        encoding[name] = var_encoding
+    return encoding
+
+
+def _write_subsets(ds, targets, compression="zlib", complevel=4, time_chunk=DEFAULT_TIME_CHUNK):
+    """
+    Writes the regional subsets of a lazily opened dataset.
+
+    The dataset is subset before any data is read. The union of the regions is wrapped in Dask
+    chunks of 'time_chunk' steps, so each chunk reads one hyperslab of the source and memory use
+    does not grow with the file length; all outputs are computed together, so every chunk of the
+    union is read once however many regions are cut from it. Outputs are written to temporary
+    files that are renamed once all of them are complete.
+
+    Parameters:
+      ds (xarray.Dataset): Lazily opened source dataset.
+      targets (list): (region, output path) pairs, where a region is a registered name or a
+        (lat_min, lat_max, lon_min, lon_max) tuple.
+    """
+    chunks = {"valid_time": time_chunk} if "valid_time" in ds.dims else None
+    ds_regions = subset_many(ds, [region for region, _ in targets], chunks=chunks)
+
+    writes = []
+    try:
+        for ds_region, (_, output_path) in zip(ds_regions, targets):
+            encoding = regional_encoding(ds_region, compression, complevel, time_chunk)
+            writes.append(ds_region.to_netcdf(f"{output_path}.part", encoding=encoding, compute=False))
+        dask.compute(*writes)
+        for _, output_path in targets:
+            os.replace(f"{output_path}.part", output_path)
+    except BaseException:
+        for _, output_path in targets:
+            if os.path.exists(f"{output_path}.part"):
+                os.remove(f"{output_path}.part")
+        raise
+
+
+def _subset_file(file_path, targets, **options):
+    """
+    Writes the regional subsets of one NetCDF file (see '_write_subsets' for the options).
+    """
+    with xr.open_dataset(file_path) as ds:
+        _write_subsets(ds, targets, **options)
+
+
+def process_netcdf_files(extract_dir, output_dir, lat_min, lat_max, lon_min, lon_max, workers=1,
+                         compression="zlib", complevel=4, time_chunk=DEFAULT_TIME_CHUNK, regions=None, metrics=None):
     """
     Processes extracted NetCDF files by subsetting the data to a specified geographic region and saving the results.
 
     The function performs the following steps for each NetCDF file in 'extract_dir':
-      - Loads the NetCDF file using xarray.
-      - Subsets the dataset using the provided latitude and longitude boundaries.
+      - Opens the NetCDF file lazily using xarray.
+      - Subsets the dataset using the provided latitude and longitude boundaries, so that only the
+        region is read from disk, in chunks of 'time_chunk' time steps.
       - Generates an output filename with a prefix (e.g., "GR_") to indicate that the file contains data for a specific region.
-      - Checks if the processed file already exists in 'output_dir'. If it does, skips processing for that file.
-      - Saves the subsetted dataset to the 'output_dir'.
+      - Checks if the processed files already exist in 'output_dir'. If they do, skips processing for that file.
+      - With several 'regions', cuts all of them from a single read of the file.
+      - Saves the subsetted dataset to the 'output_dir', compressed and keeping any integer packing of the source.
     
     Parameters:
       extract_dir (str): Directory containing the extracted NetCDF files.
@@ -146,33 +735,47 @@ def process_netcdf_files(extract_dir, output_dir, lat_min, lat_max, lon_min, lon
       lat_max (float): Maximum latitude of the target region.
       lon_min (float): Minimum longitude of the target region.
       lon_max (float): Maximum longitude of the target region.
+      workers (int): Number of files processed in parallel worker processes (default: 1).
+      compression (str): "zlib", "zstd" or None for no compression (default: "zlib").
+      complevel (int): Compression level (default: 4).
+      time_chunk (int): Number of time steps read and written per chunk (default: 720).
+      regions (list): Names of registered regions (see region_subset.REGIONS) cut from every file
+        in one read; if given, they replace the bounds above.
+      metrics (pipeline_metrics.MetricsRecorder): Recorder of one "subset" record per file, measured
+        in the process that subsets it (default: None).
     
     Returns:
       None
     """
+    metrics = metrics if metrics is not None else MetricsRecorder()
+    targets = region_targets(lat_min, lat_max, lon_min, lon_max, regions)
+    options = dict(compression=compression, complevel=complevel, time_chunk=time_chunk)
+
     # Iterate over all files in the extraction directory.
-    for file in os.listdir(extract_dir):
+    jobs = []
+    for file in sorted(os.listdir(extract_dir)):
         if file.endswith(".nc"):  # Process only NetCDF files.
-            output_filename = f"GR_{file}"
-            output_path = os.path.join(output_dir, output_filename)
-            
-            # Check if the file has already been processed.
-            if os.path.exists(output_path):
-                print(f"File {output_filename} already processed, skipping.")
-                continue
-            
-            file_path = os.path.join(extract_dir, file)
-            
-            # Load the dataset with xarray.
-            ds = xr.open_dataset(file_path)
-            
-            # Subset the dataset using the provided coordinate boundaries.
-            # Note: The order of latitude slicing (lat_max, lat_min) depends on how the data is ordered.
-            ds_region = ds.sel(latitude=slice(lat_max, lat_min), longitude=slice(lon_min, lon_max))
-            
-            # Save the subsetted dataset to a new NetCDF file.
-            ds_region.to_netcdf(output_path)
-            print(f"Processed: {file} -> {output_filename}")
+            # Check which regions of the file have already been processed.
+            pending = _pending_targets(output_dir, file, targets)
+            if pending:
+                jobs.append((file, os.path.join(extract_dir, file), pending))
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=SPAWN) as executor:
+            futures = {executor.submit(measure, _subset_file, file_path, pending, **options): (file, pending)
+                       for file, file_path, pending in jobs}
+            for future in as_completed(futures):
+                _, file_metrics = future.result()
+                file, pending = futures[future]
+                metrics.record("subset", file=file, outputs=len(pending), **file_metrics)
+                for _, output_path in pending:
+                    print(f"Processed: {file} -> {os.path.basename(output_path)}")
+    else:
+        for file, file_path, pending in jobs:
+            _, file_metrics = measure(_subset_file, file_path, pending, **options)
+            metrics.record("subset", file=file, outputs=len(pending), **file_metrics)
+            for _, output_path in pending:
+                print(f"Processed: {file} -> {os.path.basename(output_path)}")
     
     print("✅ All NetCDF files processed successfully!")
 
@@ -181,21 +784,62 @@ if __name__ == "__main__":
     args = parse_args()
 
     # Step 1: Define Paths
-    os.makedirs(args.extract_dir, exist_ok=True)  # Ensure extraction folder exists
+    if not args.fused or args.keep_extracted:
+        os.makedirs(args.extract_dir, exist_ok=True)  # Ensure extraction folder exists
     os.makedirs(args.output_dir, exist_ok=True)  # Ensure output folder exists
 
-    # Step 2: Define Greece Region (Latitude & Longitude Bounds)
-    lat_min, lat_max = 34, 42
-    lon_min, lon_max = 19, 28
+    # Record every stage in the file inventory, if requested
+    inventory = Inventory(args.inventory) if args.inventory else None
+    if inventory is not None:
+        inventory.update_directory(args.data_dir, "download")
+
+    # Step 2: Define Greece Region (Latitude & Longitude Bounds); --regions selects the registered
+    # regions that are actually cut (Greece by default)
+    lat_min, lat_max, lon_min, lon_max = REGIONS["greece"]["bounds"]
+
+    # Stage and per-file metrics go to --metrics_log / --prometheus_file
+    metrics = recorder_from_args(args)
 
     # Step 3: Loop Over ZIP Files and Extract
     # Loop over ZIP files in the data directory
-    extract_zip_files(args.data_dir, args.extract_dir)
-    process_netcdf_files(args.extract_dir, args.output_dir, lat_min, lat_max, lon_min, lon_max)
+    buffer_size = args.buffer_mb * 1024 * 1024
+    compression = None if args.compression == "none" else args.compression
+    if args.fused:
+        # Extract and subset in one pass; full-size files are only kept with --keep_extracted
+        keep_dir = args.extract_dir if args.keep_extracted else None
+        with metrics.stage("extract_subset"):
+            extract_and_subset_zip_files(args.data_dir, args.output_dir, lat_min, lat_max, lon_min, lon_max,
+                                         workers=args.workers, keep_dir=keep_dir, scratch_dir=args.scratch_dir,
+                                         in_memory_limit=args.in_memory_mb * 1024 ** 2 // max(args.workers, 1),
+                                         buffer_size=buffer_size, compression=compression, complevel=args.complevel,
+                                         time_chunk=args.time_chunk, regions=args.regions, metrics=metrics)
+    else:
+        with metrics.stage("extract"):
+            extract_zip_files(args.data_dir, args.extract_dir, workers=args.workers, buffer_size=buffer_size,
+                              metrics=metrics)
+        with metrics.stage("subset"):
+            process_netcdf_files(args.extract_dir, args.output_dir, lat_min, lat_max, lon_min, lon_max,
+                                 workers=args.workers, compression=compression, complevel=args.complevel,
+                                 time_chunk=args.time_chunk, regions=args.regions, metrics=metrics)
+    if inventory is not None:
+        if not args.fused or args.keep_extracted:
+            inventory.update_directory(args.extract_dir, "extracted")
+        inventory.update_directory(args.output_dir, "regional")
 
     # Example usage:
     # data_dir = "/path/to/greece_data"
     output_filename = os.path.join("/home/vvatellis/storage/DoctoralThesis/RepresentationEOcode","GR_merged_filtered.nc")
-    merge_and_filter_nc(args.output_dir, file_pattern="GR_*.nc", filter_hour=19, output_filename=output_filename)
+    with metrics.stage("merge"):
+        merged_path = merge_and_filter_nc(args.output_dir, file_pattern="GR_*.nc", filter_hour=19, output_filename=output_filename,
+                            time_chunk=args.time_chunk, rebuild=args.rebuild_merge, inventory=inventory,
+                            derived={"frequency": args.aggregation_frequency} if args.derived else None,
+                            metrics=metrics)
+    if inventory is not None:
+        # Only the merged outputs are recorded; the rest of their directory is not scanned.
+        derived_paths = [] if not args.derived else \
+            DerivedStage.alongside(merged_path, frequency=args.aggregation_frequency).output_files
+        for path in [merged_path] + derived_paths:
+            inventory.update_file(path, "merged")
+        inventory.close()
 
 
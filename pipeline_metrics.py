@@ -0,0 +1,298 @@
+# Structured metrics of the pipeline: per-stage and per-file timers, I/O, memory and throughput.
+#
+# A MetricsRecorder times stages ('stage', a context manager) and records per-file events
+# ('record'). Every record is appended to a JSON-lines log; with a Prometheus path, the totals
+# per stage are also written in the Prometheus text format, replaced atomically after every
+# record, for the node exporter's textfile collector. Stages can be profiled with cProfile
+# (one .prof file per stage, main thread only) and tracemalloc (peak Python allocations).
+#
+# Bytes read and written come from /proc/self/io and peak resident memory from
+# /proc/self/status (Linux); elsewhere the I/O fields are left out and the peak is the
+# lifetime peak of the process. Only the standard library is used, so importing this module
+# costs nothing.
+
+import os, json, time, threading, contextlib, datetime
+
+# Prefix of the Prometheus metric names.
+DEFAULT_NAMESPACE = "era5_pipeline"
+# Numeric fields of the records that are summed into Prometheus counters.
+SUMMED_FIELDS = ("seconds", "cpu_seconds", "queue_seconds", "transfer_seconds", "read_bytes", "written_bytes",
+                 "points", "time_steps")
+
+
+def io_counters():
+    """
+    Returns the (read, written) byte counters of this process, or None where /proc/self/io is missing.
+    """
+    try:
+        with open("/proc/self/io") as io_file:
+            counters = dict(line.split(":", 1) for line in io_file)
+    except OSError:
+        return None
+    return int(counters["rchar"]), int(counters["wchar"])
+
+
+def reset_peak_rss():
+    """
+    Resets the peak resident set size of this process (Linux), so that 'peak_rss_mb' measures
+    what follows. Returns False where the peak cannot be reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident set size of this process in MiB, since the last 'reset_peak_rss'.
+    """
+    try:
+        with open("/proc/self/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return _max_rss_mb("RUSAGE_SELF")
+
+
+def children_peak_rss_mb():
+    """
+    Returns the largest peak resident set size of the child processes reaped so far (e.g. the
+    workers of a closed process pool) in MiB, or None if no child has been reaped.
+    """
+    return _max_rss_mb("RUSAGE_CHILDREN") or None
+
+
+def _max_rss_mb(who):
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(getattr(resource, who)).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    return peak / 1024 ** 2 if os.uname().sysname == "Darwin" else peak / 1024
+
+
+# Probes running in this process; the peak memory they have seen is carried over when a nested probe resets it.
+_active_probes = []
+
+
+class _Probe:
+    # Wall time, CPU time, I/O and peak memory between 'start' and 'stop'.
+    def start(self):
+        current = peak_rss_mb()
+        for probe in _active_probes:
+            probe.carried_peak = max(probe.carried_peak or 0, current or 0)
+        reset_peak_rss()
+        self.carried_peak = None
+        _active_probes.append(self)
+        self.io = io_counters()
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def stop(self):
+        _active_probes.remove(self)
+        peak = peak_rss_mb()
+        if self.carried_peak is not None and peak is not None:
+            peak = max(peak, self.carried_peak)
+        metrics = {"seconds": time.perf_counter() - self.wall, "cpu_seconds": time.process_time() - self.cpu,
+                   "peak_rss_mb": peak}
+        children_peak = children_peak_rss_mb()
+        if children_peak is not None:
+            metrics["children_peak_rss_mb"] = children_peak
+        io = io_counters()
+        if io is not None and self.io is not None:
+            metrics["read_bytes"] = io[0] - self.io[0]
+            metrics["written_bytes"] = io[1] - self.io[1]
+        return metrics
+
+
+def measure(function, *args, **kwargs):
+    """
+    Calls 'function' and measures it, e.g. in a worker process, whose I/O counters and peak
+    memory then belong to the call alone.
+
+    Returns:
+      tuple: (result, metrics) where metrics has 'seconds', 'cpu_seconds', 'peak_rss_mb' and,
+      on Linux, 'read_bytes' and 'written_bytes'.
+    """
+    probe = _Probe().start()
+    result = function(*args, **kwargs)
+    return result, probe.stop()
+
+
+def _throughput(fields):
+    # Derived rates of a record.
+    seconds = fields.get("seconds")
+    if seconds and "points" in fields:
+        fields["points_per_second"] = fields["points"] / seconds
+
+
+class MetricsRecorder:
+    def __init__(self, log_path=None, prometheus_path=None, profile_dir=None, trace_memory=False,
+                 namespace=DEFAULT_NAMESPACE):
+        """
+        Initialize the recorder. Without any path, records are only kept in memory ('records').
+
+        Parameters:
+          log_path (str): JSON-lines file the records are appended to (default: None).
+          prometheus_path (str): Prometheus text file (e.g. "<textfile dir>/era5_pipeline.prom")
+            rewritten after every record (default: None).
+          profile_dir (str): Directory of the cProfile output of every stage ("<stage>-<pid>-<n>.prof",
+            readable with pstats or snakeviz) (default: None, which does not profile).
+          trace_memory (bool): Record the peak of Python allocations of every stage with tracemalloc
+            (slows the stages down) (default: False).
+          namespace (str): Prefix of the Prometheus metric names (default: "era5_pipeline").
+        """
+        self.log_path = log_path
+        self.prometheus_path = prometheus_path
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+        self.namespace = namespace
+        self.records = []
+        self._totals = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._profiles = 0
+        for path in (log_path, prometheus_path):
+            if path is not None and os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+        if profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def _write(self, record):
+        with self._lock:
+            self.records.append(record)
+            if self.log_path is not None:
+                with open(self.log_path, "a") as log_file:
+                    log_file.write(json.dumps(record, default=str) + "\n")
+
+            kind, labels = record["event"], {"stage": record["stage"]}
+            key = tuple(sorted(labels.items()))
+            count_name = "stage_runs_total" if kind == "stage" else "files_total"
+            self._totals[(count_name, key)] = self._totals.get((count_name, key), 0) + 1
+            for field in SUMMED_FIELDS:
+                if isinstance(record.get(field), (int, float)):
+                    name = f"{kind}_{field}_total"
+                    self._totals[(name, key)] = self._totals.get((name, key), 0) + record[field]
+            if kind == "stage":
+                for field, name, scale in (("peak_rss_mb", "peak_rss_bytes", 1024 ** 2),
+                                           ("children_peak_rss_mb", "children_peak_rss_bytes", 1024 ** 2),
+                                           ("traced_peak_mb", "traced_peak_bytes", 1024 ** 2),
+                                           ("points_per_second", "points_per_second", 1)):
+                    if isinstance(record.get(field), (int, float)):
+                        self._gauges[(f"stage_{name}", key)] = record[field] * scale
+                self._gauges[("stage_last_success", key)] = int(record["status"] == "ok")
+            self._gauges[("last_record_timestamp_seconds", ())] = time.time()
+            if self.prometheus_path is not None:
+                self._write_prometheus()
+
+    def _write_prometheus(self):
+        # Called with the lock held; one TYPE line per metric, then its samples.
+        lines = []
+        for metrics, metric_type in ((self._totals, "counter"), (self._gauges, "gauge")):
+            for name in sorted({name for name, _ in metrics}):
+                full_name = f"{self.namespace}_{name}"
+                lines.append(f"# TYPE {full_name} {metric_type}")
+                for (sample_name, labels), value in sorted(metrics.items(), key=lambda item: item[0]):
+                    if sample_name != name:
+                        continue
+                    label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+                    sample = f"{full_name}{{{label_text}}}" if label_text else full_name
+                    lines.append(f"{sample} {float(value)!r}")
+        tmp_path = f"{self.prometheus_path}.part"
+        with open(tmp_path, "w") as prometheus_file:
+            prometheus_file.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.prometheus_path)
+
+    def record(self, stage, **fields):
+        """
+        Records one file (or job) of a stage, e.g. record("interpolate", file=name, seconds=12.5, points=...).
+        Rates such as 'points_per_second' are added from the fields.
+        """
+        record = {"time": datetime.datetime.now().isoformat(timespec="seconds"), "event": "file", "stage": stage}
+        record.update(fields)
+        _throughput(record)
+        self._write(record)
+        return record
+
+    @contextlib.contextmanager
+    def stage(self, name, **fields):
+        """
+        Times a stage of the pipeline:
+
+            with metrics.stage("merge") as record:
+                ...
+                record["time_steps"] = n
+
+        The yielded record can be extended by the body; its timers, I/O counters and peak memory
+        (see 'measure') are added on exit, with a status of "ok" or "error".
+        """
+        record = {"time": datetime.datetime.now().isoformat(timespec="seconds"), "event": "stage", "stage": name}
+        record.update(fields)
+        profiler = tracing = None
+        if self.profile_dir is not None:
+            import cProfile
+
+            profiler = cProfile.Profile()
+        if self.trace_memory:
+            import tracemalloc
+
+            tracing = not tracemalloc.is_tracing()
+            if tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        probe = _Probe().start()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+            record["status"] = "ok"
+        except BaseException as error:
+            record["status"] = "error"
+            record["error"] = repr(error)
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                with self._lock:
+                    self._profiles += 1
+                    profile_path = os.path.join(self.profile_dir, f"{name}-{os.getpid()}-{self._profiles}.prof")
+                profiler.dump_stats(profile_path)
+                record["profile"] = profile_path
+            record.update(probe.stop())
+            if self.trace_memory:
+                import tracemalloc
+
+                record["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+                if tracing:
+                    tracemalloc.stop()
+            _throughput(record)
+            self._write(record)
+
+
+def add_metrics_arguments(parser):
+    """
+    Adds the --metrics_log, --prometheus_file, --profile_dir and --trace_memory options to a parser.
+    """
+    parser.add_argument("--metrics_log", type=str, default=None,
+                        help="JSON-lines file the per-stage and per-file metrics are appended to")
+    parser.add_argument("--prometheus_file", type=str, default=None,
+                        help="Prometheus text file (for the node exporter textfile collector) updated with the metrics")
+    parser.add_argument("--profile_dir", type=str, default=None,
+                        help="Directory where a cProfile file of every stage is written")
+    parser.add_argument("--trace_memory", action="store_true",
+                        help="Record the peak Python allocations of every stage with tracemalloc")
+
+
+def recorder_from_args(args):
+    """
+    Returns the MetricsRecorder configured by the options of 'add_metrics_arguments'.
+    """
+    return MetricsRecorder(log_path=args.metrics_log, prometheus_path=args.prometheus_file,
+                           profile_dir=args.profile_dir, trace_memory=args.trace_memory)
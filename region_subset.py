@@ -0,0 +1,174 @@
+# Region-aware subsetting of regular latitude/longitude grids.
+#
+# The ordering of the latitudes (ascending or descending) and the longitude convention (0-360 or
+# -180-180) are detected once per grid. A region is then turned into integer index slices, so
+# every read is a contiguous hyperslab, including boxes that cross the 0 or 180 degree meridian of
+# the grid. Several regions can be cut from a single read of their union.
+
+import hashlib
+import numpy as np
+import xarray as xr
+
+# Named regions: output file prefix and (lat_min, lat_max, lon_min, lon_max) bounds in degrees.
+# Longitudes may be given in either convention; lon_min > lon_max is not allowed, use e.g.
+# (-10, 10) or (350, 370) for a box crossing the prime meridian.
+REGIONS = {
+    "greece": {"prefix": "GR", "bounds": (34, 42, 19, 28)},
+}
+
+# Tolerance used when comparing coordinates with region bounds.
+EPSILON = 1e-9
+
+_subsetters = {}
+
+
+def register_region(name, bounds, prefix):
+    """
+    Adds a named region to the registry.
+
+    Parameters:
+      name (str): Region name.
+      bounds (tuple): (lat_min, lat_max, lon_min, lon_max) in degrees.
+      prefix (str): Prefix of the output files of the region (e.g. "GR").
+    """
+    REGIONS[name] = {"prefix": prefix, "bounds": tuple(bounds)}
+
+
+def resolve_region(region):
+    """
+    Returns the (lat_min, lat_max, lon_min, lon_max) bounds of a region name or bounds tuple.
+    """
+    if isinstance(region, str):
+        if region not in REGIONS:
+            raise ValueError(f"Unknown region '{region}'. Known regions: {', '.join(sorted(REGIONS))}.")
+        return REGIONS[region]["bounds"]
+    lat_min, lat_max, lon_min, lon_max = region
+    if lat_min > lat_max or lon_min > lon_max:
+        raise ValueError(f"Invalid region bounds {region}: expected (lat_min, lat_max, lon_min, lon_max).")
+    return tuple(region)
+
+
+def _runs(indices):
+    # Splits sorted positions into slices of consecutive indices.
+    breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+    return [slice(int(run[0]), int(run[-1]) + 1) for run in np.split(indices, breaks)]
+
+
+class GridSubsetter:
+    def __init__(self, lat, lon):
+        """
+        Analyse a regular grid once.
+
+        Parameters:
+          lat (array-like): Latitudes, ascending or descending.
+          lon (array-like): Longitudes, ascending, in the 0-360 or -180-180 convention.
+        """
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.lat_ascending = bool(self.lat.size < 2 or self.lat[1] > self.lat[0])
+        # Longitudes on [0, 360), used to locate boxes given in either convention.
+        self.lon_360 = np.mod(self.lon, 360.0)
+
+    def indices(self, region):
+        """
+        Locate a region on the grid.
+
+        Returns:
+          tuple: (lat_index, lon_index, lon_values): integer positions of the region's latitudes
+            (in grid order) and longitudes (ordered west to east), and the longitudes of the region
+            expressed in the convention of its bounds.
+        """
+        lat_min, lat_max, lon_min, lon_max = resolve_region(region)
+        lat_index = np.flatnonzero((self.lat >= lat_min - EPSILON) & (self.lat <= lat_max + EPSILON))
+
+        if lon_max - lon_min >= 360.0 - EPSILON:
+            offset = np.mod(self.lon_360 - np.mod(lon_min, 360.0), 360.0)
+        else:
+            # Distance east of the western edge, which handles boxes crossing 0 or 180 degrees.
+            offset = np.mod(self.lon_360 - np.mod(lon_min, 360.0) + EPSILON, 360.0) - EPSILON
+            offset[offset > lon_max - lon_min + EPSILON] = np.nan
+        candidates = np.flatnonzero(~np.isnan(offset))
+        lon_index = candidates[np.argsort(offset[candidates], kind="stable")]
+        # Source longitudes shifted by whole turns into the convention of the bounds.
+        turns = np.round((lon_min + offset[lon_index] - self.lon[lon_index]) / 360.0)
+        lon_values = self.lon[lon_index] + 360.0 * turns
+
+        if lat_index.size == 0 or lon_index.size == 0:
+            raise ValueError(f"Region {region} does not overlap the grid "
+                             f"(latitudes {self.lat.min()}-{self.lat.max()}, "
+                             f"longitudes {self.lon.min()}-{self.lon.max()}).")
+        return lat_index, lon_index, lon_values
+
+    def slices(self, region):
+        """
+        Return the region as index slices: one latitude slice and one or more longitude slices,
+        each a contiguous hyperslab of the grid.
+        """
+        lat_index, lon_index, _ = self.indices(region)
+        return slice(int(lat_index[0]), int(lat_index[-1]) + 1), _runs(lon_index)
+
+
+def subsetter_for(ds):
+    """
+    Returns the GridSubsetter of a dataset's grid, analysing each distinct grid only once.
+    """
+    lat = ds["latitude"].values
+    lon = ds["longitude"].values
+    key = hashlib.sha1(lat.tobytes() + b"|" + lon.tobytes()).hexdigest()
+    if key not in _subsetters:
+        _subsetters[key] = GridSubsetter(lat, lon)
+    return _subsetters[key]
+
+
+def _select(ds, lat_slice, lon_runs):
+    pieces = [ds.isel(latitude=lat_slice, longitude=run) for run in lon_runs]
+    return pieces[0] if len(pieces) == 1 else xr.concat(pieces, dim="longitude")
+
+
+def subset(ds, region):
+    """
+    Cut one region out of a dataset; the selection is lazy and reads contiguous hyperslabs.
+
+    Parameters:
+      ds (xarray.Dataset): Dataset with 'latitude' and 'longitude' coordinates.
+      region (str or tuple): Region name from REGIONS, or (lat_min, lat_max, lon_min, lon_max).
+
+    Returns:
+      xarray.Dataset: The region, with longitudes in the convention of the region's bounds.
+    """
+    return subset_many(ds, [region])[0]
+
+
+def subset_many(ds, regions, chunks=None):
+    """
+    Cut several regions out of a dataset from a single read of their union.
+
+    The union of the regions is selected once (as contiguous hyperslabs) and every region is
+    taken from it. With 'chunks', the union is wrapped in Dask chunks before the regions are cut,
+    so when the results are computed together (e.g. with dask.compute), each chunk of the union
+    is read only once.
+
+    Parameters:
+      ds (xarray.Dataset): Dataset with 'latitude' and 'longitude' coordinates.
+      regions (list): Region names from REGIONS or (lat_min, lat_max, lon_min, lon_max) tuples.
+      chunks (dict): Optional Dask chunks of the union, e.g. {"valid_time": 720}.
+
+    Returns:
+      list: One xarray.Dataset per region, in the order of 'regions'.
+    """
+    subsetter = subsetter_for(ds)
+    located = [subsetter.indices(region) for region in regions]
+
+    union_lat = np.arange(min(lat[0] for lat, _, _ in located), max(lat[-1] for lat, _, _ in located) + 1)
+    union_lon = np.unique(np.concatenate([lon for _, lon, _ in located]))
+    union = _select(ds, slice(int(union_lat[0]), int(union_lat[-1]) + 1), _runs(union_lon))
+    if chunks is not None:
+        union = union.chunk(chunks)
+
+    results = []
+    for lat_index, lon_index, lon_values in located:
+        region_ds = union.isel(latitude=lat_index - union_lat[0],
+                               longitude=np.searchsorted(union_lon, lon_index))
+        lon_values = lon_values.astype(ds["longitude"].dtype)
+        results.append(region_ds.assign_coords(longitude=("longitude", lon_values, ds["longitude"].attrs)))
+    return results